@@ -0,0 +1,179 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import singledispatchmethod
+from time import perf_counter_ns
+from typing import Any, Iterator
+import json
+
+# ヒストグラムのバケット数: バケット k は 2^(k-1) <= 処理時間 (ns) < 2^k
+BUCKETS = 40
+
+PERCENTILES = (50, 90, 99)
+
+
+# 1つの (プロジェクション, イベント種別) の計測値
+@dataclass
+class ApplyStats:
+    calls: int = 0
+    total_ns: int = 0
+    max_ns: int = 0
+    histogram: list[int] = field(default_factory=lambda: [0] * BUCKETS)
+
+    def merge(self, other: "ApplyStats"):
+        self.calls += other.calls
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    # パーセンタイル (ns)。ヒストグラムのバケットの上限で近似する
+    def percentile(self, p: float) -> int:
+        threshold = self.calls * p / 100
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= threshold:
+                return min(2 ** bucket, self.max_ns)
+        return self.max_ns
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "total_ns": self.total_ns,
+            "mean_ns": self.total_ns / self.calls if self.calls else 0.0,
+            "max_ns": self.max_ns,
+            **{f"p{p}_ns": self.percentile(p) for p in PERCENTILES},
+            # バケットの上限 (ns) -> 件数
+            "histogram": {2 ** bucket: count for bucket, count in enumerate(self.histogram) if count},
+        }
+
+
+#################################################
+# Profiler
+#################################################
+
+# プロジェクションの apply をイベント種別ごとに計測するプロファイラ
+# NOTE: profiling() の間だけクラスの apply を計測付きの関数に差し替え、抜けると元の singledispatchmethod に戻す。
+#       無効なとき (profiling() の外) は apply に何も挟まないので、オーバーヘッドはない。
+#       trusted_replay のように singledispatch の登録を直接引くリプレイは計測されない
+class ApplyProfiler:
+    def __init__(self):
+        # (プロジェクション名, イベント種別名) -> 計測値
+        self.stats: dict[tuple[str, str], ApplyStats] = {}
+
+    @staticmethod
+    def projection_name(projection_class: type) -> str:
+        # NOTE: 同じ名前のプロジェクション (LeadStateModelProjection) がモジュールごとにあるのでモジュール名を付ける
+        return f"{projection_class.__module__}.{projection_class.__qualname__}"
+
+    @contextmanager
+    def profiling(self, *projection_classes: type) -> Iterator["ApplyProfiler"]:
+        originals = {}
+        try:
+            for projection_class in projection_classes:
+                original = projection_class.__dict__.get("apply")
+                if not isinstance(original, singledispatchmethod):
+                    raise TypeError(f"{projection_class.__qualname__}.apply is not a singledispatchmethod")
+                originals[projection_class] = original
+                setattr(projection_class, "apply", self._timed_apply(projection_class, original))
+            yield self
+        finally:
+            for projection_class, original in originals.items():
+                setattr(projection_class, "apply", original)
+
+    def _timed_apply(self, projection_class: type, original: singledispatchmethod):
+        dispatch = original.dispatcher.dispatch
+        name = self.projection_name(projection_class)
+        stats = self.stats
+        by_event_class: dict[type, ApplyStats] = {}
+
+        def apply(projection, event):
+            event_class = type(event)
+            handler = dispatch(event_class)
+            start = perf_counter_ns()
+            handler(projection, event)
+            elapsed = perf_counter_ns() - start
+            entry = by_event_class.get(event_class)
+            if entry is None:
+                entry = by_event_class[event_class] = stats.setdefault((name, event_class.__name__), ApplyStats())
+            entry.calls += 1
+            entry.total_ns += elapsed
+            if elapsed > entry.max_ns:
+                entry.max_ns = elapsed
+            entry.histogram[min(elapsed.bit_length(), BUCKETS - 1)] += 1
+
+        return apply
+
+    # 別プロセス (projection_rebuild のワーカー) で計測した値を足し込む
+    def merge(self, stats: dict[tuple[str, str], ApplyStats]):
+        for key, value in stats.items():
+            self.stats.setdefault(key, ApplyStats()).merge(value)
+
+    def to_dict(self) -> dict[str, dict[str, dict[str, Any]]]:
+        report: dict[str, dict[str, dict[str, Any]]] = {}
+        for (projection, event_type), value in sorted(self.stats.items()):
+            report.setdefault(projection, {})[event_type] = value.to_dict()
+        return report
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    # プロジェクションごとに、合計時間の多いイベント種別から並べる
+    def to_text(self) -> str:
+        lines = []
+        for projection, by_event_type in self.to_dict().items():
+            total_ns = sum(value["total_ns"] for value in by_event_type.values()) or 1
+            lines.append(projection)
+            lines.append(f"  {'event type':<28} {'calls':>10} {'total ms':>10} {'share':>6} {'mean us':>8} "
+                         + " ".join(f"{f'p{p} us':>8}" for p in PERCENTILES) + f" {'max us':>8}")
+            for event_type, value in sorted(by_event_type.items(), key=lambda item: -item[1]["total_ns"]):
+                lines.append(
+                    f"  {event_type:<28} {value['calls']:>10,} {value['total_ns'] / 1e6:>10.1f} "
+                    f"{value['total_ns'] / total_ns:>6.1%} {value['mean_ns'] / 1e3:>8.2f} "
+                    + " ".join(f"{value[f'p{p}_ns'] / 1e3:>8.2f}" for p in PERCENTILES)
+                    + f" {value['max_ns'] / 1e3:>8.1f}"
+                )
+        return "\n".join(lines)
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_json())
+
+
+if __name__ == "__main__":
+    # 使い方: python apply_profiler.py [リード数]
+    import sys
+    import time
+
+    from benchmarks.lead_generator import generate_events
+    from event_decoder import decode_records
+    import event_sourcing
+    import event_sourcing_analysis
+
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    events = list(decode_records(generate_events(leads, 10)))
+    projection_classes = (event_sourcing.LeadStateModelProjection, event_sourcing_analysis.LeadStateModelProjection)
+
+    def replay(projection_class) -> dict:
+        projections: dict = {}
+        for event in events:
+            projection = projections.get(event.lead_id)
+            if projection is None:
+                projection = projections[event.lead_id] = projection_class.empty()
+            projection.apply(event)
+        return projections
+
+    profiler = ApplyProfiler()
+    for projection_class in projection_classes:
+        start = time.perf_counter()
+        expected = replay(projection_class)
+        disabled = time.perf_counter() - start
+        with profiler.profiling(projection_class):
+            start = time.perf_counter()
+            profiled = replay(projection_class)
+            enabled = time.perf_counter() - start
+        assert profiled == expected
+        # 計測を抜けたら元の apply に戻っている
+        assert isinstance(projection_class.__dict__["apply"], singledispatchmethod)
+        print(f"{ApplyProfiler.projection_name(projection_class)}: disabled={disabled:.2f}s enabled={enabled:.2f}s")
+
+    print(profiler.to_text())
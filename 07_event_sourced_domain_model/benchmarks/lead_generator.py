@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta, timezone
+from heapq import merge
+from typing import Any, Iterator
+import random
+
+from lead_events import LeadStatusEnum
+
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+FAMILY_NAMES = ["小林", "佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "加藤"]
+GIVEN_NAMES = ["浩美", "裕美", "博美", "健太", "翔太", "美咲", "陽菜", "大輝", "結衣", "蓮", "葵", "悠真"]
+
+# 状態ごとに次に起こりうるイベントと重み
+# NOTE: 注文受領 -> 支払完了 はリードの最後に置くので、ここには含めない
+TRANSITIONS: dict[LeadStatusEnum, list[tuple[str, int]]] = {
+    LeadStatusEnum.NEW_LEAD: [("架電", 6), ("商談予定設定", 3), ("連絡先変更", 1)],
+    LeadStatusEnum.FOLLOWUP_SET: [("架電", 5), ("商談予定設定", 4), ("連絡先変更", 1)],
+}
+
+# イベント種別 -> 適用後の状態 (None は状態を変えない)
+NEXT_STATUS: dict[str, LeadStatusEnum | None] = {
+    "架電": None,
+    "商談予定設定": LeadStatusEnum.FOLLOWUP_SET,
+    "連絡先変更": None,
+    "注文受領": LeadStatusEnum.PENDING_PAYMENT,
+    "支払完了": LeadStatusEnum.CONVERTED,
+}
+
+
+def _name(rng: random.Random) -> str:
+    return rng.choice(FAMILY_NAMES) + rng.choice(GIVEN_NAMES)
+
+
+def _phone_number(rng: random.Random) -> str:
+    return f"{rng.randint(0, 999):03d}-{rng.randint(0, 9999):04d}"
+
+
+def _timestamp(value: datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-4] + "Z"  # events.json と同じ 1/100 秒の精度
+
+
+# 1リード分のライフサイクル (events.json と同じ形式のレコード)
+# NOTE: 新規登録から始まり、LeadStatusEnum の遷移に沿って events_per_lead 件のイベントを作る。
+#       conversion_rate の確率で最後の2件が 注文受領 -> 支払完了 になる
+def generate_lead(
+    lead_id: int, events_per_lead: int, rng: random.Random, conversion_rate: float = 0.3
+) -> list[dict[str, Any]]:
+    timestamp = START + timedelta(seconds=rng.randrange(365 * 86400))
+    records = [{
+        "lead-id": lead_id, "event-id": 0, "event-type": "新規登録", "timestamp": _timestamp(timestamp),
+        "name": _name(rng), "phone-number": _phone_number(rng),
+    }]
+    status = LeadStatusEnum.NEW_LEAD
+    converts = events_per_lead >= 3 and rng.random() < conversion_rate
+    for event_id in range(1, events_per_lead):
+        remaining = events_per_lead - event_id
+        if converts and remaining <= 2:
+            event_type = "注文受領" if remaining == 2 else "支払完了"
+        else:
+            choices, weights = zip(*TRANSITIONS[status])
+            event_type = rng.choices(choices, weights)[0]
+        timestamp += timedelta(seconds=rng.randrange(60, 3 * 86400), milliseconds=rng.randrange(100) * 10)
+        record: dict[str, Any] = {
+            "lead-id": lead_id, "event-id": event_id, "event-type": event_type, "timestamp": _timestamp(timestamp),
+        }
+        if event_type == "連絡先変更":
+            record["name"] = _name(rng)
+            record["phone-number"] = _phone_number(rng)
+        records.append(record)
+        status = NEXT_STATUS[event_type] or status
+    return records
+
+
+# leads 件のリードのイベントを、全体の時刻順に並べて返す
+def generate_events(
+    leads: int, events_per_lead: int, seed: int = 0, conversion_rate: float = 0.3
+) -> Iterator[dict[str, Any]]:
+    rng = random.Random(seed)
+    lifecycles = [generate_lead(lead_id, events_per_lead, rng, conversion_rate) for lead_id in range(leads)]
+    # NOTE: タイムスタンプは同じ形式の文字列なので、文字列の比較で時刻順になる
+    return merge(*lifecycles, key=lambda record: record["timestamp"])
+
+
+if __name__ == "__main__":
+    # 使い方: python -m benchmarks.lead_generator [リード数] [1リードあたりのイベント数] > events.ndjson
+    import json
+    import sys
+
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000
+    events_per_lead = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    for record in generate_events(leads, events_per_lead):
+        print(json.dumps(record, ensure_ascii=False))
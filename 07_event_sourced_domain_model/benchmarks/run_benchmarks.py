@@ -0,0 +1,149 @@
+from datetime import datetime, timezone
+from typing import Any, Callable
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.lead_generator import generate_events
+from event_decoder import decode_json, decode_records
+from event_loader import peak_rss_bytes
+from lazy_events import decode_lazy, event_fields_of, replay_lazy
+from projection_daemon import CatchUpProjector, NdjsonEventSource
+from projection_rebuild import LeadProjection, rebuild_shard
+import event_sourcing
+import event_sourcing_analysis
+import event_sourcing_search
+
+PROJECTIONS: dict[str, type[LeadProjection]] = {
+    "base": event_sourcing.LeadStateModelProjection,
+    "analysis": event_sourcing_analysis.LeadStateModelProjection,
+    "search": event_sourcing_search.LeadStateModelProjection,
+}
+
+
+# fn を repeat 回実行し、最短の経過時間 (秒) を返す
+def best_of(fn: Callable[[], Any], repeat: int) -> float:
+    elapsed = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed)
+
+
+# リードごとにプロジェクションを作って apply する (デコード済みのイベント)
+def apply_all(projection_class, events) -> dict:
+    projections: dict = {}
+    for event in events:
+        projection = projections.get(event.lead_id)
+        if projection is None:
+            projection = projections[event.lead_id] = projection_class.empty()
+        projection.apply(event)
+    return projections
+
+
+# リードごとにイベントをまとめ、lazy + trusted replay で再構築する (NDJSON の行から)
+def replay_lazy_all(projection_class, lines) -> dict:
+    streams: dict = {}
+    for event in decode_lazy(lines, event_fields_of(projection_class)):
+        streams.setdefault(event.lead_id, []).append(event)
+    return {lead_id: replay_lazy(projection_class.empty(), stream) for lead_id, stream in streams.items()}
+
+
+def run(leads: int, events_per_lead: int, repeat: int = 3) -> dict[str, Any]:
+    records = list(generate_events(leads, events_per_lead))
+    data = json.dumps(records, ensure_ascii=False).encode("utf-8")
+    lines = [json.dumps(record, ensure_ascii=False).encode("utf-8") for record in records]
+    events = decode_json(data)
+    count = len(events)
+    results: dict[str, dict[str, Any]] = {}
+
+    def throughput(name: str, elapsed: float, **extra: Any):
+        results[name] = {"seconds": elapsed, "events_per_sec": count / elapsed, **extra}
+        print(f"{name:<28} {elapsed:8.3f}s {count / elapsed:>12,.0f} events/sec", file=sys.stderr)
+
+    # デコード
+    throughput("decode.json_array", best_of(lambda: decode_json(data), repeat))
+    throughput("decode.records", best_of(lambda: list(decode_records(records)), repeat))
+    throughput("decode.lazy_all_fields", best_of(lambda: list(decode_lazy(lines)), repeat))
+
+    # プロジェクションごとの apply (リードごと)
+    for name, projection_class in PROJECTIONS.items():
+        throughput(f"apply.{name}", best_of(lambda: apply_all(projection_class, events), repeat))
+
+    # デコード込みの再構築 (どちらもリードごとにプロジェクションを作るので rebuild.base と比べられる)
+    base = event_sourcing.LeadStateModelProjection
+    throughput("rebuild.base", best_of(lambda: rebuild_shard(base, records), repeat))
+    throughput("replay.lazy_trusted.base", best_of(lambda: replay_lazy_all(base, lines), repeat))
+
+    # スナップショット (リードモデルの保存ファイル) からのウォームスタート
+    with tempfile.TemporaryDirectory() as directory:
+        events_path = os.path.join(directory, "events.ndjson")
+        with open(events_path, "wb") as f:
+            f.writelines(line + b"\n" for line in lines)
+        state_path = os.path.join(directory, "read_models.pickle")
+        projector = CatchUpProjector(NdjsonEventSource(events_path), PROJECTIONS, state_path)
+        projector.read_models = {name: apply_all(projection_class, events) for name, projection_class in PROJECTIONS.items()}
+        projector.save()
+
+        def load():
+            CatchUpProjector(NdjsonEventSource(events_path), PROJECTIONS, state_path).load()
+
+        throughput("snapshot.load", best_of(load, repeat), bytes=os.path.getsize(state_path))
+
+    # ピークメモリ (tracemalloc): デコード + 全プロジェクションの apply
+    # NOTE: 計測開始後に確保したメモリだけが対象になる
+    gc.collect()
+    tracemalloc.start()
+    decoded = decode_json(data)
+    read_models = {name: apply_all(projection_class, decoded) for name, projection_class in PROJECTIONS.items()}
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del decoded, read_models
+    results["memory.decode_and_apply"] = {"peak_bytes": peak, "bytes_per_event": peak / count}
+    print(f"{'memory.decode_and_apply':<28} peak={peak / 1024 / 1024:.1f}MiB ({peak / count:.0f} bytes/event)", file=sys.stderr)
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {"leads": leads, "events_per_lead": events_per_lead, "events": count, "repeat": repeat},
+        "peak_rss_bytes": peak_rss_bytes(),
+        "results": results,
+    }
+
+
+# 前回の結果と比べて、シナリオごとの変化を表示する
+def compare(previous: dict[str, Any], current: dict[str, Any]) -> list[str]:
+    lines = []
+    for name, result in current["results"].items():
+        before = previous["results"].get(name)
+        if before is None:
+            continue
+        metric = "seconds" if "seconds" in result else "peak_bytes"
+        change = result[metric] / before[metric] - 1
+        lines.append(f"{name:<28} {metric:<10} {change:+7.1%}")
+    return lines
+
+
+if __name__ == "__main__":
+    # 使い方: cd 07_event_sourced_domain_model && python -m benchmarks.run_benchmarks [リード数] [1リードあたりのイベント数] [出力ファイル] [比較する前回の結果]
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    events_per_lead = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    output = sys.argv[3] if len(sys.argv) > 3 else "benchmark_results.json"
+    baseline = sys.argv[4] if len(sys.argv) > 4 else None
+
+    report = run(leads, events_per_lead)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"results: {output}", file=sys.stderr)
+
+    if baseline:
+        with open(baseline, "r", encoding="utf-8") as f:
+            print("\n".join(compare(json.load(f), report)))
@@ -0,0 +1,225 @@
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Iterator
+import struct
+
+from columnar_event_log import EVENT_CLASSES, EVENT_CODES, from_epoch_micros, to_epoch_micros
+from event_decoder import lead_id_of
+from event_sourcing_domain_model import EVENT_TYPES as TICKET_EVENT_TYPES, DomainEvent
+from lead_events import ContactDetailsChangedEvent, LeadEvent, LeadInitializedEvent, Name, PhoneNumber
+
+# 現在のスキーマバージョン (各レコードの先頭1byte)
+# NOTE: レイアウトを変えたらバージョンを上げ、古いバージョンを1つ新しいレイアウトに変換するアップキャスターを
+#       LEAD_UPCASTERS / TICKET_UPCASTERS に登録する (旧バージョン -> 関数)。
+#       例: 時刻をミリ秒からマイクロ秒に変えて v2 にするなら、v1 のレコードの時刻を1000倍して先頭を 2 にする関数を 1 に登録する
+SCHEMA_VERSION = 1
+
+# flags のビット
+AWARE = 0x01  # タイムゾーン付きの時刻 (UTCに正規化して保存)。立っていなければナイーブな時刻
+
+# 文字列: 長さ (4byte) + UTF-8
+STRING_LENGTH = struct.Struct("<I")
+
+# 複数イベントを続けて書くときのレコード長 (4byte)
+FRAME = struct.Struct("<I")
+
+Upcaster = Callable[[bytes], bytes]
+
+
+def _flags(timestamp: datetime) -> int:
+    return AWARE if timestamp.tzinfo is not None else 0
+
+
+def _timestamp(micros: int, flags: int) -> datetime:
+    timestamp = from_epoch_micros(micros)
+    return timestamp if flags & AWARE else timestamp.replace(tzinfo=None)
+
+
+def _pack_string(buffer: bytearray, value: str):
+    data = value.encode("utf-8")
+    buffer += STRING_LENGTH.pack(len(data))
+    buffer += data
+
+
+def _unpack_string(data: bytes, offset: int) -> tuple[str, int]:
+    (length,) = STRING_LENGTH.unpack_from(data, offset)
+    offset += STRING_LENGTH.size
+    return data[offset:offset + length].decode("utf-8"), offset + length
+
+
+# 古いバージョンのレコードを SCHEMA_VERSION まで順に変換する
+def _upcast(data: bytes, upcasters: dict[int, Upcaster]) -> bytes:
+    while (version := data[0]) != SCHEMA_VERSION:
+        upcaster = upcasters.get(version)
+        if upcaster is None:
+            raise ValueError(f"Unsupported schema version: {version}")
+        data = upcaster(data)
+    return data
+
+
+#################################################
+# LeadEvent
+#################################################
+# レイアウト (v1):
+#   ヘッダ: バージョン (1) | 種別コード (1) | flags (1) | event_id (8) | タイムスタンプ (エポックマイクロ秒, 8)
+#   本体  : lead_id (文字列) [| name (文字列) | phone_number (文字列)]  ※ 新規登録・連絡先変更のみ
+
+LEAD_HEADER = struct.Struct("<BBBqq")
+
+# 氏名・電話番号を持つイベントと、その種別コード
+_CONTACT_DETAILS_EVENTS = (LeadInitializedEvent, ContactDetailsChangedEvent)
+_CONTACT_DETAILS_CODES = frozenset(EVENT_CODES[event_class] for event_class in _CONTACT_DETAILS_EVENTS)
+
+
+def encode_lead_event(event: LeadEvent) -> bytes:
+    code = EVENT_CODES[type(event)]
+    buffer = bytearray(LEAD_HEADER.pack(
+        SCHEMA_VERSION, code, _flags(event.timestamp), event.event_id, to_epoch_micros(event.timestamp)
+    ))
+    _pack_string(buffer, event.lead_id.value)
+    if isinstance(event, _CONTACT_DETAILS_EVENTS):
+        _pack_string(buffer, event.name.value)
+        _pack_string(buffer, event.phone_number.value)
+    return bytes(buffer)
+
+
+def decode_lead_event(data: bytes) -> LeadEvent:
+    if data[0] != SCHEMA_VERSION:
+        data = _upcast(data, LEAD_UPCASTERS)
+    _, code, flags, event_id, micros = LEAD_HEADER.unpack_from(data)
+    lead_id, offset = _unpack_string(data, LEAD_HEADER.size)
+    event_class = EVENT_CLASSES[code]
+    timestamp = _timestamp(micros, flags)
+    if code in _CONTACT_DETAILS_CODES:
+        name, offset = _unpack_string(data, offset)
+        phone_number, offset = _unpack_string(data, offset)
+        return event_class(
+            lead_id=lead_id_of(lead_id), event_id=event_id, timestamp=timestamp,
+            name=Name(value=name), phone_number=PhoneNumber(value=phone_number),
+        )
+    return event_class(lead_id=lead_id_of(lead_id), event_id=event_id, timestamp=timestamp)
+
+
+# 旧バージョン -> 1つ新しいバージョンへの変換 (v1 が最初のバージョンなので、まだない)
+LEAD_UPCASTERS: dict[int, Upcaster] = {}
+
+
+#################################################
+# DomainEvent (チケット)
+#################################################
+# レイアウト (v1):
+#   バージョン (1) | 種別コード (1) | flags (1) | タイムスタンプ (エポックマイクロ秒, 8)
+
+TICKET_HEADER = struct.Struct("<BBBq")
+
+TICKET_EVENT_CLASSES: tuple[type[DomainEvent], ...] = tuple(TICKET_EVENT_TYPES.values())
+TICKET_EVENT_CODES: dict[type[DomainEvent], int] = {
+    event_class: code for code, event_class in enumerate(TICKET_EVENT_CLASSES)
+}
+
+
+def encode_ticket_event(event: DomainEvent) -> bytes:
+    return TICKET_HEADER.pack(
+        SCHEMA_VERSION, TICKET_EVENT_CODES[type(event)], _flags(event.timestamp), to_epoch_micros(event.timestamp)
+    )
+
+
+def decode_ticket_event(data: bytes) -> DomainEvent:
+    if data[0] != SCHEMA_VERSION:
+        data = _upcast(data, TICKET_UPCASTERS)
+    _, code, flags, micros = TICKET_HEADER.unpack_from(data)
+    return TICKET_EVENT_CLASSES[code](timestamp=_timestamp(micros, flags))
+
+
+TICKET_UPCASTERS: dict[int, Upcaster] = {}
+
+
+#################################################
+# Stream (長さ付きレコードの連結)
+#################################################
+
+def encode_stream[E](events: Iterable[E], encode: Callable[[E], bytes]) -> bytes:
+    buffer = bytearray()
+    for event in events:
+        record = encode(event)
+        buffer += FRAME.pack(len(record))
+        buffer += record
+    return bytes(buffer)
+
+
+def decode_stream[E](data: bytes, decode: Callable[[bytes], E]) -> Iterator[E]:
+    view = memoryview(data)
+    offset = 0
+    while offset < len(data):
+        (length,) = FRAME.unpack_from(data, offset)
+        offset += FRAME.size
+        yield decode(bytes(view[offset:offset + length]))
+        offset += length
+
+
+if __name__ == "__main__":
+    # 使い方: python binary_codec.py [リード数]
+    import json
+    import os
+    import sys
+    import time
+
+    from event_decoder import decode_json
+    from event_sourcing_domain_model import ClosedEvent, EscalatedEvent, InitializedEvent
+    from file_event_store import decode_event, encode_event
+
+    # 知らないバージョンのレコードは読まずにエラーにする
+    ticket_event = EscalatedEvent(timestamp=datetime(2020, 5, 20, 9, 52, 55, 950000))
+    assert decode_ticket_event(encode_ticket_event(ticket_event)) == ticket_event
+    initialized = decode_json('[{"lead-id": 12, "event-id": 0, "event-type": "新規登録", "timestamp": "2020-05-20T09:52:55.950Z", "name": "小林裕美", "phone-number": "555-8101"}]')[0]
+    try:
+        decode_lead_event(bytes([SCHEMA_VERSION + 1]) + encode_lead_event(initialized)[1:])
+    except ValueError as e:
+        print(e)  # Unsupported schema version: 2
+    else:
+        raise AssertionError("future schema version was decoded")
+
+    # 64KiB を超える文字列も書ける
+    long_name = initialized.model_copy(update={"name": Name(value="x" * 70_000)})
+    assert decode_lead_event(encode_lead_event(long_name)) == long_name
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(f"{script_dir}/events.json", "r", encoding="utf-8") as f:
+        template = json.load(f)
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    lead_events = decode_json(json.dumps([{**event, "lead-id": lead} for lead in range(leads) for event in template]))
+    now = datetime.now()
+    ticket_events = [InitializedEvent(timestamp=now), EscalatedEvent(timestamp=now), ClosedEvent(timestamp=now.astimezone(timezone.utc))] * (len(lead_events) // 3)
+
+    def json_encode_lead(event: LeadEvent) -> bytes:
+        return json.dumps({"type": type(event).__name__, "data": event.model_dump(mode="json")}, separators=(",", ":")).encode("utf-8")
+
+    def json_decode_lead(payload: bytes) -> LeadEvent:
+        record = json.loads(payload)
+        return LEAD_EVENT_TYPES[record["type"]].model_validate(record["data"])
+
+    LEAD_EVENT_TYPES = {event_class.__name__: event_class for event_class in EVENT_CLASSES}
+
+    def benchmark(label: str, events: list, encode: Callable, decode: Callable):
+        start = time.perf_counter()
+        records = [encode(event) for event in events]
+        encode_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        decoded = [decode(record) for record in records]
+        decode_elapsed = time.perf_counter() - start
+        assert decoded == events
+        size = sum(len(record) for record in records)
+        print(
+            f"{label:<14} encode={len(events) / encode_elapsed:>10,.0f}/s decode={len(events) / decode_elapsed:>10,.0f}/s "
+            f"bytes/event={size / len(events):6.1f}"
+        )
+
+    print(f"events={len(lead_events)}")
+    benchmark("lead json", lead_events, json_encode_lead, json_decode_lead)
+    benchmark("lead binary", lead_events, encode_lead_event, decode_lead_event)
+    benchmark("ticket json", ticket_events, encode_event, decode_event)
+    benchmark("ticket binary", ticket_events, encode_ticket_event, decode_ticket_event)
+
+    stream = encode_stream(lead_events, encode_lead_event)
+    assert list(decode_stream(stream, decode_lead_event)) == lead_events
+    wire = json.dumps([{**event, "lead-id": lead} for lead in range(leads) for event in template], ensure_ascii=False).encode("utf-8")
+    print(f"events.json format={len(wire):,} bytes, binary stream={len(stream):,} bytes ({len(stream) / len(wire):.0%})")
@@ -0,0 +1,241 @@
+from array import array
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Iterable, Iterator, overload
+
+from event_decoder import EVENT_TYPES
+from lead_events import (
+    LeadID, Name, PhoneNumber,
+    LeadEvent, LeadInitializedEvent, ContactDetailsChangedEvent,
+)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+# イベント種別コード (1byte) <-> イベントのクラス
+EVENT_CLASSES: tuple[type[LeadEvent], ...] = tuple(EVENT_TYPES.values())
+EVENT_CODES: dict[type[LeadEvent], int] = {event_class: code for code, event_class in enumerate(EVENT_CLASSES)}
+
+# 氏名・電話番号を持たないイベント
+NO_STRING = -1
+
+# iter_events で使い回す LeadID / Name / PhoneNumber の最大数 (それぞれ)
+# NOTE: 1リードのイベントはまとまって並ぶことが多いので、直近に使った値だけを持てば十分に使い回せる
+OBJECT_CACHE_SIZE = 1024
+
+# aware 列の値: タイムゾーン付きの時刻 (UTCに正規化して保存)。0 ならナイーブな時刻 (UTCとみなして保存)
+AWARE = 1
+
+
+def to_epoch_micros(timestamp: datetime) -> int:
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+def from_epoch_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+
+#################################################
+# String Table
+#################################################
+
+# 文字列を重複なく保持し、整数のインデックスで参照する
+class StringTable:
+    def __init__(self):
+        self._strings: list[str] = []
+        self._index: dict[str, int] = {}
+
+    def intern(self, value: str) -> int:
+        index = self._index.get(value)
+        if index is None:
+            index = self._index[value] = len(self._strings)
+            self._strings.append(value)
+        return index
+
+    def lookup(self, value: str) -> int | None:
+        return self._index.get(value)
+
+    def __getitem__(self, index: int) -> str:
+        return self._strings[index]
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    # 文字列本体 (UTF-8) のバイト数
+    @property
+    def nbytes(self) -> int:
+        return sum(len(s.encode("utf-8")) for s in self._strings)
+
+
+#################################################
+# Columnar Event Log
+#################################################
+
+# イベントを列ごとの配列 (array) で保持するイベントログ
+# NOTE: pydantic のイベントは1件あたり数百バイトになるが、
+#       ここでは固定長の列 (8+4+1+8+1+4+4 = 30バイト) と重複排除した文字列だけを持つ
+class ColumnarEventLog:
+    def __init__(self):
+        self.event_ids = array("q")
+        self.lead_ids = array("i")       # lead_table のインデックス (0 から連番)
+        self.type_codes = array("B")     # EVENT_CLASSES のインデックス
+        self.timestamps = array("q")     # UNIXエポックからのマイクロ秒 (UTC)
+        self.aware = array("B")          # AWARE または 0 (ナイーブな時刻は読み出し時にタイムゾーンを外す)
+        self.names = array("i")          # strings のインデックス または NO_STRING
+        self.phone_numbers = array("i")  # strings のインデックス または NO_STRING
+        self.lead_table = StringTable()
+        self.strings = StringTable()
+
+    @classmethod
+    def from_events(cls, events: Iterable[LeadEvent]) -> "ColumnarEventLog":
+        log = cls()
+        log.extend(events)
+        return log
+
+    def append(self, event: LeadEvent):
+        self.event_ids.append(event.event_id)
+        self.lead_ids.append(self.lead_table.intern(event.lead_id.value))
+        self.type_codes.append(EVENT_CODES[type(event)])
+        self.timestamps.append(to_epoch_micros(event.timestamp))
+        self.aware.append(AWARE if event.timestamp.tzinfo is not None else 0)
+        if isinstance(event, (LeadInitializedEvent, ContactDetailsChangedEvent)):
+            self.names.append(self.strings.intern(event.name.value))
+            self.phone_numbers.append(self.strings.intern(event.phone_number.value))
+        else:
+            self.names.append(NO_STRING)
+            self.phone_numbers.append(NO_STRING)
+
+    def extend(self, events: Iterable[LeadEvent]):
+        for event in events:
+            self.append(event)
+
+    def __len__(self) -> int:
+        return len(self.event_ids)
+
+    # 列と文字列テーブルが使うおおよそのバイト数
+    @property
+    def nbytes(self) -> int:
+        columns = (
+            self.event_ids, self.lead_ids, self.type_codes, self.timestamps, self.aware, self.names, self.phone_numbers,
+        )
+        return sum(column.itemsize * len(column) for column in columns) + self.lead_table.nbytes + self.strings.nbytes
+
+    @overload
+    def __getitem__(self, index: int) -> LeadEvent: ...
+    @overload
+    def __getitem__(self, index: slice) -> Iterator[LeadEvent]: ...
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.iter_events(*index.indices(len(self))[:2])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ColumnarEventLog index out of range")
+        return next(self.iter_events(index, index + 1))
+
+    def __iter__(self) -> Iterator[LeadEvent]:
+        return self.iter_events()
+
+    # start 番目から stop 番目までのイベントを1件ずつ組み立てて返す (既存のプロジェクションにそのまま渡せる)
+    # NOTE: LeadID / Name / PhoneNumber は、直近に使った OBJECT_CACHE_SIZE 個まで同じ値のオブジェクトを使い回す
+    #       (全ての値を持つと、リード数・文字列の異なり数に比例してメモリが増える)
+    def iter_events(self, start: int = 0, stop: int | None = None) -> Iterator[LeadEvent]:
+        stop = len(self) if stop is None else stop
+
+        @lru_cache(maxsize=OBJECT_CACHE_SIZE)
+        def lead_id_at(index: int) -> LeadID:
+            return LeadID(value=self.lead_table[index])
+
+        @lru_cache(maxsize=OBJECT_CACHE_SIZE)
+        def name_at(index: int) -> Name:
+            return Name(value=self.strings[index])
+
+        @lru_cache(maxsize=OBJECT_CACHE_SIZE)
+        def phone_number_at(index: int) -> PhoneNumber:
+            return PhoneNumber(value=self.strings[index])
+
+        for i in range(start, stop):
+            lead_id = lead_id_at(self.lead_ids[i])
+            event_class = EVENT_CLASSES[self.type_codes[i]]
+            timestamp = from_epoch_micros(self.timestamps[i])
+            if not self.aware[i]:
+                timestamp = timestamp.replace(tzinfo=None)
+
+            name_index = self.names[i]
+            if name_index == NO_STRING:
+                yield event_class(lead_id=lead_id, event_id=self.event_ids[i], timestamp=timestamp)
+                continue
+
+            yield event_class(
+                lead_id=lead_id,
+                event_id=self.event_ids[i],
+                timestamp=timestamp,
+                name=name_at(name_index),
+                phone_number=phone_number_at(self.phone_numbers[i]),
+            )
+
+
+if __name__ == "__main__":
+    # 使い方: python columnar_event_log.py [リード数]
+    import json
+    import os
+    import sys
+    import time
+    import tracemalloc
+
+    from event_decoder import decode_json
+    from event_sourcing import LeadStateModelProjection
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(f"{script_dir}/events.json", "r", encoding="utf-8") as f:
+        template = json.load(f)
+
+    # events.json のイベント列をリードIDを変えて複製し、合成データを作る
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    data = json.dumps([{**event, "lead-id": lead} for lead in range(leads) for event in template])
+
+    tracemalloc.start()
+    events = decode_json(data)
+    list_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    log = ColumnarEventLog.from_events(events)
+    columnar_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"events={len(log)}")
+    print(f"list[LeadEvent]   : {list_bytes / len(events):,.0f} bytes/event")
+    print(f"ColumnarEventLog  : {columnar_bytes / len(log):,.0f} bytes/event (nbytes={log.nbytes / len(log):.1f})")
+
+    start = time.perf_counter()
+    scanned = sum(1 for _ in log)
+    print(f"lazy scan         : {scanned / (time.perf_counter() - start):,.0f} events/sec")
+
+    assert list(log) == events
+    assert log[-len(log)] == events[0]
+    for index in (len(log), -len(log) - 1):
+        try:
+            log[index]
+        except IndexError:
+            pass
+        else:
+            raise AssertionError(f"log[{index}] should raise IndexError")
+
+    # ナイーブな時刻はナイーブなまま、タイムゾーン付きの時刻はUTCで読み出す
+    naive = ColumnarEventLog.from_events([
+        events[0].model_copy(update={"timestamp": events[0].timestamp.replace(tzinfo=None)}),
+        events[1],
+    ])
+    assert naive[0].timestamp.tzinfo is None and naive[0].timestamp == events[0].timestamp.replace(tzinfo=None)
+    assert naive[1] == events[1]
+
+    # 列から組み立てたイベントを既存のプロジェクションに適用する
+    lead_state = LeadStateModelProjection.empty()
+    lead_index = log.lead_table.lookup("12")
+    for i, lead in enumerate(log.lead_ids):
+        if lead == lead_index:
+            lead_state.apply(log[i])
+    print(lead_state)
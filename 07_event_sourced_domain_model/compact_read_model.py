@@ -0,0 +1,246 @@
+from array import array
+from datetime import datetime
+from functools import singledispatchmethod
+from typing import Iterable, Iterator
+
+from columnar_event_log import StringTable, from_epoch_micros, to_epoch_micros
+from event_sourcing_analysis import LeadStateModelProjection
+from lead_events import (
+    LeadID, Name, LeadStatusEnum, LeadStatus, PhoneNumber,
+    LeadEvent, LeadInitializedEvent, ContactedEvent, FollowupSetEvent,
+    ContactDetailsChangedEvent, OrderSubmittedEvent, PaymentConfirmedEvent,
+)
+
+# 状態コード (1byte) <-> LeadStatus
+# NOTE: LeadStatus は不変なので、状態ごとに1つのインスタンスを使い回す
+STATUSES: tuple[LeadStatus, ...] = tuple(LeadStatus(value=status) for status in LeadStatusEnum)
+STATUS_CODES: dict[LeadStatusEnum, int] = {status.value: code for code, status in enumerate(STATUSES)}
+
+# follow_up_on / created_on / updated_on が None
+NO_TIMESTAMP = -(2 ** 63)
+
+# aware 列のビット: その列の時刻がタイムゾーン付き (UTCに正規化して保存)。立っていなければナイーブな時刻 (UTCとみなして保存)
+# NOTE: columnar_event_log の aware 列と同じく、読み出し時にナイーブな時刻はタイムゾーンを外して元に戻す
+AWARE_FOLLOW_UP_ON = 1
+AWARE_CREATED_ON = 2
+AWARE_UPDATED_ON = 4
+
+
+def _to_micros(timestamp: datetime | None) -> int:
+    return NO_TIMESTAMP if timestamp is None else to_epoch_micros(timestamp)
+
+
+def _from_micros(micros: int, aware: bool) -> datetime | None:
+    if micros == NO_TIMESTAMP:
+        return None
+    timestamp = from_epoch_micros(micros)
+    return timestamp if aware else timestamp.replace(tzinfo=None)
+
+
+#################################################
+# Compact Lead Table
+#################################################
+
+# 全リードの LeadStateModelProjection (event_sourcing_analysis) を列ごとの配列で持つ表
+# NOTE: 1リードあたり固定長の列 (4+4+1+8+4+8+8+1+4 = 42バイト) と、リードIDの索引・重複排除した文字列だけを持つ。
+#       pydantic のプロジェクションとの相互変換は API の境界 (to_projection / put) でだけ行う
+class CompactLeadTable:
+    def __init__(self):
+        self.lead_ids = StringTable()     # リードID -> 行番号
+        self.strings = StringTable()      # 氏名・電話番号 (同じ値は1つだけ持つ)
+        self.names = array("i")           # strings のインデックス
+        self.phone_numbers = array("i")   # strings のインデックス
+        self.statuses = array("B")        # STATUSES のインデックス
+        self.follow_up_on = array("q")    # エポックマイクロ秒 / NO_TIMESTAMP
+        self.followups = array("i")
+        self.created_on = array("q")
+        self.updated_on = array("q")
+        self.aware = array("B")           # AWARE_* のビットの組み合わせ
+        self.versions = array("i")
+
+    def __len__(self) -> int:
+        return len(self.lead_ids)
+
+    def __contains__(self, lead_id: LeadID) -> bool:
+        return self.lead_ids.lookup(lead_id.value) is not None
+
+    # 列が使うおおよそのバイト数 (リードIDの索引の dict を除く)
+    @property
+    def nbytes(self) -> int:
+        columns = (
+            self.names, self.phone_numbers, self.statuses, self.follow_up_on,
+            self.followups, self.created_on, self.updated_on, self.aware, self.versions,
+        )
+        return sum(column.itemsize * len(column) for column in columns) + self.lead_ids.nbytes + self.strings.nbytes
+
+    # リードの行番号。なければ空の行を追加する
+    def _row(self, lead_id: LeadID) -> int:
+        row = self.lead_ids.intern(lead_id.value)
+        if row == len(self.names):
+            empty = self.strings.intern("")
+            self.names.append(empty)
+            self.phone_numbers.append(empty)
+            self.statuses.append(STATUS_CODES[LeadStatusEnum.NEW_LEAD])
+            self.follow_up_on.append(NO_TIMESTAMP)
+            self.followups.append(0)
+            self.created_on.append(NO_TIMESTAMP)
+            self.updated_on.append(NO_TIMESTAMP)
+            self.aware.append(0)
+            self.versions.append(0)
+        return row
+
+    # 時刻の列に書き込み、タイムゾーンの有無を aware 列の bit に記録する
+    def _set_timestamp(self, column: array, bit: int, row: int, timestamp: datetime | None):
+        column[row] = _to_micros(timestamp)
+        if timestamp is not None and timestamp.tzinfo is not None:
+            self.aware[row] |= bit
+        else:
+            self.aware[row] &= ~bit
+
+    #################################################
+    # イベントの適用 (LeadStateModelProjection.apply と同じ規則)
+    #################################################
+
+    # NOTE: メソッドのオーバーロードにsingledispatchmethodを使用
+    @singledispatchmethod
+    def apply(self, event):
+        raise TypeError("Unsupported event type")
+
+    @apply.register
+    def _(self, event: LeadInitializedEvent):
+        row = self._row(event.lead_id)
+        self.names[row] = self.strings.intern(event.name.value)
+        self.phone_numbers[row] = self.strings.intern(event.phone_number.value)
+        self.statuses[row] = STATUS_CODES[event.status.value]
+        self._set_timestamp(self.created_on, AWARE_CREATED_ON, row, event.timestamp)
+        self._set_timestamp(self.updated_on, AWARE_UPDATED_ON, row, event.timestamp)
+        self.versions[row] = 0
+        self.followups[row] = 0
+
+    @apply.register
+    def _(self, event: ContactedEvent):
+        row = self._row(event.lead_id)
+        self._set_timestamp(self.updated_on, AWARE_UPDATED_ON, row, event.timestamp)
+        self._set_timestamp(self.follow_up_on, AWARE_FOLLOW_UP_ON, row, None)
+        self.versions[row] += 1
+
+    @apply.register
+    def _(self, event: FollowupSetEvent):
+        row = self._row(event.lead_id)
+        self._set_timestamp(self.updated_on, AWARE_UPDATED_ON, row, event.timestamp)
+        self._set_timestamp(self.follow_up_on, AWARE_FOLLOW_UP_ON, row, event.timestamp)
+        self.statuses[row] = STATUS_CODES[event.status.value]
+        self.versions[row] += 1
+        self.followups[row] += 1
+
+    @apply.register
+    def _(self, event: ContactDetailsChangedEvent):
+        row = self._row(event.lead_id)
+        self.names[row] = self.strings.intern(event.name.value)
+        self.phone_numbers[row] = self.strings.intern(event.phone_number.value)
+        self._set_timestamp(self.updated_on, AWARE_UPDATED_ON, row, event.timestamp)
+        self.versions[row] += 1
+
+    @apply.register(OrderSubmittedEvent)
+    @apply.register(PaymentConfirmedEvent)
+    def _(self, event: OrderSubmittedEvent | PaymentConfirmedEvent):
+        row = self._row(event.lead_id)
+        self.statuses[row] = STATUS_CODES[event.status.value]
+        self._set_timestamp(self.updated_on, AWARE_UPDATED_ON, row, event.timestamp)
+        self.versions[row] += 1
+
+    def extend(self, events: Iterable[LeadEvent]):
+        for event in events:
+            self.apply(event)
+
+    #################################################
+    # pydantic のプロジェクションとの変換
+    #################################################
+
+    # プロジェクションを表に書き込む (既にあれば上書き)
+    def put(self, projection: LeadStateModelProjection):
+        row = self._row(projection.lead_id)
+        self.names[row] = self.strings.intern(projection.name.value)
+        self.phone_numbers[row] = self.strings.intern(projection.phone_number.value)
+        self.statuses[row] = STATUS_CODES[projection.status.value]
+        self._set_timestamp(self.follow_up_on, AWARE_FOLLOW_UP_ON, row, projection.follow_up_on)
+        self.followups[row] = projection.followups
+        self._set_timestamp(self.created_on, AWARE_CREATED_ON, row, projection.created_on)
+        self._set_timestamp(self.updated_on, AWARE_UPDATED_ON, row, projection.updated_on)
+        self.versions[row] = projection.version
+
+    # 1リード分の行を pydantic のプロジェクションにする
+    def to_projection(self, lead_id: LeadID) -> LeadStateModelProjection:
+        row = self.lead_ids.lookup(lead_id.value)
+        if row is None:
+            raise KeyError(lead_id)
+        aware = self.aware[row]
+        return LeadStateModelProjection(
+            lead_id=lead_id,
+            name=Name(value=self.strings[self.names[row]]),
+            status=STATUSES[self.statuses[row]],
+            phone_number=PhoneNumber(value=self.strings[self.phone_numbers[row]]),
+            follow_up_on=_from_micros(self.follow_up_on[row], bool(aware & AWARE_FOLLOW_UP_ON)),
+            followups=self.followups[row],
+            created_on=_from_micros(self.created_on[row], bool(aware & AWARE_CREATED_ON)),
+            updated_on=_from_micros(self.updated_on[row], bool(aware & AWARE_UPDATED_ON)),
+            version=self.versions[row],
+        )
+
+    def projections(self) -> Iterator[LeadStateModelProjection]:
+        for row in range(len(self)):
+            yield self.to_projection(LeadID(value=self.lead_ids[row]))
+
+    @classmethod
+    def from_projections(cls, projections: Iterable[LeadStateModelProjection]) -> "CompactLeadTable":
+        table = cls()
+        for projection in projections:
+            table.put(projection)
+        return table
+
+
+if __name__ == "__main__":
+    # 使い方: python compact_read_model.py [リード数] [1リードあたりのイベント数]
+    import gc
+    import sys
+    import time
+    import tracemalloc
+
+    from benchmarks.lead_generator import generate_events
+    from event_decoder import decode_records
+    from projection_rebuild import rebuild_shard
+
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    events_per_lead = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    records = list(generate_events(leads, events_per_lead))
+    events = list(decode_records(records))
+
+    def measure(build):
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = build()
+        elapsed = time.perf_counter() - start
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, current, elapsed
+
+    projections, projection_bytes, projection_elapsed = measure(
+        lambda: rebuild_shard(LeadStateModelProjection, records)
+    )
+    def build_table() -> CompactLeadTable:
+        table = CompactLeadTable()
+        table.extend(events)
+        return table
+
+    table, table_bytes, table_elapsed = measure(build_table)
+
+    # イベントから作った表と、プロジェクションとが一致する
+    for lead_id, projection in list(projections.items())[:1_000]:
+        assert table.to_projection(lead_id) == projection, lead_id
+    assert CompactLeadTable.from_projections(projections.values()).to_projection(lead_id) == projection
+
+    print(f"leads={leads:,} events={len(events):,}")
+    print(f"dict[LeadID, LeadStateModelProjection]: {projection_bytes / leads:8,.0f} bytes/lead (decode + apply {projection_elapsed:.2f}s under tracemalloc)")
+    print(f"CompactLeadTable                      : {table_bytes / leads:8,.0f} bytes/lead (apply {table_elapsed:.2f}s under tracemalloc, columns+strings {table.nbytes / leads:.0f} bytes/lead)")
+    print(f"distinct strings: {len(table.strings):,}")
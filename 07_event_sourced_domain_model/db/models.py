@@ -0,0 +1,29 @@
+from datetime import datetime
+from sqlalchemy import String, Integer, DateTime, Text, PrimaryKeyConstraint
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+
+class Base(DeclarativeBase): pass
+
+class Event(Base):
+    __tablename__ = "events"
+    stream_id: Mapped[str] = mapped_column(String(36))                    # TicketID (UUID) を str で保存
+    version: Mapped[int] = mapped_column(Integer)                         # ストリーム内の連番 (1 から)
+    event_type: Mapped[str] = mapped_column(String(64), nullable=False)   # イベントのクラス名
+    occurred_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)            # イベントをJSONにシリアライズしたもの
+
+    __table_args__ = (
+        # (stream_id, version) の一意制約で楽観的な排他制御を行う (同じバージョンを2回書こうとすると失敗する)
+        # NOTE: 主キーにすることで InnoDB / SQLite(WITHOUT ROWID) ではクラスタ化インデックスになり、
+        #       ストリームの読み込み (WHERE stream_id = ? ORDER BY version) がこのインデックスだけで完結する (カバリングインデックス)
+        PrimaryKeyConstraint("stream_id", "version", name="pk_events"),
+        {"sqlite_with_rowid": False},
+    )
+
+
+class Snapshot(Base):
+    __tablename__ = "snapshots"
+    stream_id: Mapped[str] = mapped_column(String(36), primary_key=True)  # TicketID (UUID) を str で保存
+    schema_version: Mapped[int] = mapped_column(Integer, nullable=False)  # TicketState.snapshot_schema_version
+    position: Mapped[int] = mapped_column(Integer, nullable=False)        # スナップショットに含まれるイベント数
+    state: Mapped[str] = mapped_column(Text, nullable=False)              # TicketState をJSONにシリアライズしたもの
@@ -0,0 +1,237 @@
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
+from typing import Annotated, Any, Iterable, Iterator, Literal, TypedDict, Union, final
+from pydantic import ConfigDict, Field, TypeAdapter, with_config
+from datetime import datetime
+import gc
+
+from lead_events import (
+    LeadID, Name, PhoneNumber,
+    LeadEvent, LeadInitializedEvent, ContactedEvent, FollowupSetEvent,
+    ContactDetailsChangedEvent, OrderSubmittedEvent, PaymentConfirmedEvent,
+)
+
+
+#################################################
+# Record (events.json 1件分の形式)
+#################################################
+# NOTE: JSONのキー ("lead-id" 等) とドメインイベントの形が異なるため、
+#       まずフラットなレコード (TypedDict) として検証し、その後ドメインイベントを組み立てる。
+#       レコードはスカラー値だけなので validate_json は pydantic-core 内で完結する。
+#       判別子で選ばれる具象レコードは @final にして、"name" in record で型を絞り込めるようにする。
+
+# "lead-id": 12 を "12" として受け付ける
+@with_config(ConfigDict(coerce_numbers_to_str=True))
+class LeadEventRecord(TypedDict):
+    lead_id: Annotated[str, Field(alias="lead-id")]
+    event_id: Annotated[int, Field(alias="event-id")]
+    timestamp: datetime
+
+class ContactDetailsRecord(LeadEventRecord):
+    name: str
+    phone_number: Annotated[str, Field(alias="phone-number")]
+
+@final
+class LeadInitializedRecord(ContactDetailsRecord):
+    event_type: Annotated[Literal["新規登録"], Field(alias="event-type")]
+
+@final
+class ContactedRecord(LeadEventRecord):
+    event_type: Annotated[Literal["架電"], Field(alias="event-type")]
+
+@final
+class FollowupSetRecord(LeadEventRecord):
+    event_type: Annotated[Literal["商談予定設定"], Field(alias="event-type")]
+
+@final
+class ContactDetailsChangedRecord(ContactDetailsRecord):
+    event_type: Annotated[Literal["連絡先変更"], Field(alias="event-type")]
+
+@final
+class OrderSubmittedRecord(LeadEventRecord):
+    event_type: Annotated[Literal["注文受領"], Field(alias="event-type")]
+
+@final
+class PaymentConfirmedRecord(LeadEventRecord):
+    event_type: Annotated[Literal["支払完了"], Field(alias="event-type")]
+
+
+#################################################
+# Registry
+#################################################
+
+# event-type (JSON上のイベント種別) -> (レコードの型, ドメインイベントのクラス)
+REGISTRY: dict[str, tuple[type[LeadEventRecord], type[LeadEvent]]] = {
+    "新規登録": (LeadInitializedRecord, LeadInitializedEvent),
+    "架電": (ContactedRecord, ContactedEvent),
+    "商談予定設定": (FollowupSetRecord, FollowupSetEvent),
+    "連絡先変更": (ContactDetailsChangedRecord, ContactDetailsChangedEvent),
+    "注文受領": (OrderSubmittedRecord, OrderSubmittedEvent),
+    "支払完了": (PaymentConfirmedRecord, PaymentConfirmedEvent),
+}
+
+# event-type -> ドメインイベントのクラス
+EVENT_TYPES: dict[str, type[LeadEvent]] = {name: event_class for name, (_, event_class) in REGISTRY.items()}
+
+# ドメインイベントのクラス -> event-type
+EVENT_TYPE_NAMES: dict[type[LeadEvent], str] = {event_class: name for name, event_class in EVENT_TYPES.items()}
+
+# event-type を判別子とした Discriminated Union
+AnyLeadEventRecord = Annotated[
+    Union[
+        LeadInitializedRecord, ContactedRecord, FollowupSetRecord,
+        ContactDetailsChangedRecord, OrderSubmittedRecord, PaymentConfirmedRecord,
+    ],
+    Field(discriminator="event_type"),
+]
+
+# event-type -> 連絡先 (name / phone_number) を持つドメインイベントのクラス
+CONTACT_DETAILS_EVENT_TYPES: dict[str, type[LeadInitializedEvent] | type[ContactDetailsChangedEvent]] = {
+    "新規登録": LeadInitializedEvent,
+    "連絡先変更": ContactDetailsChangedEvent,
+}
+
+# NOTE: TypeAdapter の構築 (スキーマ生成) は重いので、モジュール読み込み時に1回だけ行う
+_records_adapter: TypeAdapter[list[AnyLeadEventRecord]] = TypeAdapter(list[AnyLeadEventRecord])
+
+
+# 同じリードのイベントで LeadID を使い回す
+@lru_cache(maxsize=65536)
+def lead_id_of(value: str) -> LeadID:
+    return LeadID(value=value)
+
+
+# 検証済みのレコードからドメインイベントを組み立てる
+# NOTE: 次の2つと比較して、この組み立て方が最も速かった (20,000リード分の decode_json で計測)
+#       - model_construct: 検証は省けるが、フィールドの既定値の補完などを Python で行うため、
+#         この小さなモデルでは通常の生成 (pydantic-core で検証) より 1.5〜3倍遅い
+#       - エイリアスと event-type の判別子を持たせたモデルへの直接の validate_json:
+#         スカラー ("lead-id": 12) から値オブジェクト (LeadID) への変換に Python のバリデータが要り、約1.7倍遅い
+def to_event(record: AnyLeadEventRecord) -> LeadEvent:
+    lead_id = lead_id_of(record["lead_id"])
+    if "name" in record:
+        return CONTACT_DETAILS_EVENT_TYPES[record["event_type"]](
+            lead_id=lead_id,
+            event_id=record["event_id"],
+            timestamp=record["timestamp"],
+            name=Name(value=record["name"]),
+            phone_number=PhoneNumber(value=record["phone_number"]),
+        )
+    return EVENT_TYPES[record["event_type"]](
+        lead_id=lead_id,
+        event_id=record["event_id"],
+        timestamp=record["timestamp"],
+    )
+
+
+# 大量のオブジェクトを一度に生成する間は循環参照GCを止める
+# NOTE: 生成のたびに世代別GCが走り、生存オブジェクト全体を何度も走査してしまうため
+@contextmanager
+def gc_paused() -> Iterator[None]:
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+#################################################
+# Decoder
+#################################################
+
+# JSON配列のバイト列を1回の validate_json でまとめて検証・変換する
+def decode_json(data: bytes | str) -> list[LeadEvent]:
+    with gc_paused():
+        return [to_event(record) for record in _records_adapter.validate_json(data)]
+
+
+# dict のイテラブル (event_loader のストリーム等) を batch_size 件ずつまとめて検証・変換する
+def decode_records(records: Iterable[dict[str, Any]], batch_size: int = 1024) -> Iterator[LeadEvent]:
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        with gc_paused():
+            events = [to_event(record) for record in _records_adapter.validate_python(batch)]
+        yield from events
+
+
+#################################################
+# Benchmark
+#################################################
+
+# 従来の if/elif による1件ずつの変換 (比較用)
+def _decode_legacy(events_json: list[dict[str, Any]]) -> list[LeadEvent]:
+    events: list[LeadEvent] = []
+    for event in events_json:
+        event_type = event["event-type"]
+        lead_id = LeadID(value=str(event["lead-id"]))
+        event_id = event["event-id"]
+        timestamp = datetime.fromisoformat(event["timestamp"].replace("Z", "+00:00"))
+        e: LeadEvent
+        if event_type == "新規登録":
+            e = LeadInitializedEvent(
+                lead_id=lead_id,
+                event_id=event_id,
+                name=Name(value=event["name"]),
+                phone_number=PhoneNumber(value=event["phone-number"]),
+                timestamp=timestamp,
+            )
+        elif event_type == "架電":
+            e = ContactedEvent(lead_id=lead_id, event_id=event_id, timestamp=timestamp)
+        elif event_type == "商談予定設定":
+            e = FollowupSetEvent(lead_id=lead_id, event_id=event_id, timestamp=timestamp)
+        elif event_type == "連絡先変更":
+            e = ContactDetailsChangedEvent(
+                lead_id=lead_id,
+                event_id=event_id,
+                name=Name(value=event["name"]),
+                phone_number=PhoneNumber(value=event["phone-number"]),
+                timestamp=timestamp,
+            )
+        elif event_type == "注文受領":
+            e = OrderSubmittedEvent(lead_id=lead_id, event_id=event_id, timestamp=timestamp)
+        elif event_type == "支払完了":
+            e = PaymentConfirmedEvent(lead_id=lead_id, event_id=event_id, timestamp=timestamp)
+        else:
+            raise ValueError(f"Unknown event type: {event_type}")
+        events.append(e)
+    return events
+
+
+if __name__ == "__main__":
+    # 使い方: python event_decoder.py [リード数]
+    import json
+    import os
+    import sys
+    import time
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(f"{script_dir}/events.json", "r", encoding="utf-8") as f:
+        template = json.load(f)
+
+    # events.json のイベント列をリードIDを変えて複製し、合成データを作る
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    records = [{**event, "lead-id": lead} for lead in range(leads) for event in template]
+    data = json.dumps(records, ensure_ascii=False).encode("utf-8")
+
+    start = time.perf_counter()
+    legacy = _decode_legacy(json.loads(data))
+    legacy_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with gc_paused():
+        _decode_legacy(json.loads(data))
+    legacy_gc_paused_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = decode_json(data)
+    batched_elapsed = time.perf_counter() - start
+
+    assert legacy == batched
+    print(f"events={len(records)} bytes={len(data)}")
+    print(f"legacy  (json.loads + if/elif): {legacy_elapsed:.3f}s {len(records) / legacy_elapsed:,.0f} events/sec")
+    print(f"legacy  (GC paused)           : {legacy_gc_paused_elapsed:.3f}s {len(records) / legacy_gc_paused_elapsed:,.0f} events/sec")
+    print(f"batched (validate_json)       : {batched_elapsed:.3f}s {len(records) / batched_elapsed:,.0f} events/sec")
+    print(f"speedup: {legacy_elapsed / batched_elapsed:.1f}x")
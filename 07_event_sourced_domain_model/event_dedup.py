@@ -0,0 +1,241 @@
+from typing import Any, Iterable, Iterator
+import hashlib
+import math
+
+# 各リードの最初の event_id
+FIRST_EVENT_ID = 0
+
+# リードごとに保持する、最高水位より先の受け取り済み event_id の上限
+MAX_PENDING = 1024
+
+# ブルームフィルタの既定の容量 (要素数) と偽陽性率
+# NOTE: 容量を超えて追加すると偽陽性率が上がる (捨てる側に倒れる)
+BLOOM_CAPACITY = 100_000
+FALSE_POSITIVE_RATE = 0.001
+
+
+#################################################
+# Bloom Filter
+#################################################
+
+# 固定サイズのブルームフィルタ (偽陰性なし・偽陽性あり)
+# NOTE: 要素のハッシュを1回だけ計算し、ダブルハッシュ法で num_hashes 個のビット位置を作る。
+#       ビット列は EventDeduplicator ごと (CatchUpProjector のチェックポイントで) pickle されるので、
+#       プロセスごとに値が変わる hash() ではなく blake2b でビット位置を決める
+class BloomFilter:
+    def __init__(self, capacity: int = BLOOM_CAPACITY, false_positive_rate: float = FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.num_bits = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> Iterator[int]:
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+
+#################################################
+# Deduplicator
+#################################################
+
+# (lead_id, event_id) の重複を取り除く取り込みステージ
+# NOTE: リトライで同じイベントが再送されても、プロジェクションには1回だけ適用されるようにする。
+#       - リードごとの最高水位 (欠けなく受け取った最後の event_id) 以下は確実に重複
+#       - 最高水位の次の event_id は確実に新規 (順序通りに届く大半のイベントはここで判定が終わる)
+#       - それより先の event_id (順序が入れ替わって先に届いたもの) は pending (正確な集合) で判定する
+#       pending はリードごとに max_pending 件までしか持たない。溢れたら (event_id が欠けたまま届かない、
+#       最初の event_id が FIRST_EVENT_ID でない等) 欠けている区間をあきらめて最高水位を進め、その区間を gaps に残す。
+#       gaps の中の event_id が後から届いたときだけブルームフィルタで判定するので、そこに限り偽陽性の分だけ
+#       新規のイベントを重複として捨てることがある (exactly-once が確率的になるのはこの場合だけ)
+class EventDeduplicator:
+    def __init__(
+        self,
+        max_pending: int = MAX_PENDING,
+        bloom_capacity: int = BLOOM_CAPACITY,
+        false_positive_rate: float = FALSE_POSITIVE_RATE,
+    ):
+        self.max_pending = max_pending
+        self.high_water_marks: dict[str, int] = {}
+        self.pending: dict[str, set[int]] = {}
+        # リードID -> あきらめた区間 [(start, end), ...] (両端を含む)
+        self.gaps: dict[str, list[tuple[int, int]]] = {}
+        # gaps の中で受け取った (lead_id, event_id)
+        self.bloom = BloomFilter(bloom_capacity, false_positive_rate)
+        self.received = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+        self.gap_skips = 0   # pending が溢れて区間をあきらめた回数
+        self.late = 0        # あきらめた区間の event_id が後から届いた回数
+        self.late_dropped = 0  # そのうちブルームフィルタが「含まれるかもしれない」と答えて捨てた回数
+
+    @property
+    def duplicate_rate(self) -> float:
+        return self.duplicates / self.received if self.received else 0.0
+
+    @property
+    def pending_size(self) -> int:
+        return sum(len(event_ids) for event_ids in self.pending.values())
+
+    # 初めて見る (lead_id, event_id) なら True
+    def accept(self, lead_id: str, event_id: int) -> bool:
+        self.received += 1
+        high_water_mark = self.high_water_marks.get(lead_id, FIRST_EVENT_ID - 1)
+        if event_id == high_water_mark + 1:
+            self._advance(lead_id, event_id)
+            return True
+        if event_id <= high_water_mark:
+            if lead_id in self.gaps and self._in_gap(lead_id, event_id):
+                return self._accept_late(lead_id, event_id)
+            self.duplicates += 1
+            return False
+
+        self.out_of_order += 1
+        pending = self.pending.setdefault(lead_id, set())
+        if event_id in pending:
+            self.duplicates += 1
+            return False
+        pending.add(event_id)
+        if len(pending) > self.max_pending:
+            self._skip_gap(lead_id)
+        return True
+
+    # 最高水位を進め、続きの event_id が pending にあればそこまで進める
+    def _advance(self, lead_id: str, event_id: int):
+        pending = self.pending.get(lead_id)
+        if pending:
+            while event_id + 1 in pending:
+                event_id += 1
+                pending.remove(event_id)
+            if not pending:
+                del self.pending[lead_id]
+        self.high_water_marks[lead_id] = event_id
+
+    # 欠けている区間 (最高水位の次 〜 pending の最小値の手前) をあきらめて最高水位を進める
+    def _skip_gap(self, lead_id: str):
+        self.gap_skips += 1
+        start = self.high_water_marks.get(lead_id, FIRST_EVENT_ID - 1) + 1
+        first = min(self.pending[lead_id])
+        self.gaps.setdefault(lead_id, []).append((start, first - 1))
+        self.pending[lead_id].remove(first)
+        self._advance(lead_id, first)
+
+    def _in_gap(self, lead_id: str, event_id: int) -> bool:
+        return any(start <= event_id <= end for start, end in self.gaps[lead_id])
+
+    # あきらめた区間の event_id: 受け取ったかどうかはブルームフィルタにしか残っていない
+    def _accept_late(self, lead_id: str, event_id: int) -> bool:
+        self.late += 1
+        key = f"{lead_id}\0{event_id}"
+        if key in self.bloom:
+            # 本当に重複か、偽陽性で新規のイベントを捨てているかは区別できない
+            self.late_dropped += 1
+            self.duplicates += 1
+            return False
+        self.bloom.add(key)
+        return True
+
+    # 生のイベント (events.json の1件) から重複を取り除く
+    # NOTE: pydantic でデコードする前に、lead-id / event-id だけを見て捨てる
+    def filter(self, records: Iterable[dict[str, Any]]) -> Iterator[dict[str, Any]]:
+        accept = self.accept
+        for record in records:
+            if accept(str(record["lead-id"]), record["event-id"]):
+                yield record
+
+    def report(self) -> str:
+        return (
+            f"received={self.received} duplicates={self.duplicates} ({self.duplicate_rate:.2%}) "
+            f"out_of_order={self.out_of_order} pending={self.pending_size} gap_skips={self.gap_skips} "
+            f"late={self.late} late_dropped={self.late_dropped} bloom_bytes={len(self.bloom.bits):,}"
+        )
+
+
+if __name__ == "__main__":
+    # 使い方: python event_dedup.py [リード数] [重複率]
+    import random
+    import sys
+    import time
+
+    from benchmarks.lead_generator import generate_events
+    from event_decoder import decode_records
+    from event_sourcing_analysis import LeadStateModelProjection
+    from projection_rebuild import rebuild_shard
+
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    duplicate_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    records = list(generate_events(leads, 10))
+    expected = rebuild_shard(LeadStateModelProjection, records)
+
+    # リトライによる再送: 同じイベントが少し後にもう一度届く
+    random.seed(0)
+    arrivals = []
+    for record in records:
+        arrivals.append(record)
+        if random.random() < duplicate_rate:
+            arrivals.append(dict(arrivals[-1 - random.randrange(min(len(arrivals), 50))]))
+
+    # 重複をそのまま適用すると version / followups が二重に数えられる
+    naive = rebuild_shard(LeadStateModelProjection, arrivals)
+    wrong = sum(naive[lead_id] != projection for lead_id, projection in expected.items())
+
+    deduplicator = EventDeduplicator()
+    start = time.perf_counter()
+    accepted = list(deduplicator.filter(arrivals))
+    elapsed = time.perf_counter() - start
+    assert accepted == records
+    assert rebuild_shard(LeadStateModelProjection, accepted) == expected
+    print(f"events={len(records):,} arrivals={len(arrivals):,} leads with wrong state without dedup={wrong:,}/{leads:,}")
+    print(f"dedup {len(arrivals) / elapsed:,.0f} records/sec {deduplicator.report()}")
+
+    # 順序の入れ替わり: 最高水位より先の event_id は pending で判定し、
+    # 全ての (lead_id, event_id) を保持する場合と同じ結果になる
+    shuffled = list(arrivals)
+    for i in range(0, len(shuffled) - 10, 7):
+        j = i + random.randrange(10)
+        shuffled[i], shuffled[j] = shuffled[j], shuffled[i]
+    seen = set()
+    reference = []
+    for record in shuffled:
+        key = (str(record["lead-id"]), record["event-id"])
+        if key not in seen:
+            seen.add(key)
+            reference.append(record)
+    deduplicator = EventDeduplicator()
+    assert list(deduplicator.filter(shuffled)) == reference
+    print(f"shuffled {deduplicator.report()}")
+
+    # event_id 0 が欠けたまま届かないリード: pending は max_pending 件で頭打ちになり、
+    # あきらめた区間の event_id が後から届いたときはブルームフィルタで判定する
+    deduplicator = EventDeduplicator(max_pending=4)
+    assert all(deduplicator.accept("lost", event_id) for event_id in range(1, 100))
+    assert deduplicator.pending_size <= 4 and deduplicator.high_water_marks["lost"] == 99
+    assert not deduplicator.accept("lost", 50)
+    assert deduplicator.accept("lost", 0) and not deduplicator.accept("lost", 0)
+    print(f"lost id {deduplicator.report()}")
+
+    # 全件デコードとの比較: 重複分 (duplicate_rate) のデコードは省けるが、判定のコストが1件ごとにかかる。
+    # NOTE: 目的は速度ではなく、重複を適用しないこと (重複率が低ければ全件デコードより遅くなる)
+    start = time.perf_counter()
+    for _ in decode_records(arrivals):
+        pass
+    decode_all = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in decode_records(EventDeduplicator().filter(arrivals)):
+        pass
+    print(f"decode all={decode_all:.2f}s dedup+decode={time.perf_counter() - start:.2f}s")
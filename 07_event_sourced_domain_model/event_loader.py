@@ -0,0 +1,166 @@
+from typing import Any, Iterable, Iterator, TypeVar
+import json
+import resource
+import sys
+import time
+
+T = TypeVar("T")
+
+# 1回の read で読み込む文字数
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = " \t\r\n"
+
+
+#################################################
+# Loader
+#################################################
+
+# JSON配列 ([{...}, {...}, ...]) を1要素ずつ読み込むジェネレータ
+# NOTE: json.load と違い、ファイル全体をデコードしたリストをメモリに保持しない
+def iter_json_array(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[dict[str, Any]]:
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        pos = 0
+        eof = False
+        # 次に読むもの: "start" ('['), "first" ('[' の直後: 要素か ']'), "element" (',' の直後: 要素),
+        #               "delimiter" (要素の直後: ',' か ']'), "end" (']' の後: 空白だけ)
+        state = "start"
+
+        def fill() -> bool:
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+                return False
+            # 処理済みの部分は捨ててバッファが肥大化しないようにする
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            return True
+
+        while True:
+            # 空白を読み飛ばす
+            while True:
+                while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                    pos += 1
+                if pos < len(buffer):
+                    break
+                if not fill():
+                    break
+
+            if pos >= len(buffer):
+                if state == "end":
+                    return
+                if state == "start":
+                    raise ValueError(f"JSON array expected: {path}")
+                raise ValueError(f"Unexpected end of JSON array: {path}")
+
+            ch = buffer[pos]
+            if state == "start":
+                if ch != "[":
+                    raise ValueError(f"JSON array expected: {path}")
+                state = "first"
+                pos += 1
+                continue
+            if state == "end":
+                raise ValueError(f"Extra data after JSON array: {path}")
+            if state == "delimiter":
+                # NOTE: 要素の直後が ',' か ']' であることはデコード時に確かめてある
+                state = "element" if ch == "," else "end"
+                pos += 1
+                continue
+            if ch == "]" and state == "first":
+                state = "end"
+                pos += 1
+                continue
+            if ch in ",]":
+                raise ValueError(f"Unexpected {ch!r} in JSON array: {path}")
+
+            # 要素を1つデコードする。途中で途切れていればチャンクを追加して再試行
+            while True:
+                try:
+                    record, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof or not fill():
+                        raise
+                    continue
+                # 数値などは途中で途切れていても成功してしまう ("1.5" の "1" まで等) ので、
+                # 要素の後ろの空白を除いた次の文字が ',' か ']' であることを確かめてから受け付ける
+                following = end
+                while following < len(buffer) and buffer[following] in _WHITESPACE:
+                    following += 1
+                if following < len(buffer) and buffer[following] in ",]":
+                    break
+                if eof or not fill():
+                    raise ValueError(f"',' or ']' expected after an array element: {path}")
+            pos = end
+            state = "delimiter"
+            yield record
+
+
+# NDJSON (1行1イベント) を1行ずつ読み込むジェネレータ
+def iter_ndjson(path: str) -> Iterator[dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+# 拡張子でフォーマットを判定してイベントを読み込む
+def iter_events(path: str) -> Iterator[dict[str, Any]]:
+    if path.endswith((".ndjson", ".jsonl")):
+        return iter_ndjson(path)
+    return iter_json_array(path)
+
+
+#################################################
+# 計測
+#################################################
+
+# プロセスのピークRSS (bytes)
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # NOTE: ru_maxrss は Linux では KiB、macOS では bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# イベント数と経過時間を数えながら素通しするイテレータ
+class ReplayStats:
+    def __init__(self):
+        self.events = 0
+        self.started_at = 0.0
+        self.elapsed = 0.0
+
+    def track(self, events: Iterable[T]) -> Iterator[T]:
+        self.started_at = time.perf_counter()
+        try:
+            for event in events:
+                self.events += 1
+                yield event
+        finally:
+            self.elapsed = time.perf_counter() - self.started_at
+
+    @property
+    def events_per_sec(self) -> float:
+        return self.events / self.elapsed if self.elapsed > 0 else 0.0
+
+    def report(self) -> str:
+        return (
+            f"events={self.events} elapsed={self.elapsed:.3f}s "
+            f"events/sec={self.events_per_sec:,.0f} peak_rss={peak_rss_bytes() / 1024 / 1024:.1f}MiB"
+        )
+
+
+if __name__ == "__main__":
+    # 使い方: python event_loader.py [events.json | events.ndjson]
+    import os
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    path = sys.argv[1] if len(sys.argv) > 1 else f"{script_dir}/events.json"
+
+    stats = ReplayStats()
+    for _ in stats.track(iter_events(path)):
+        pass
+    print(stats.report())
@@ -0,0 +1,216 @@
+from heapq import heappop, heappush, merge
+from itertools import count
+from typing import Any, Callable, Hashable, Iterable, Iterator
+
+from columnar_event_log import to_epoch_micros
+from lead_events import LeadEvent
+
+Key = Callable[[Any], Any]
+
+# 並べ替えバッファに保持するイベント数の上限
+MAX_BUFFER = 100_000
+
+
+# 時刻順 (同じ時刻はリード・event_id の順)
+# NOTE: タイムゾーン付きの datetime 同士の比較は遅いので、エポックマイクロ秒 (int) で比べる
+def by_timestamp(event: LeadEvent) -> tuple:
+    return (to_epoch_micros(event.timestamp), event.lead_id.value, event.event_id)
+
+
+# リードごとに event_id の順
+def by_lead_and_event_id(event: LeadEvent) -> tuple:
+    return (event.lead_id.value, event.event_id)
+
+
+#################################################
+# k-way merge (プル型)
+#################################################
+
+# それぞれ key の順に並んだ複数のソースを、全体を読み込まずに key の順で1本にする
+# NOTE: heapq.merge は各ソースの先頭1件ずつしか保持しないので、メモリはソース数に比例する
+def merge_ordered[E](sources: Iterable[Iterable[E]], key: Key = by_timestamp) -> Iterator[E]:
+    return merge(*sources, key=key)
+
+
+#################################################
+# Ordering Stage (プッシュ型)
+#################################################
+
+# 複数のプロデューサーから到着順に届くイベントを key の順に並べ直して送り出すステージ
+# NOTE: 各プロデューサーのイベントはそのプロデューサー内では key の順に届く前提。
+#       ウォーターマーク (全プロデューサーの最新の key の最小値) 以下のイベントは、
+#       以後それより小さい key のイベントが届かないので確定として送り出す。
+class OrderingStage[E]:
+    def __init__(self, producers: Iterable[Hashable], key: Key = by_timestamp, max_buffer: int = MAX_BUFFER):
+        self.key = key
+        self.max_buffer = max_buffer
+        # プロデューサー -> 最後に届いたイベント (またはハートビート) の key。まだ何も届いていなければ None
+        self.positions: dict[Hashable, Any] = {producer: None for producer in producers}
+        self._buffer: list[tuple[Any, int, E]] = []
+        self._sequence = count()  # 同じ key のイベントは到着順
+        self._last_key: Any = None
+        self.forced = 0  # バッファが溢れて、ウォーターマークを待たずに送り出したイベント数
+        self.late = 0    # 送り出し済みの key より小さい key で届いたイベント数 (順序を保証できない)
+        self.max_buffered = 0
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    # 全プロデューサーから届いた key の最小値。閉じたプロデューサーは除く
+    @property
+    def watermark(self) -> Any:
+        if any(position is None for position in self.positions.values()):
+            return None
+        return min(self.positions.values(), default=None)
+
+    # イベントを受け取り、順序が確定したイベントを返す
+    # NOTE: 知らない (閉じた) プロデューサーのイベントはバッファに入れる前に拒否する
+    #       (バッファに入れてから advance で失敗すると、ウォーターマークに関係なく残ったイベントが送り出される)
+    def push(self, producer: Hashable, event: E) -> list[E]:
+        self._check_producer(producer)
+        key = self.key(event)
+        if self._last_key is not None and key < self._last_key:
+            # 既に後ろのイベントを送り出してしまった: 並べ直せないのでそのまま流す
+            self.late += 1
+            return [event]
+        heappush(self._buffer, (key, next(self._sequence), event))
+        self.max_buffered = max(self.max_buffered, len(self._buffer))
+        return self.advance(producer, key)
+
+    # イベントのないプロデューサーのウォーターマークを進める (ハートビート)
+    def advance(self, producer: Hashable, key: Any) -> list[E]:
+        self._check_producer(producer)
+        position = self.positions[producer]
+        if position is None or position < key:
+            self.positions[producer] = key
+        return self._release()
+
+    # プロデューサーが終了した: 以後そのプロデューサーのイベントを待たない
+    def close(self, producer: Hashable) -> list[E]:
+        self._check_producer(producer)
+        del self.positions[producer]
+        if not self.positions:
+            return self.flush()
+        return self._release()
+
+    # バッファに残っているイベントを全て key の順に送り出す
+    def flush(self) -> list[E]:
+        released = []
+        while self._buffer:
+            released.append(self._pop())
+        return released
+
+    def _check_producer(self, producer: Hashable):
+        if producer not in self.positions:
+            raise KeyError(f"Unknown or closed producer: {producer}")
+
+    def _release(self) -> list[E]:
+        watermark = self.watermark
+        released = []
+        buffer = self._buffer
+        while buffer and watermark is not None and buffer[0][0] <= watermark:
+            released.append(self._pop())
+        while len(buffer) > self.max_buffer:
+            self.forced += 1
+            released.append(self._pop())
+        return released
+
+    def _pop(self) -> E:
+        key, _, event = heappop(self._buffer)
+        self._last_key = key
+        return event
+
+
+# (プロデューサー, イベント) の到着順のストリームを key の順の generator にする
+def reorder[E](
+    arrivals: Iterable[tuple[Hashable, E]],
+    producers: Iterable[Hashable],
+    key: Key = by_timestamp,
+    max_buffer: int = MAX_BUFFER,
+) -> Iterator[E]:
+    stage: OrderingStage[E] = OrderingStage(producers, key, max_buffer)
+    for producer, event in arrivals:
+        yield from stage.push(producer, event)
+    yield from stage.flush()
+
+
+if __name__ == "__main__":
+    # 使い方: python event_ordering.py [リード数] [プロデューサー数]
+    from datetime import timedelta
+    import json
+    import os
+    import random
+    import sys
+    import time
+
+    from event_decoder import decode_json
+    from event_sourcing import LeadStateModelProjection
+    from lead_events import LeadID
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(f"{script_dir}/events.json", "r", encoding="utf-8") as f:
+        template = json.load(f)
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    producers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    # リードごとに開始時刻をずらした合成データを、プロデューサーに振り分ける
+    # NOTE: 同じリードのイベントも別々のプロデューサーから届く (架電と注文受領は別システム等)
+    events = decode_json(json.dumps([{**event, "lead-id": lead} for lead in range(leads) for event in template]))
+    offsets: dict[LeadID, timedelta] = {}
+    random.seed(0)
+    shifted = []
+    for event in events:
+        offset = offsets.setdefault(event.lead_id, timedelta(minutes=random.randrange(60 * 24 * 30)))
+        shifted.append(event.model_copy(update={"timestamp": event.timestamp + offset}))
+    streams: list[list[LeadEvent]] = [[] for _ in range(producers)]
+    for event in shifted:
+        streams[event.event_id % producers].append(event)
+    for stream in streams:
+        stream.sort(key=by_timestamp)  # 各プロデューサー内では時刻順
+
+    # 到着順: プロデューサーをランダムに選んで、その先頭のイベントが届く
+    arrivals: list[tuple[int, LeadEvent]] = []
+    heads = [0] * producers
+    while len(arrivals) < len(shifted):
+        producer = random.choice([p for p in range(producers) if heads[p] < len(streams[p])])
+        arrivals.append((producer, streams[producer][heads[producer]]))
+        heads[producer] += 1
+
+    def project(ordered: Iterable[LeadEvent]) -> dict:
+        projections: dict = {}
+        for event in ordered:
+            projection = projections.get(event.lead_id)
+            if projection is None:
+                projection = projections[event.lead_id] = LeadStateModelProjection.empty()
+            projection.apply(event)
+        return projections
+
+    expected = sorted(shifted, key=by_timestamp)
+
+    start = time.perf_counter()
+    merged = list(merge_ordered(streams))
+    print(f"merge_ordered : {time.perf_counter() - start:.3f}s")
+    assert merged == expected
+
+    stage: OrderingStage[LeadEvent] = OrderingStage(range(producers), max_buffer=10_000)
+    start = time.perf_counter()
+    ordered = [e for producer, event in arrivals for e in stage.push(producer, event)] + stage.flush()
+    elapsed = time.perf_counter() - start
+    print(f"OrderingStage : {elapsed:.3f}s {len(arrivals) / elapsed:,.0f} events/sec max_buffered={stage.max_buffered} forced={stage.forced} late={stage.late}")
+    assert ordered == expected
+
+    # 閉じたプロデューサーのイベントはバッファに入れずに拒否する
+    stage = OrderingStage(range(2))
+    stage.close(1)
+    try:
+        stage.push(1, expected[0])
+    except KeyError as e:
+        print(e)  # 'Unknown or closed producer: 1'
+    assert len(stage) == 0 and stage.push(0, expected[0]) == [expected[0]]
+
+    # 到着順にそのまま適用すると、リード内の順序が崩れて誤った状態になる
+    correct = project(expected)
+    assert project(reorder(arrivals, range(producers))) == correct
+    unordered = project(event for _, event in arrivals)
+    wrong = sum(unordered[lead_id] != projection for lead_id, projection in correct.items())
+    print(f"events={len(arrivals)} producers={producers} leads with wrong state when applied in arrival order={wrong}/{leads}")
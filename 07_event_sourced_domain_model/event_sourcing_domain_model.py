@@ -1,7 +1,12 @@
 from pydantic import BaseModel, Field, computed_field, ConfigDict
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 from datetime import datetime
 from functools import singledispatchmethod
+from typing import Any, ClassVar
 import enum
+import sys
+import threading
 from uuid import uuid4, UUID
 
 class TicketID(BaseModel):
@@ -20,6 +25,11 @@ class EscalatedEvent(DomainEvent):
 class ClosedEvent(DomainEvent):
     pass
 
+# イベント名 -> イベントのクラス (永続化したイベントの復元に使う)
+EVENT_TYPES: dict[str, type[DomainEvent]] = {
+    event_class.__name__: event_class for event_class in (InitializedEvent, EscalatedEvent, ClosedEvent)
+}
+
 class TicketStateEnum(str, enum.Enum):
     OPEN = "open"
     ESCALATED = "escalated"
@@ -29,6 +39,10 @@ class TicketStateEnum(str, enum.Enum):
 # Entity
 ################################
 class TicketState(BaseModel):
+    # スナップショットのスキーマバージョン
+    # NOTE: フィールドを追加・変更したら上げる。古いバージョンのスナップショットは無視される
+    snapshot_schema_version: ClassVar[int] = 1
+
     id: TicketID
     version: int = Field(default=0)
     state: TicketStateEnum = Field(default=TicketStateEnum.OPEN)
@@ -65,8 +79,10 @@ class Ticket(BaseModel):
     state: TicketState
 
     @classmethod
-    def from_events(cls, ticket_id: TicketID, events: list[DomainEvent]):
-        ticket = cls(state=TicketState(id=ticket_id), domain_events=[])
+    def from_events(cls, ticket_id: TicketID, events: list[DomainEvent], snapshot: TicketState | None = None):
+        # スナップショットがあればそこから、なければ初期状態から再構築する
+        state = snapshot.model_copy(deep=True) if snapshot else TicketState(id=ticket_id)
+        ticket = cls(state=state, domain_events=[])
         # 永続化されている過去イベントで状態を再構築 (domain_events には積まない)
         for event in events:
             ticket.state.apply(event)
@@ -90,45 +106,273 @@ class Ticket(BaseModel):
 
 
 
+################################
+# スナップショット
+################################
+class TicketSnapshot(BaseModel):
+    ticket_id: TicketID
+    schema_version: int
+    position: int          # スナップショットに含まれるイベント数 (ストリーム上の位置)
+    state: dict[str, Any]  # TicketState をシリアライズしたもの
+    model_config = ConfigDict(frozen=True)
+
+    @classmethod
+    def take(cls, state: TicketState, position: int) -> "TicketSnapshot":
+        return cls(
+            ticket_id=state.id,
+            schema_version=TicketState.snapshot_schema_version,
+            position=position,
+            state=state.model_dump(mode="json"),
+        )
+
+    def restore(self) -> TicketState:
+        return TicketState.model_validate(self.state)
+
+
+# スナップショットを取るタイミングを決めるポリシー
+class SnapshotPolicy(ABC):
+    @abstractmethod
+    def should_take_snapshot(self, ticket: Ticket, events_since_snapshot: int) -> bool: ...
+
+# スナップショットを取らない
+class NoSnapshotPolicy(SnapshotPolicy):
+    def should_take_snapshot(self, ticket: Ticket, events_since_snapshot: int) -> bool:
+        return False
+
+# 前回のスナップショットから K 件以上イベントが増えたらスナップショットを取る
+class EveryKEventsSnapshotPolicy(SnapshotPolicy):
+    def __init__(self, k: int):
+        if k <= 0:
+            raise ValueError("k must be positive")
+        self.k = k
+
+    def should_take_snapshot(self, ticket: Ticket, events_since_snapshot: int) -> bool:
+        return events_since_snapshot >= self.k
+
+
+################################
+# 集約のキャッシュ
+################################
+# 再構築した TicketState をストリーム上の位置 (イベント数) と一緒に保持する LRU キャッシュ
+# NOTE: ヒットしても位置より後ろのイベントだけは読み込んで適用するので、古い状態を返すことはない
+class TicketStateCache:
+    def __init__(self, max_entries: int = 10_000, max_bytes: int | None = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        # ストリームID -> (位置, 状態, 見積もりバイト数)。末尾ほど最近使ったもの
+        self._entries: OrderedDict[UUID, tuple[int, TicketState, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, ticket_id: TicketID) -> tuple[int, TicketState] | None:
+        with self._lock:
+            entry = self._entries.get(ticket_id.value)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(ticket_id.value)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, ticket_id: TicketID, position: int, state: TicketState):
+        # NOTE: TicketState のフィールドは不変な値だけなので浅いコピーで呼び出し側の変更から切り離せる
+        state = state.model_copy()
+        size = _sizeof(state)
+        with self._lock:
+            old = self._entries.pop(ticket_id.value, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            self._entries[ticket_id.value] = (position, state, size)
+            self.nbytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def invalidate(self, ticket_id: TicketID):
+        with self._lock:
+            entry = self._entries.pop(ticket_id.value, None)
+            if entry is not None:
+                self.nbytes -= entry[2]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+# キャッシュのエントリが使うメモリの見積もり (インスタンス + フィールドの辞書 + 各フィールドの値)
+def _sizeof(state: TicketState) -> int:
+    return (
+        sys.getsizeof(state) + sys.getsizeof(state.__dict__)
+        + sum(sys.getsizeof(value) for value in state.__dict__.values())
+    )
+
+
 ################################
 # リポジトリ
 ################################
-class TicketsRepository:
-    def __init__(self):
-        self.store = {}  # In-memory store, in real-world use a database
+# 楽観的排他制御の競合 (expected_version がストリームの長さと一致しない)
+# NOTE: 既存の呼び出し元が ValueError で捕まえられるように ValueError を継承する
+class ConcurrencyConflictError(ValueError):
+    def __init__(self, message: str = "Concurrency conflict detected"):
+        super().__init__(message)
 
-    # イベントのロード
-    def load_events(self, ticket_id: TicketID) -> list[DomainEvent]:
-        return self.store.get(ticket_id.value, [])
+
+LOCK_STRIPES = 64
+
+class TicketsRepository:
+    def __init__(
+        self,
+        snapshot_policy: SnapshotPolicy | None = None,
+        lock_stripes: int = LOCK_STRIPES,
+        state_cache: TicketStateCache | None = None,
+    ):
+        self._init_store()
+        self.snapshot_policy = snapshot_policy or NoSnapshotPolicy()
+        self.state_cache = state_cache
+        # ストリームごとのロック (ストライピング)
+        # NOTE: ストリームIDのハッシュで固定数のロックに振り分ける。
+        #       チケットごとにロックを作らずに済み、無関係なチケットの追記は並行して進む
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+
+    # イベント・スナップショットの保存先 (インメモリ)
+    # NOTE: ファイル・DBに保存するサブクラスはオーバーライドして、使わない dict を作らない
+    def _init_store(self):
+        self.store: dict[UUID, list[DomainEvent]] = {}  # In-memory store, in real-world use a database
+        self.snapshots: dict[UUID, TicketSnapshot] = {}
+
+    def _lock_for(self, ticket_id: TicketID) -> threading.Lock:
+        return self._locks[hash(ticket_id.value) % len(self._locks)]
+
+    # イベントのロード (start 番目以降)
+    def load_events(self, ticket_id: TicketID, start: int = 0) -> list[DomainEvent]:
+        return self.store.get(ticket_id.value, [])[start:]
 
     # イベントの保存
+    # NOTE: バージョンの確認と追記をストリームのロックの中で行う (compare-and-append)
     def save_events(self, ticket_id: TicketID, events: list[DomainEvent], expected_version: int):
-        current_events = self.store.get(ticket_id.value, [])
-
-        if len(current_events) != expected_version:
-            raise ValueError("Concurrency conflict detected")
-        current_events.extend(events)
-        self.store[ticket_id.value] = current_events
+        with self._lock_for(ticket_id):
+            current_events = self.store.get(ticket_id.value, [])
+
+            if len(current_events) != expected_version:
+                raise ConcurrencyConflictError()
+            current_events.extend(events)
+            self.store[ticket_id.value] = current_events
+
+    # ストリームの長さ (保存済みのイベント数)
+    def stream_length(self, ticket_id: TicketID) -> int:
+        return len(self.store.get(ticket_id.value, []))
+
+    # スナップショットの保存
+    def save_snapshot(self, snapshot: TicketSnapshot):
+        self.snapshots[snapshot.ticket_id.value] = snapshot
+
+    # 最新のスナップショットのロード (スキーマが古いものは無視する)
+    def load_snapshot(self, ticket_id: TicketID) -> TicketSnapshot | None:
+        snapshot = self.snapshots.get(ticket_id.value)
+        if snapshot is None or snapshot.schema_version != TicketState.snapshot_schema_version:
+            return None
+        return snapshot
+
+    # 集約のロード: キャッシュ or 最新のスナップショット + それ以降のイベントで再構築する
+    def load_ticket(self, ticket_id: TicketID) -> Ticket:
+        return self.load_tickets([ticket_id])[ticket_id]
+
+    # 複数の集約をまとめてロードする (イベントは load_events_many で一度に読む)
+    def load_tickets(self, ticket_ids: list[TicketID]) -> dict[TicketID, Ticket]:
+        bases = {ticket_id: self._load_base_state(ticket_id) for ticket_id in ticket_ids}
+        events = self.load_events_many({ticket_id: position for ticket_id, (position, _, _) in bases.items()})
+        tickets = {}
+        for ticket_id, (position, state, cached) in bases.items():
+            tickets[ticket_id] = ticket = Ticket.from_events(ticket_id, events[ticket_id], snapshot=state)
+            if self.state_cache is not None and (not cached or events[ticket_id]):
+                self.state_cache.put(ticket_id, position + len(events[ticket_id]), ticket.state)
+        return tickets
+
+    # 再構築の起点: (ストリーム上の位置, 状態, キャッシュから取ったか)
+    # キャッシュ -> スナップショット -> 初期状態 の順に探す
+    def _load_base_state(self, ticket_id: TicketID) -> tuple[int, TicketState | None, bool]:
+        cached = self.state_cache.get(ticket_id) if self.state_cache is not None else None
+        if cached is not None:
+            return cached[0], cached[1], True
+        snapshot = self.load_snapshot(ticket_id)
+        if snapshot is not None:
+            return snapshot.position, snapshot.restore(), False
+        return 0, None, False
+
+    # 複数ストリームのイベントのロード (ストリームID -> start 番目以降)
+    # NOTE: DBなどに保存する実装は1回の問い合わせで読むようにオーバーライドする
+    def load_events_many(self, starts: dict[TicketID, int]) -> dict[TicketID, list[DomainEvent]]:
+        return {ticket_id: self.load_events(ticket_id, start=start) for ticket_id, start in starts.items()}
+
+    # 複数ストリームへの追記 (ストリームID, イベント, expected_version)。競合したストリームのIDを返す
+    # NOTE: 競合したストリーム以外の追記は行う (ストリームをまたいだアトミック性はない)
+    def save_events_many(self, appends: list[tuple[TicketID, list[DomainEvent], int]]) -> set[TicketID]:
+        conflicts = set()
+        for ticket_id, events, expected_version in appends:
+            try:
+                self.save_events(ticket_id, events, expected_version)
+            except ConcurrencyConflictError:
+                conflicts.add(ticket_id)
+        return conflicts
 
     # チケットの変更をコミット
     def commit_changes(self, ticket: Ticket, original_version: int):
-        self.save_events(ticket.state.id, ticket.domain_events, original_version)
-        ticket.domain_events.clear()
+        if self.commit_changes_many([(ticket, original_version)]):
+            raise ConcurrencyConflictError()
+
+    # 複数チケットの変更をまとめてコミットする。競合したチケットのIDを返す
+    def commit_changes_many(self, changes: list[tuple[Ticket, int]]) -> set[TicketID]:
+        conflicts = self.save_events_many(
+            [(ticket.state.id, ticket.domain_events, original_version) for ticket, original_version in changes]
+        )
+        for ticket, original_version in changes:
+            if ticket.state.id in conflicts:
+                # 他のライターが先に追記した: キャッシュの状態はもう最新ではないので捨てる
+                if self.state_cache is not None:
+                    self.state_cache.invalidate(ticket.state.id)
+                continue
+            # NOTE: 追記が成功したので、このコミットで書いたイベントの直後の位置は original_version + 件数で確定している。
+            #       ロックを抜けた後に stream_length() を読むと、他のライターの追記を含んだ位置になってしまう
+            position = original_version + len(ticket.domain_events)
+            if self.state_cache is not None and ticket.domain_events:
+                self.state_cache.put(ticket.state.id, position, ticket.state)
+            ticket.domain_events.clear()
+            self._take_snapshot_if_needed(ticket, position)
+        return conflicts
+
+    # position: ticket.state に含まれるイベント数 (ストリーム上の位置)
+    def _take_snapshot_if_needed(self, ticket: Ticket, position: int):
+        snapshot = self.load_snapshot(ticket.state.id)
+        events_since_snapshot = position - (snapshot.position if snapshot else 0)
+        if self.snapshot_policy.should_take_snapshot(ticket, events_since_snapshot):
+            self.save_snapshot(TicketSnapshot.take(ticket.state, position))
 
 
 ################################
 # API
 ################################
+class EscalationOutcome(str, enum.Enum):
+    ESCALATED = "escalated"  # エスカレートした
+    NO_OP = "no_op"          # エスカレートの条件を満たさない (既にエスカレート済み・クローズ済み)
+    CONFLICT = "conflict"    # 他の書き込みと競合した
+
+
 class TicketAPI:
     def __init__(self, tickets_repository: TicketsRepository):
         self.tickets_repository = tickets_repository
 
     # チケットのエスカレーション要求API
     def request_escalation(self, id: TicketID):
-        # イベントを取得
-        events = self.tickets_repository.load_events(id)
-        # 集約を再構築
-        ticket = Ticket.from_events(id, events)
+        # 集約を再構築 (スナップショットがあればそれ以降のイベントのみ適用)
+        ticket = self.tickets_repository.load_ticket(id)
         # 楽観的排他制御のため、現在のバージョンを保存
         original_version = ticket.version
         # エスカレーションコマンドを実行
@@ -136,9 +380,29 @@ class TicketAPI:
         # 変更を保存
         self.tickets_repository.commit_changes(ticket, original_version)
 
+    # 複数チケットのエスカレーション要求API (SLA の一括チェック等)
+    # NOTE: 集約のロードと追記をそれぞれまとめて行い、1件の競合でバッチ全体を失敗させずにチケットごとの結果を返す
+    def request_escalations(self, ids: list[TicketID]) -> dict[TicketID, EscalationOutcome]:
+        tickets = self.tickets_repository.load_tickets(list(dict.fromkeys(ids)))
+        changes = []
+        outcomes = {}
+        for ticket_id, ticket in tickets.items():
+            original_version = ticket.version
+            ticket.request_escalation()
+            if ticket.domain_events:
+                changes.append((ticket, original_version))
+            else:
+                outcomes[ticket_id] = EscalationOutcome.NO_OP
+        conflicts = self.tickets_repository.commit_changes_many(changes)
+        for ticket, _ in changes:
+            ticket_id = ticket.state.id
+            outcomes[ticket_id] = EscalationOutcome.CONFLICT if ticket_id in conflicts else EscalationOutcome.ESCALATED
+        return {ticket_id: outcomes[ticket_id] for ticket_id in tickets}
+
 
 if __name__ == "__main__":
-    repo = TicketsRepository()
+    # 1イベントごとにスナップショットを取る
+    repo = TicketsRepository(snapshot_policy=EveryKEventsSnapshotPolicy(k=1))
     ticket_id = TicketID()
 
     # チケットIDを生成
@@ -158,4 +422,149 @@ if __name__ == "__main__":
     # チケットの状態を確認
     events = repo.load_events(ticket_id)
     ticket = Ticket.from_events(ticket_id, events)
-    print(ticket.state)  # id=TicketID(value=UUID('...')) version=1 state=<TicketStateEnum.ESCALATED: 'escalated'> remaining_time_percentage=100.0 is_escalated=True
\ No newline at end of file
+    print(ticket.state)  # id=TicketID(value=UUID('...')) version=1 state=<TicketStateEnum.ESCALATED: 'escalated'> remaining_time_percentage=100.0 is_escalated=True
+
+    # スナップショット + 以降のイベントで再構築
+    print(repo.load_snapshot(ticket_id))  # ticket_id=TicketID(value=UUID('...')) schema_version=1 position=1 state={...}
+    print(repo.load_ticket(ticket_id).state)  # id=TicketID(value=UUID('...')) version=1 state=<TicketStateEnum.ESCALATED: 'escalated'> remaining_time_percentage=100.0 is_escalated=True
+
+    # TicketState のスキーマが変わると古いスナップショットは無視され、全イベントから再構築される
+    TicketState.snapshot_schema_version = 2
+    print(repo.load_snapshot(ticket_id))  # None
+    TicketState.snapshot_schema_version = 1
+
+    # 追記の直後 (スナップショットを取る前) に別のライターが追記しても、スナップショットの位置はずれない
+    class RacingRepository(TicketsRepository):
+        def save_events_many(self, appends):
+            conflicts = super().save_events_many(appends)
+            for racing_id, _, _ in appends:
+                super().save_events_many([(racing_id, [ClosedEvent(timestamp=datetime.now())], self.stream_length(racing_id))])
+            return conflicts
+
+    racing_repo = RacingRepository(snapshot_policy=EveryKEventsSnapshotPolicy(k=1))
+    racing_ticket = Ticket.from_events(ticket_id, [])
+    racing_ticket.append_event(InitializedEvent(timestamp=datetime.now()))
+    racing_repo.commit_changes(racing_ticket, original_version=0)
+    snapshot = racing_repo.load_snapshot(ticket_id)
+    assert snapshot is not None and snapshot.position == 1
+    assert racing_repo.load_ticket(ticket_id).state.state == TicketStateEnum.CLOSED
+
+    ################################
+    # 並行書き込みのベンチマーク
+    # 使い方: python event_sourcing_domain_model.py [スレッド数] [スレッドあたりの保存回数] [チケット数]
+    ################################
+    from concurrent.futures import ThreadPoolExecutor
+    import random
+    import time
+
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    saves_per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    tickets = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+    now = datetime.now()
+
+    def contention_benchmark(
+        repo: TicketsRepository, ticket_ids: list[TicketID], saves: int
+    ) -> tuple[float, int, int]:
+        def writer(seed: int) -> tuple[int, int]:
+            rng = random.Random(seed)
+            appended = conflicts = 0
+            for _ in range(saves):
+                ticket_id = rng.choice(ticket_ids)
+                expected_version = repo.stream_length(ticket_id)
+                time.sleep(0)  # 集約の再構築・コマンドの実行の間に他のスレッドへ切り替わる状況を再現する
+                try:
+                    repo.save_events(ticket_id, [EscalatedEvent(timestamp=now)], expected_version)
+                    appended += 1
+                except ConcurrencyConflictError:
+                    conflicts += 1
+            return appended, conflicts
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(writer, range(threads)))
+        elapsed = time.perf_counter() - start
+        appended = sum(a for a, _ in results)
+        conflicts = sum(c for _, c in results)
+        # 成功した追記の数とストリームの長さが一致する (二重に通った追記がない)
+        assert sum(repo.stream_length(t) for t in ticket_ids) == appended
+        return elapsed, appended, conflicts
+
+    # ストアへの書き込み (DB・ファイルの I/O) の代わりに、ストリームのロックを取った後 GIL を手放して待つ
+    write_latency = 0.0005
+
+    class _SlowLock:
+        def __init__(self, lock):
+            self._lock = lock
+
+        def __enter__(self):
+            self._lock.acquire()
+            time.sleep(write_latency)
+
+        def __exit__(self, *exc_info):
+            self._lock.release()
+
+    class SimulatedIORepository(TicketsRepository):
+        def _lock_for(self, ticket_id):
+            return _SlowLock(super()._lock_for(ticket_id))
+
+    # NOTE: インメモリの追記はロックの中の処理がごく短く GIL に律速されるので、ストライピングしても速くならない
+    #       (ロックの取り合いより GIL の取り合いが支配的)。ストライピングが効くのは、ロックの中で I/O を待つ場合
+    print()
+    for label, repository_class, ticket_count, lock_stripes, saves in [
+        ("in-memory hot (1 ticket)", TicketsRepository, 1, LOCK_STRIPES, saves_per_thread),
+        ("in-memory striped      ", TicketsRepository, tickets, LOCK_STRIPES, saves_per_thread),
+        ("in-memory single lock  ", TicketsRepository, tickets, 1, saves_per_thread),
+        ("store I/O striped      ", SimulatedIORepository, tickets, LOCK_STRIPES, max(1, saves_per_thread // 100)),
+        ("store I/O single lock  ", SimulatedIORepository, tickets, 1, max(1, saves_per_thread // 100)),
+    ]:
+        elapsed, appended, conflicts = contention_benchmark(
+            repository_class(lock_stripes=lock_stripes), [TicketID() for _ in range(ticket_count)], saves
+        )
+        print(
+            f"{label} threads={threads} tickets={ticket_count} "
+            f"appends/sec={appended / elapsed:,.0f} conflicts={conflicts / (threads * saves):.1%}"
+        )
+    print("NOTE: in-memory appends are GIL-bound, so lock striping only pays off when the critical section waits on store I/O")
+
+    ################################
+    # 集約キャッシュのベンチマーク
+    # NOTE: イベントの多いホットなチケットに対してコマンドを繰り返す
+    ################################
+    hot_ticket_ids = [TicketID() for _ in range(100)]
+    history: list[DomainEvent] = [EscalatedEvent(timestamp=now)] * 1_000
+
+    def load_benchmark(repo: TicketsRepository) -> float:
+        for ticket_id in hot_ticket_ids:
+            repo.save_events(ticket_id, history, expected_version=0)
+        rng = random.Random(0)
+        start = time.perf_counter()
+        for _ in range(1_000):
+            TicketAPI(repo).request_escalation(rng.choice(hot_ticket_ids))
+        return time.perf_counter() - start
+
+    print()
+    print(f"load_ticket (no cache): {load_benchmark(TicketsRepository()):.3f}s")
+    cache = TicketStateCache(max_entries=len(hot_ticket_ids))
+    elapsed = load_benchmark(TicketsRepository(state_cache=cache))
+    print(
+        f"load_ticket (cache)   : {elapsed:.3f}s hits={cache.hits} misses={cache.misses} "
+        f"hit_rate={cache.hit_rate:.1%} evictions={cache.evictions} entries={len(cache)} nbytes={cache.nbytes:,}"
+    )
+
+    ################################
+    # 一括エスカレーション
+    ################################
+    from collections import Counter
+
+    repo = TicketsRepository()
+    sweep_ticket_ids = [TicketID() for _ in range(10_000)]
+    for ticket_id in sweep_ticket_ids[::3]:
+        repo.save_events(ticket_id, [EscalatedEvent(timestamp=now)], expected_version=0)  # エスカレート済み
+
+    start = time.perf_counter()
+    outcomes = TicketAPI(repo).request_escalations(sweep_ticket_ids)
+    elapsed = time.perf_counter() - start
+    print()
+    print(f"request_escalations: tickets={len(sweep_ticket_ids):,} elapsed={elapsed:.3f}s {dict(Counter(o.value for o in outcomes.values()))}")
+    # 2回目は全て NO_OP
+    print(Counter(o.value for o in TicketAPI(repo).request_escalations(sweep_ticket_ids).values()))  # Counter({'no_op': 10000})
@@ -1,70 +1,26 @@
 from functools import singledispatchmethod
 from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, computed_field
 from datetime import datetime
-import enum
-import json
+from typing import ClassVar
+import sys
 
-
-#################################################
-# Value Object
-#################################################
-
-class LeadID(BaseModel):
-    value: str
-    model_config = ConfigDict(frozen=True)
-
-class Name(BaseModel):
-    value: str
-    model_config = ConfigDict(frozen=True)
-    
-class LeadStatusEnum(str, enum.Enum):
-    NEW_LEAD = "new_lead"
-    FOLLOWUP_SET = "followup_set"
-    PENDING_PAYMENT = "pending_payment"
-    CONVERTED = "converted"
-    CLOSED = "closed"
-
-class LeadStatus(BaseModel):
-    value: LeadStatusEnum
-    model_config = ConfigDict(frozen=True)
-
-class PhoneNumber(BaseModel):
-    value: str
-    model_config = ConfigDict(frozen=True)
-
-
-class LeadEvent(BaseModel):
-    lead_id: LeadID
-    event_id: int
-    timestamp: datetime
-    model_config = ConfigDict(frozen=True)
-
-class LeadInitializedEvent(LeadEvent):
-    name: Name
-    phone_number: PhoneNumber
-    status: LeadStatus = Field(default=LeadStatus(value=LeadStatusEnum.NEW_LEAD))
-
-class ContactedEvent(LeadEvent):
-    pass
-
-class FollowupSetEvent(LeadEvent):
-    status: LeadStatus = Field(default=LeadStatus(value=LeadStatusEnum.FOLLOWUP_SET))
-
-class ContactDetailsChangedEvent(LeadEvent):
-    name: Name
-    phone_number: PhoneNumber
-
-class OrderSubmittedEvent(LeadEvent):
-    status: LeadStatus = Field(default=LeadStatus(value=LeadStatusEnum.PENDING_PAYMENT))
-
-class PaymentConfirmedEvent(LeadEvent):
-    status: LeadStatus = Field(default=LeadStatus(value=LeadStatusEnum.CONVERTED))
+from event_decoder import decode_records
+from event_loader import iter_events, ReplayStats
+from lead_search_index import LeadSearchIndex
+from lead_events import (
+    LeadID, Name, LeadStatusEnum, LeadStatus, PhoneNumber,
+    LeadInitializedEvent, ContactedEvent, FollowupSetEvent,
+    ContactDetailsChangedEvent, OrderSubmittedEvent, PaymentConfirmedEvent,
+)
 
 
 #################################################
 # Entity・Aggregate
 #################################################
 class LeadStateModelProjection(BaseModel):
+    # apply で読むイベントのフィールド (lazy_events.decode_lazy はこれ以外のフィールドを変換しない)
+    event_fields: ClassVar[frozenset[str]] = frozenset({"lead_id", "timestamp", "name", "phone_number"})
+
     lead_id: LeadID
     __names: dict[Name, bool] = PrivateAttr(default_factory=dict)
     status: LeadStatus
@@ -79,6 +35,14 @@ class LeadStateModelProjection(BaseModel):
         validate_assignment=True, # 属性の再代入時にもバリデーションを行う
     )
 
+    # イベント適用前の空の状態 (LeadInitializedEvent で上書きされる)
+    @classmethod
+    def empty(cls) -> "LeadStateModelProjection":
+        return cls(
+            lead_id=LeadID(value=""),
+            status=LeadStatus(value=LeadStatusEnum.NEW_LEAD),
+        )
+
     @computed_field
     @property
     def name(self) -> Name | None:
@@ -148,57 +112,22 @@ class LeadStateModelProjection(BaseModel):
         self.version += 1
 
 if __name__ == "__main__":
-    # events.jsonからイベントを読み込む
+    # events.jsonからイベントを1件ずつ読み込む (ファイル全体はメモリに載せない)
     script_dir = __import__("os").path.dirname(__import__("os").path.abspath(__file__))
-    with open(f"{script_dir}/events.json", "r", encoding="utf-8") as f:
-        events_json = json.load(f)
-
-    # イベントをLeadEventインスタンスに変換
-    events = []
-    for event in events_json:
-        event_type = event["event-type"]
-        lead_id = LeadID(value=str(event["lead-id"]))
-        event_id = event["event-id"]
-        timestamp = datetime.fromisoformat(event["timestamp"].replace("Z", "+00:00"))
-        if event_type == "新規登録":
-            e = LeadInitializedEvent(
-                lead_id=lead_id,
-                event_id=event_id,
-                name=Name(value=event["name"]),
-                phone_number=PhoneNumber(value=event["phone-number"]),
-                timestamp=timestamp,
-            )
-        elif event_type == "架電":
-            e = ContactedEvent(lead_id=lead_id, event_id=event_id, timestamp=timestamp)
-        elif event_type == "商談予定設定":
-            e = FollowupSetEvent(lead_id=lead_id, event_id=event_id, timestamp=timestamp)
-        elif event_type == "連絡先変更":
-            e = ContactDetailsChangedEvent(
-                lead_id=lead_id,
-                event_id=event_id,
-                name=Name(value=event["name"]),
-                phone_number=PhoneNumber(value=event["phone-number"]),
-                timestamp=timestamp,
-            )
-        elif event_type == "注文受領":
-            e = OrderSubmittedEvent(lead_id=lead_id, event_id=event_id, timestamp=timestamp)
-        elif event_type == "支払完了":
-            e = PaymentConfirmedEvent(lead_id=lead_id, event_id=event_id, timestamp=timestamp)
-        else:
-            raise ValueError(f"Unknown event type: {event_type}")
-        events.append(e)
-
-    # イベントID順でソート
-    sorted(events, key=lambda e: e.event_id)
-
-
-    lead_state = LeadStateModelProjection(
-        lead_id=LeadID(value=""),
-        status=LeadStatus(value=LeadStatusEnum.NEW_LEAD),
-    )
+    path = sys.argv[1] if len(sys.argv) > 1 else f"{script_dir}/events.json"
+
+    lead_state = LeadStateModelProjection.empty()
+    # 全リードを横断する検索インデックス
+    search_index = LeadSearchIndex()
 
-    # イベントを適用して状態を再構築
-    for e in events:
+    # イベントをLeadEventインスタンスに変換し、そのまま適用して状態を再構築
+    stats = ReplayStats()
+    for e in decode_records(stats.track(iter_events(path))):
         lead_state.apply(e)
+        search_index.apply(e)
 
-    print(lead_state)  # lead_id=LeadID(value='12') status=LeadStatus(value=<LeadStatusEnum.CONVERTED: 'converted'>) follow_up_on=None created_on=datetime.datetime(2020, 5, 20, 9, 52, 55, 950000, tzinfo=datetime.timezone.utc) updated_on=datetime.datetime(2020, 5, 27, 12, 38, 44, 120000, tzinfo=datetime.timezone.utc) version=6 name=Name(value='小林裕美') phone_number=PhoneNumber(value='555-8101')
\ No newline at end of file
+    print(lead_state)  # lead_id=LeadID(value='12') status=LeadStatus(value=<LeadStatusEnum.CONVERTED: 'converted'>) follow_up_on=None created_on=datetime.datetime(2020, 5, 20, 9, 52, 55, 950000, tzinfo=TzInfo(0)) updated_on=datetime.datetime(2020, 5, 27, 12, 38, 44, 120000, tzinfo=TzInfo(0)) version=6 name=Name(value='小林裕美') phone_number=PhoneNumber(value='555-8101')
+    print(search_index.search_name(Name(value="小林浩美")))  # {LeadID(value='12')}
+    print(search_index.search_name_fuzzy(Name(value="小林裕美")))  # [(LeadID(value='12'), 1.0)]
+    print(search_index.search_phone_number_partial("2951"))  # {LeadID(value='12')}
+    print(stats.report(), file=sys.stderr)
@@ -0,0 +1,343 @@
+from uuid import UUID
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from event_sourcing_domain_model import (
+    ConcurrencyConflictError, EVENT_TYPES, LOCK_STRIPES, DomainEvent, SnapshotPolicy, TicketID, TicketSnapshot,
+    TicketState, TicketStateCache, TicketsRepository,
+)
+
+# レコードヘッダ: ストリームID (UUID 16byte), ペイロード長 (4byte), ペイロードのCRC32 (4byte)
+HEADER = struct.Struct("<16sII")
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+def encode_event(event: DomainEvent) -> bytes:
+    return json.dumps(
+        {"type": type(event).__name__, "data": event.model_dump(mode="json")},
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def decode_event(payload: bytes) -> DomainEvent:
+    record = json.loads(payload)
+    return EVENT_TYPES[record["type"]].model_validate(record["data"])
+
+
+#################################################
+# Segment
+#################################################
+
+# 追記専用のセグメントファイル (segment-00000000.log, segment-00000001.log, ...)
+class Segment:
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self._map: mmap.mmap | None = None
+        # NOTE: マップし直し (古いマップを閉じる) と読み出しが並行すると、閉じたマップを読んでしまうので直列化する。
+        #       読み出しは必要な範囲のコピーだけなので、ロックを持つ時間は短い
+        self._map_lock = threading.Lock()
+
+    # offset から length バイトを読む
+    # NOTE: セグメント全体を読み込まず、mmap から必要な範囲だけをコピーする
+    def read(self, offset: int, length: int) -> bytes:
+        end = offset + length
+        with self._map_lock:
+            if self._map is None or len(self._map) < end:
+                # 追記で伸びたセグメントはマップし直す
+                self._close_map()
+                with open(self.path, "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map[offset:end]
+
+    def close(self):
+        with self._map_lock:
+            self._close_map()
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+#################################################
+# Repository
+#################################################
+
+# イベントを追記専用のセグメントファイルに永続化するリポジトリ
+# NOTE: load_events / save_events のインターフェースは TicketsRepository と同じ
+class FileTicketsRepository(TicketsRepository):
+    def __init__(
+        self,
+        directory: str,
+        segment_size: int = SEGMENT_SIZE,
+        fsync: bool = False,
+        snapshot_policy: SnapshotPolicy | None = None,
+        lock_stripes: int = LOCK_STRIPES,
+        state_cache: TicketStateCache | None = None,
+    ):
+        super().__init__(snapshot_policy=snapshot_policy, lock_stripes=lock_stripes, state_cache=state_cache)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        # ストリームID -> 各イベントの (セグメント番号, オフセット, ペイロード長)
+        self.index: dict[UUID, list[tuple[int, int, int]]] = {}
+        self.segments: list[Segment] = []
+        # NOTE: 全ストリームが同じセグメントに追記するので、ファイルへの追記は1本のロックで直列化する
+        self._append_lock = threading.Lock()
+
+        # スナップショット: チケットごとに1ファイル (snapshots/<TicketID>.json)
+        self.snapshot_directory = os.path.join(directory, "snapshots")
+        os.makedirs(self.snapshot_directory, exist_ok=True)
+        self.segments.extend(Segment(path) for path in sorted(glob.glob(os.path.join(directory, "segment-*.log"))))
+        for segment_no in range(len(self.segments)):
+            self._scan(segment_no)
+        if not self.segments:
+            self._add_segment()
+        self._writer = open(self.segments[-1].path, "ab")
+
+    # イベント・スナップショットはファイルに保存するので、基底クラスのインメモリの dict は作らない
+    def _init_store(self):
+        pass
+
+    def __enter__(self) -> "FileTicketsRepository":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self):
+        self._writer.close()
+        for segment in self.segments:
+            segment.close()
+
+    def _add_segment(self):
+        path = os.path.join(self.directory, f"segment-{len(self.segments):08d}.log")
+        open(path, "ab").close()
+        self.segments.append(Segment(path))
+
+    # 起動時にセグメントを走査してオフセットインデックスを再構築する
+    # NOTE: 書き込み途中で落ちた末尾のレコード (長さ不足・CRC不一致) は切り捨てる。
+    #       書き込み途中で落ちうるのは最後 (追記中) のセグメントだけなので、それより前のセグメントの不正なレコードは破損としてエラーにする
+    def _scan(self, segment_no: int):
+        segment = self.segments[segment_no]
+        if segment.size == 0:
+            return
+        with open(segment.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            while offset + HEADER.size <= len(data):
+                stream_id, length, crc = HEADER.unpack_from(data, offset)
+                end = offset + HEADER.size + length
+                if end > len(data) or zlib.crc32(data[offset + HEADER.size:end]) != crc:
+                    break
+                self.index.setdefault(UUID(bytes=stream_id), []).append((segment_no, offset + HEADER.size, length))
+                offset = end
+        if offset < segment.size:
+            if segment_no != len(self.segments) - 1:
+                raise ValueError(f"Corrupted record in sealed segment: {segment.path} (offset {offset})")
+            with open(segment.path, "r+b") as writable:
+                writable.truncate(offset)
+            segment.size = offset
+
+    # イベントのロード (start 番目以降)
+    # NOTE: インデックスから該当ストリームのレコード位置だけを読む
+    def load_events(self, ticket_id: TicketID, start: int = 0) -> list[DomainEvent]:
+        positions = self.index.get(ticket_id.value, [])[start:]
+        return [decode_event(self.segments[segment_no].read(offset, length)) for segment_no, offset, length in positions]
+
+    # イベントの保存
+    def save_events(self, ticket_id: TicketID, events: list[DomainEvent], expected_version: int):
+        if self.save_events_many([(ticket_id, events, expected_version)]):
+            raise ConcurrencyConflictError()
+
+    # 複数ストリームへの追記
+    # NOTE: 競合しなかったストリームのイベントをまとめて1回の write (と fsync) で追記する
+    def save_events_many(self, appends: list[tuple[TicketID, list[DomainEvent], int]]) -> set[TicketID]:
+        with self._append_lock:
+            return self._append(appends)
+
+    def _append(self, appends: list[tuple[TicketID, list[DomainEvent], int]]) -> set[TicketID]:
+        if self.segments[-1].size >= self.segment_size:
+            self._writer.close()
+            self._add_segment()
+            self._writer = open(self.segments[-1].path, "ab")
+
+        # バッチ内のイベントを1回の write でまとめて追記する
+        segment_no = len(self.segments) - 1
+        segment = self.segments[segment_no]
+        buffer = bytearray()
+        conflicts = set()
+        new_positions: dict[UUID, list[tuple[int, int, int]]] = {}
+        for ticket_id, events, expected_version in appends:
+            # 同じバッチで同じストリームに続けて追記する場合は、先の追記を含めた長さと比べる
+            positions = new_positions.get(ticket_id.value, self.index.get(ticket_id.value, []))
+            if len(positions) != expected_version:
+                conflicts.add(ticket_id)
+                continue
+            positions = new_positions[ticket_id.value] = list(positions)
+            for event in events:
+                payload = encode_event(event)
+                positions.append((segment_no, segment.size + len(buffer) + HEADER.size, len(payload)))
+                buffer += HEADER.pack(ticket_id.value.bytes, len(payload), zlib.crc32(payload))
+                buffer += payload
+        if buffer:
+            self._writer.write(buffer)
+            self._writer.flush()
+            if self.fsync:
+                os.fsync(self._writer.fileno())
+            segment.size += len(buffer)
+        # 書き込みが終わってからインデックスに反映する
+        self.index.update(new_positions)
+        return conflicts
+
+    # ストリームの長さ (保存済みのイベント数)
+    def stream_length(self, ticket_id: TicketID) -> int:
+        return len(self.index.get(ticket_id.value, []))
+
+    def _snapshot_path(self, ticket_id: TicketID) -> str:
+        return os.path.join(self.snapshot_directory, f"{ticket_id.value}.json")
+
+    # スナップショットの保存 (最新の1件を上書きする)
+    # NOTE: 一時ファイルに書いてから置き換えるので、途中で落ちても古いスナップショットが残るだけ
+    def save_snapshot(self, snapshot: TicketSnapshot):
+        path = self._snapshot_path(snapshot.ticket_id)
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(snapshot.model_dump_json())
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    # 最新のスナップショットのロード (スキーマが古いものは無視する)
+    # NOTE: fsync しない設定では、落ちたときにスナップショットより後のイベントが切り捨てられていることがある。
+    #       ストリームより先の位置のスナップショットは使わない
+    def load_snapshot(self, ticket_id: TicketID) -> TicketSnapshot | None:
+        try:
+            with open(self._snapshot_path(ticket_id), "r", encoding="utf-8") as f:
+                snapshot = TicketSnapshot.model_validate_json(f.read())
+        except FileNotFoundError:
+            return None
+        if snapshot.schema_version != TicketState.snapshot_schema_version or snapshot.position > self.stream_length(ticket_id):
+            return None
+        return snapshot
+
+
+if __name__ == "__main__":
+    # 使い方: python file_event_store.py [チケット数] [チケットあたりのイベント数]
+    from datetime import datetime
+    import sys
+    import tempfile
+    import time
+
+    from event_sourcing_domain_model import ClosedEvent, EscalatedEvent, EveryKEventsSnapshotPolicy, InitializedEvent, TicketAPI
+
+    tickets = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    events_per_ticket = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    ticket_ids = [TicketID() for _ in range(tickets)]
+    now = datetime.now()
+    stream: list[DomainEvent] = [InitializedEvent(timestamp=now)] + [EscalatedEvent(timestamp=now)] * (events_per_ticket - 2) + [ClosedEvent(timestamp=now)]
+    total = tickets * events_per_ticket
+
+    with tempfile.TemporaryDirectory() as directory:
+        with FileTicketsRepository(directory, segment_size=16 * 1024 * 1024) as repo:
+            # 1件ずつの追記
+            start = time.perf_counter()
+            for ticket_id in ticket_ids:
+                for version, event in enumerate(stream):
+                    repo.save_events(ticket_id, [event], expected_version=version)
+            elapsed = time.perf_counter() - start
+            print(f"append (1 event/save)  : {total / elapsed:,.0f} events/sec segments={len(repo.segments)}")
+
+        # 再起動: セグメントを走査してインデックスを再構築
+        start = time.perf_counter()
+        with FileTicketsRepository(directory) as repo:
+            print(f"reopen (index rebuild) : {time.perf_counter() - start:.3f}s streams={len(repo.index)}")
+
+            start = time.perf_counter()
+            for ticket_id in ticket_ids:
+                assert len(repo.load_events(ticket_id)) == events_per_ticket
+            elapsed = time.perf_counter() - start
+            print(f"read (load_events)     : {total / elapsed:,.0f} events/sec")
+
+            try:
+                repo.save_events(ticket_ids[0], [ClosedEvent(timestamp=now)], expected_version=0)
+            except ConcurrencyConflictError as e:
+                print(e)  # Concurrency conflict detected
+
+    # スナップショットもファイルに保存され、再起動後に読める
+    with tempfile.TemporaryDirectory() as directory:
+        ticket_id = TicketID()
+        with FileTicketsRepository(directory, snapshot_policy=EveryKEventsSnapshotPolicy(k=1)) as repo:
+            TicketAPI(repo).request_escalation(ticket_id)
+            expected_state = repo.load_ticket(ticket_id).state
+        with FileTicketsRepository(directory) as repo:
+            snapshot = repo.load_snapshot(ticket_id)
+            assert snapshot is not None and snapshot.position == 1 and snapshot.restore() == expected_state
+            assert repo.load_ticket(ticket_id).state == expected_state
+
+    # 最後のセグメントの書き込み途中のレコードは切り捨て、それより前のセグメントの破損はエラーにする
+    with tempfile.TemporaryDirectory() as directory:
+        with FileTicketsRepository(directory, segment_size=4096) as repo:
+            for ticket_id in ticket_ids[:100]:
+                repo.save_events(ticket_id, stream, expected_version=0)
+            sealed, last = repo.segments[0].path, repo.segments[-1].path
+            assert sealed != last
+            last_size = repo.segments[-1].size
+        with open(last, "ab") as torn:
+            torn.write(HEADER.pack(ticket_ids[0].value.bytes, 100, 0))
+        with FileTicketsRepository(directory) as repo:
+            assert repo.segments[-1].size == last_size
+            assert all(len(repo.load_events(ticket_id)) == events_per_ticket for ticket_id in ticket_ids[:100])
+        with open(sealed, "r+b") as corrupted:
+            corrupted.seek(HEADER.size)
+            corrupted.write(b"#")
+        try:
+            FileTicketsRepository(directory)
+            raise AssertionError("corruption in a sealed segment must not be truncated")
+        except ValueError as e:
+            print(e)  # Corrupted record in sealed segment: ...
+
+    with tempfile.TemporaryDirectory() as directory:
+        with FileTicketsRepository(directory) as repo:
+            # ストリーム単位のバッチ追記
+            start = time.perf_counter()
+            for ticket_id in ticket_ids:
+                repo.save_events(ticket_id, stream, expected_version=0)
+            elapsed = time.perf_counter() - start
+            print(f"append (batched)       : {total / elapsed:,.0f} events/sec")
+
+            # 複数ストリームの一括追記 (1回の write / fsync)
+            more: list[DomainEvent] = [ClosedEvent(timestamp=now)]
+            start = time.perf_counter()
+            conflicts = repo.save_events_many([(ticket_id, more, len(stream)) for ticket_id in ticket_ids])
+            elapsed = time.perf_counter() - start
+            print(f"append (save_events_many): {tickets / elapsed:,.0f} events/sec conflicts={len(conflicts)}")
+
+            # 追記中のセグメントを複数スレッドから読んでも、マップし直しと読み出しがぶつからない
+            from concurrent.futures import ThreadPoolExecutor
+
+            stop = threading.Event()
+
+            def reader() -> int:
+                reads = 0
+                while not stop.is_set():
+                    for ticket_id in ticket_ids[:100]:
+                        repo.load_events(ticket_id)
+                        reads += 1
+                return reads
+
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                readers = [pool.submit(reader) for _ in range(4)]
+                # 読んでいるストリームに追記し続ける (読むたびにセグメントの末尾が伸びている)
+                for round in range(20):
+                    for ticket_id in ticket_ids[:100]:
+                        repo.save_events(ticket_id, more, len(stream) + 1 + round)
+                stop.set()
+                print(f"concurrent reads while appending: {sum(r.result() for r in readers):,} loads")
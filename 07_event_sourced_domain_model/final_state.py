@@ -0,0 +1,179 @@
+from dataclasses import dataclass
+from datetime import datetime
+import numpy as np
+
+from columnar_event_log import AWARE, EVENT_CLASSES, EVENT_CODES, ColumnarEventLog, from_epoch_micros
+from lead_events import LeadInitializedEvent, LeadStatusEnum
+
+INITIALIZED = EVENT_CODES[LeadInitializedEvent]
+
+# 状態コード (LeadStatusEnum の定義順) <-> LeadStatusEnum
+STATUSES: tuple[LeadStatusEnum, ...] = tuple(LeadStatusEnum)
+NEW_LEAD = STATUSES.index(LeadStatusEnum.NEW_LEAD)
+
+# イベント種別コード -> そのイベントで変わる状態コード。状態を変えないイベントは -1
+STATUS_BY_TYPE = np.array([
+    STATUSES.index(event_class.model_fields["status"].default.value) if "status" in event_class.model_fields else -1
+    for event_class in EVENT_CLASSES
+], dtype=np.int8)
+
+# 新規登録がないリードの created_on
+NO_TIMESTAMP = np.iinfo(np.int64).min
+
+
+# NOTE: ナイーブな時刻として記録されたもの (aware が偽) はタイムゾーンを外して返す
+def _from_micros(micros: int, aware: bool) -> datetime | None:
+    if micros == NO_TIMESTAMP:
+        return None
+    timestamp = from_epoch_micros(micros)
+    return timestamp if aware else timestamp.replace(tzinfo=None)
+
+
+# 1リード分の最終状態
+@dataclass(frozen=True)
+class FinalState:
+    status: LeadStatusEnum
+    version: int
+    created_on: datetime | None
+    updated_on: datetime | None
+
+
+#################################################
+# 最終状態の一括再構築
+#################################################
+
+# 全リードの最終的な status / version / created_on / updated_on を列 (NumPy配列) で持つ表
+# NOTE: LeadStateModelProjection.apply の規則を、リードごとの集約 (最後の位置・件数) に置き換えて求める
+#         status     : 最後の状態を変えるイベント (新規登録・商談予定設定・注文受領・支払完了) の状態
+#         version    : 最後の新規登録より後のイベント数 (新規登録がなければ全イベント数)
+#         created_on : 最後の新規登録の時刻
+#         updated_on : 最後のイベントの時刻
+#       「最後」は時刻ではなくストリーム上の位置で決める (apply と同じく、同じ時刻のイベントは後のものが勝つ)
+@dataclass(frozen=True)
+class FinalStateTable:
+    statuses: np.ndarray    # STATUSES のインデックス
+    versions: np.ndarray
+    created_on: np.ndarray  # エポックマイクロ秒 / NO_TIMESTAMP
+    updated_on: np.ndarray  # エポックマイクロ秒 / NO_TIMESTAMP
+    created_on_aware: np.ndarray  # created_on がタイムゾーン付きの時刻か
+    updated_on_aware: np.ndarray  # updated_on がタイムゾーン付きの時刻か
+
+    def __len__(self) -> int:
+        return len(self.versions)
+
+    def __getitem__(self, row: int) -> FinalState:
+        return FinalState(
+            status=STATUSES[self.statuses[row]],
+            version=int(self.versions[row]),
+            created_on=_from_micros(int(self.created_on[row]), bool(self.created_on_aware[row])),
+            updated_on=_from_micros(int(self.updated_on[row]), bool(self.updated_on_aware[row])),
+        )
+
+    # イベントの列 (リード番号, イベント種別コード, タイムスタンプ, aware) から一括で求める
+    # NOTE: イベントごとの apply (Pythonの呼び出し) は行わず、maximum.at / bincount でまとめて計算する。
+    #       各リードのイベントは配列上でストリームの順に並んでいる前提 (リード間は混ざっていてよい)
+    @classmethod
+    def from_event_arrays(
+        cls, lead_ids: np.ndarray, type_codes: np.ndarray, timestamps: np.ndarray, aware: np.ndarray, leads: int
+    ) -> "FinalStateTable":
+        positions = np.arange(len(lead_ids), dtype=np.int64)
+
+        # リードごとの最後のイベントの位置
+        last = np.full(leads, -1, dtype=np.int64)
+        np.maximum.at(last, lead_ids, positions)
+        has_events = last >= 0
+        updated_on = np.full(leads, NO_TIMESTAMP, dtype=np.int64)
+        updated_on[has_events] = timestamps[last[has_events]]
+        updated_on_aware = np.zeros(leads, dtype=np.bool_)
+        updated_on_aware[has_events] = aware[last[has_events]] == AWARE
+
+        # リードごとの最後の新規登録の位置と、それより後のイベント数
+        initialized = type_codes == INITIALIZED
+        last_initialized = np.full(leads, -1, dtype=np.int64)
+        np.maximum.at(last_initialized, lead_ids[initialized], positions[initialized])
+        after = positions > last_initialized[lead_ids]
+        versions = np.bincount(lead_ids[after], minlength=leads)
+        created_on = np.full(leads, NO_TIMESTAMP, dtype=np.int64)
+        has_initialized = last_initialized >= 0
+        created_on[has_initialized] = timestamps[last_initialized[has_initialized]]
+        created_on_aware = np.zeros(leads, dtype=np.bool_)
+        created_on_aware[has_initialized] = aware[last_initialized[has_initialized]] == AWARE
+
+        # リードごとの最後の状態を変えるイベントの状態
+        event_statuses = STATUS_BY_TYPE[type_codes]
+        changes = event_statuses >= 0
+        last_change = np.full(leads, -1, dtype=np.int64)
+        np.maximum.at(last_change, lead_ids[changes], positions[changes])
+        statuses = np.full(leads, NEW_LEAD, dtype=np.int8)
+        has_change = last_change >= 0
+        statuses[has_change] = event_statuses[last_change[has_change]]
+
+        return cls(
+            statuses=statuses, versions=versions, created_on=created_on, updated_on=updated_on,
+            created_on_aware=created_on_aware, updated_on_aware=updated_on_aware,
+        )
+
+    # ColumnarEventLog の列をコピーせずに NumPy 配列として参照して求める
+    @classmethod
+    def from_event_log(cls, log: ColumnarEventLog) -> "FinalStateTable":
+        return cls.from_event_arrays(
+            np.frombuffer(log.lead_ids, dtype=np.int32),
+            np.frombuffer(log.type_codes, dtype=np.uint8),
+            np.frombuffer(log.timestamps, dtype=np.int64),
+            np.frombuffer(log.aware, dtype=np.uint8),
+            len(log.lead_table),
+        )
+
+
+if __name__ == "__main__":
+    # 使い方: python final_state.py [リード数] [1リードあたりのイベント数]
+    import random
+    import sys
+    import time
+
+    from benchmarks.lead_generator import generate_events
+    from event_decoder import decode_records
+    from event_sourcing import LeadStateModelProjection
+    from lead_events import LeadID, LeadEvent
+
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    events_per_lead = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    events: list[LeadEvent] = list(decode_records(generate_events(leads, events_per_lead)))
+    # 1割のリードはナイーブな時刻で記録する (最終状態でもナイーブなまま返る)
+    events = [
+        event.model_copy(update={"timestamp": event.timestamp.replace(tzinfo=None)})
+        if event.lead_id.value.endswith("0") else event
+        for event in events
+    ]
+    log = ColumnarEventLog.from_events(events)
+
+    # イベントごとに apply する従来のリプレイ (デコード済みのイベントから)
+    start = time.perf_counter()
+    projections: dict[LeadID, LeadStateModelProjection] = {}
+    for event in events:
+        projection = projections.get(event.lead_id)
+        if projection is None:
+            projection = projections[event.lead_id] = LeadStateModelProjection.empty()
+        projection.apply(event)
+    replay_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = FinalStateTable.from_event_log(log)
+    vectorized_elapsed = time.perf_counter() - start
+
+    # 抜き取りでプロジェクションと一致することを確認する
+    random.seed(0)
+    for row in random.sample(range(len(table)), min(1_000, len(table))):
+        projection = projections[LeadID(value=log.lead_table[row])]
+        assert table[row] == FinalState(
+            status=projection.status.value,
+            version=projection.version,
+            created_on=projection.created_on,
+            updated_on=projection.updated_on,
+        ), row
+
+    print(f"leads={len(table):,} events={len(log):,}")
+    print(f"apply per event  : {replay_elapsed:.3f}s")
+    print(f"FinalStateTable  : {vectorized_elapsed:.3f}s ({replay_elapsed / vectorized_elapsed:.0f}x)")
+    for code, status in enumerate(STATUSES):
+        print(f"  {status.value:<16} {int((table.statuses == code).sum()):>10,}")
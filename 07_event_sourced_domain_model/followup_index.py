@@ -0,0 +1,264 @@
+from bisect import bisect_left, insort
+from datetime import datetime
+from functools import singledispatchmethod
+from heapq import heapify, heappop, heappush
+from itertools import count
+from typing import Iterator
+import sys
+
+from columnar_event_log import from_epoch_micros, to_epoch_micros
+from lead_events import LeadID, LeadEvent, ContactedEvent, FollowupSetEvent
+
+# 古いエントリがこの数を超え、かつ有効なエントリ数を超えたら詰め直す
+COMPACT_THRESHOLD = 1024
+
+# _SortedBlocks の1ブロックの要素数の目安 (2倍を超えたら分割する)
+BLOCK_SIZE = 512
+
+Entry = tuple[int, str]  # (予定時刻 (エポックマイクロ秒), リードID)
+
+
+#################################################
+# Sorted Blocks
+#################################################
+
+# (予定時刻, リードID) の昇順の集合を、BLOCK_SIZE 前後の昇順のブロックに分けて持つ
+# NOTE: 1つのリストへの挿入・削除は O(n) の memmove になるので、ブロックの末尾の値 (_maxes) を二分探索してブロックを決め、
+#       ブロック内を二分探索する。挿入・削除は O(log n + BLOCK_SIZE)、範囲の列挙は O(log n + k)
+class _SortedBlocks:
+    def __init__(self):
+        self._blocks: list[list[Entry]] = []
+        self._maxes: list[Entry] = []  # 各ブロックの末尾 (最大) の値
+
+    def add(self, entry: Entry):
+        blocks, maxes = self._blocks, self._maxes
+        if not blocks:
+            blocks.append([entry])
+            maxes.append(entry)
+            return
+        i = bisect_left(maxes, entry)
+        if i == len(blocks):
+            # NOTE: 予定時刻はイベントの時刻なのでほぼ昇順に届き、ほとんどが末尾のブロックへの追加になる
+            i -= 1
+            blocks[i].append(entry)
+            maxes[i] = entry
+        else:
+            insort(blocks[i], entry)
+        block = blocks[i]
+        if len(block) > 2 * BLOCK_SIZE:
+            tail = block[BLOCK_SIZE:]
+            del block[BLOCK_SIZE:]
+            blocks.insert(i + 1, tail)
+            maxes[i] = block[-1]
+            maxes.insert(i + 1, tail[-1])
+
+    def remove(self, entry: Entry):
+        blocks, maxes = self._blocks, self._maxes
+        i = bisect_left(maxes, entry)
+        block = blocks[i]
+        j = bisect_left(block, entry)
+        del block[j]
+        if not block:
+            del blocks[i]
+            del maxes[i]
+        elif j == len(block):
+            maxes[i] = block[-1]
+
+    # lo <= 値 < hi の値を昇順に返す
+    def irange(self, lo: tuple[int, ...], hi: tuple[int, ...]) -> Iterator[Entry]:
+        blocks = self._blocks
+        i = bisect_left(self._maxes, lo)
+        if i == len(blocks):
+            return
+        j = bisect_left(blocks[i], lo)
+        while i < len(blocks):
+            block = blocks[i]
+            for k in range(j, len(block)):
+                entry = block[k]
+                if entry >= hi:
+                    return
+                yield entry
+            i += 1
+            j = 0
+
+
+#################################################
+# Follow-up Index
+#################################################
+
+# フォローアップ予定時刻 (follow_up_on) の索引
+# NOTE: LeadStateModelProjection と同じく FollowupSetEvent で設定し、ContactedEvent で解除する。
+#       範囲の問い合わせ (between / due) は (時刻, リードID) の _SortedBlocks で答え、解除・再設定のたびにすぐ更新する。
+#       払い出し (pop_due) は (時刻, 通番, リードID) の最小ヒープの先頭から取り出し、
+#       解除・再設定されたエントリは消さずに残しておく (遅延削除)。
+#       ヒープのエントリが有効かどうかは、リードの現在の通番と一致するかで判定する
+#       (時刻で判定すると T -> T2 -> T と再設定したときに T のエントリが2つとも有効になってしまう)
+class FollowupIndex:
+    def __init__(self):
+        self._sorted = _SortedBlocks()                 # 現在の予定 (時刻, リードID) の昇順
+        self._heap: list[tuple[int, int, str]] = []  # (予定時刻 (エポックマイクロ秒), 通番, リードID) の最小ヒープ
+        self.due_on: dict[str, int] = {}               # リードID -> 現在の予定時刻
+        self._naive: set[str] = set()                  # 現在の予定時刻がナイーブな時刻 (UTCとみなして保存) のリードID
+        self._sequences: dict[str, int] = {}           # リードID -> 現在のエントリの通番
+        self._lead_ids: dict[str, LeadID] = {}         # 検索結果で LeadID を作り直さないように保持する
+        self._next_sequence = count()
+        self._stale = 0
+
+    def __len__(self) -> int:
+        return len(self.due_on)
+
+    # NOTE: メソッドのオーバーロードにsingledispatchmethodを使用
+    @singledispatchmethod
+    def apply(self, event: LeadEvent):
+        pass  # follow_up_on を変えないイベントは無視する
+
+    @apply.register
+    def _(self, event: FollowupSetEvent):
+        self.schedule(event.lead_id, event.timestamp)
+
+    @apply.register
+    def _(self, event: ContactedEvent):
+        self.cancel(event.lead_id)
+
+    def schedule(self, lead_id: LeadID, due_on: datetime):
+        micros = to_epoch_micros(due_on)
+        previous = self.due_on.get(lead_id.value)
+        if previous == micros:
+            return
+        self._lead_ids.setdefault(lead_id.value, lead_id)
+        if previous is not None:
+            self._sorted.remove((previous, lead_id.value))
+        sequence = next(self._next_sequence)
+        self.due_on[lead_id.value] = micros
+        if due_on.tzinfo is None:
+            self._naive.add(lead_id.value)
+        else:
+            self._naive.discard(lead_id.value)
+        self._sequences[lead_id.value] = sequence
+        self._sorted.add((micros, lead_id.value))
+        heappush(self._heap, (micros, sequence, lead_id.value))
+        if previous is not None:
+            self._stale += 1
+            self._compact_if_needed()
+
+    def cancel(self, lead_id: LeadID):
+        micros = self.due_on.pop(lead_id.value, None)
+        if micros is not None:
+            self._forget(micros, lead_id.value)
+            self._stale += 1
+            self._compact_if_needed()
+
+    def _forget(self, micros: int, lead_id: str):
+        del self._sequences[lead_id]
+        self._naive.discard(lead_id)
+        self._sorted.remove((micros, lead_id))
+
+    def _is_live(self, sequence: int, lead_id: str) -> bool:
+        return self._sequences.get(lead_id) == sequence
+
+    def _compact_if_needed(self):
+        if self._stale > COMPACT_THRESHOLD and self._stale > len(self.due_on):
+            self._heap = [(micros, self._sequences[lead_id], lead_id) for lead_id, micros in self.due_on.items()]
+            heapify(self._heap)
+            self._stale = 0
+
+    # 保存した時刻を、設定されたときと同じタイムゾーンの有無で返す
+    def _timestamp(self, micros: int, lead_id: str) -> datetime:
+        timestamp = from_epoch_micros(micros)
+        return timestamp.replace(tzinfo=None) if lead_id in self._naive else timestamp
+
+    # start <= 予定時刻 < end のリードを予定時刻の順に返す (O(log n + k))
+    def between(self, start: datetime, end: datetime) -> list[tuple[LeadID, datetime]]:
+        return [
+            (self._lead_ids[lead_id], self._timestamp(micros, lead_id))
+            for micros, lead_id in self._sorted.irange((to_epoch_micros(start),), (to_epoch_micros(end),))
+        ]
+
+    # now の時点で予定時刻を過ぎているリード (古い順。O(log n + k))
+    def due(self, now: datetime) -> list[LeadID]:
+        return [
+            self._lead_ids[lead_id]
+            for _, lead_id in self._sorted.irange((-sys.maxsize,), (to_epoch_micros(now) + 1,))
+        ]
+
+    # 予定時刻を過ぎたリードを古い順に最大 limit 件取り出し、索引から外す (架電システムへの払い出し)
+    # NOTE: ヒープの先頭から取り出すので、取り出すエントリ (古いエントリを含む) 1件あたり O(log n)
+    def pop_due(self, now: datetime, limit: int | None = None) -> list[LeadID]:
+        heap = self._heap
+        key = (to_epoch_micros(now), sys.maxsize)
+        popped: list[LeadID] = []
+        while heap and heap[0] < key and (limit is None or len(popped) < limit):
+            micros, sequence, lead_id = heappop(heap)
+            if self._is_live(sequence, lead_id):
+                del self.due_on[lead_id]
+                self._forget(micros, lead_id)
+                popped.append(self._lead_ids[lead_id])
+            else:
+                self._stale -= 1
+        return popped
+
+
+if __name__ == "__main__":
+    # 使い方: python followup_index.py [リード数] [1リードあたりのイベント数]
+    from datetime import timedelta
+    import time
+
+    from benchmarks.lead_generator import generate_events
+    from event_decoder import decode_records
+    from event_sourcing import LeadStateModelProjection
+    from trusted_replay import replay_trusted
+
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    events_per_lead = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    events = list(decode_records(generate_events(leads, events_per_lead)))
+
+    # T -> T2 -> T と再設定しても、リードは1回だけ返る
+    lead_id = LeadID(value="rescheduled")
+    t1, t2 = events[0].timestamp, events[0].timestamp + timedelta(days=1)
+    index = FollowupIndex()
+    for due_on in (t1, t2, t1):
+        index.schedule(lead_id, due_on)
+    assert index.between(t1, t2 + timedelta(days=1)) == [(lead_id, t1)]
+    assert index.due(t2) == [lead_id] and index.pop_due(t2) == [lead_id] and not index.due(t2)
+
+    index = FollowupIndex()
+    start = time.perf_counter()
+    for event in events:
+        index.apply(event)
+    print(f"leads={leads:,} events={len(events):,} build={time.perf_counter() - start:.3f}s scheduled={len(index):,}")
+
+    # プロジェクションを全件走査する場合と比較する
+    by_lead: dict[LeadID, list[LeadEvent]] = {}
+    for event in events:
+        by_lead.setdefault(event.lead_id, []).append(event)
+    projections = [replay_trusted(LeadStateModelProjection.empty(), lead_events) for lead_events in by_lead.values()]
+
+    now = events[len(events) // 2].timestamp
+
+    # 予定時刻を過ぎたリードを100件ずつ払い出す
+    due = index.due(now)
+    assert sorted(lead_id.value for lead_id in due) == sorted(
+        p.lead_id.value for p in projections if p.follow_up_on is not None and p.follow_up_on <= now
+    )
+    start = time.perf_counter()
+    batches = 0
+    while index.pop_due(now, limit=100):
+        batches += 1
+    print(f"due now: {len(due):,} leads popped in {batches} batches {(time.perf_counter() - start) * 1000:.1f}ms remaining={len(index):,}")
+
+    # 払い出した後の「次の1時間」(now ちょうどの予定は払い出し済み)
+    window = (now + timedelta(microseconds=1), now + timedelta(hours=1))
+
+    start = time.perf_counter()
+    scanned = sorted(
+        (p.follow_up_on, p.lead_id.value) for p in projections
+        if p.follow_up_on is not None and window[0] <= p.follow_up_on < window[1]
+    )
+    scan_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = index.between(*window)
+    index_elapsed = time.perf_counter() - start
+
+    assert sorted((due_on, lead_id.value) for lead_id, due_on in indexed) == scanned
+    print(f"next hour: hits={len(indexed)} scan={scan_elapsed * 1000:.2f}ms index={index_elapsed * 1000:.3f}ms")
@@ -0,0 +1,175 @@
+from dataclasses import dataclass
+from typing import Iterable
+import numpy as np
+
+from columnar_event_log import EVENT_CODES, ColumnarEventLog, to_epoch_micros
+from lead_events import LeadInitializedEvent, FollowupSetEvent, PaymentConfirmedEvent, LeadStatusEnum
+
+INITIALIZED = EVENT_CODES[LeadInitializedEvent]
+FOLLOWUP_SET = EVENT_CODES[FollowupSetEvent]
+PAYMENT_CONFIRMED = EVENT_CODES[PaymentConfirmedEvent]
+
+# 該当するイベントがないリードのタイムスタンプ
+NO_TIMESTAMP = np.iinfo(np.int64).max
+
+PERCENTILES = (50, 75, 90, 95, 99)
+
+
+#################################################
+# リード単位の集計表
+#################################################
+
+# リードごとの集計値を列 (NumPy配列) で持つ表
+@dataclass(frozen=True)
+class FunnelTable:
+    followups: np.ndarray     # フォローアップ (商談予定設定) の回数
+    created_on: np.ndarray    # 新規登録の時刻 (エポックマイクロ秒) / NO_TIMESTAMP
+    converted_on: np.ndarray  # 最初の支払完了の時刻 (エポックマイクロ秒) / NO_TIMESTAMP
+
+    def __len__(self) -> int:
+        return len(self.followups)
+
+    @property
+    def converted(self) -> np.ndarray:
+        return self.converted_on != NO_TIMESTAMP
+
+    # イベントの列 (リード番号, イベント種別コード, タイムスタンプ) から一括で集計する
+    # NOTE: リードごとのPythonループは行わず、bincount / minimum.at でまとめて計算する
+    @classmethod
+    def from_event_arrays(
+        cls, lead_ids: np.ndarray, type_codes: np.ndarray, timestamps: np.ndarray, leads: int
+    ) -> "FunnelTable":
+        followups = np.bincount(lead_ids[type_codes == FOLLOWUP_SET], minlength=leads)
+
+        created_on = np.full(leads, NO_TIMESTAMP, dtype=np.int64)
+        initialized = type_codes == INITIALIZED
+        np.minimum.at(created_on, lead_ids[initialized], timestamps[initialized])
+
+        converted_on = np.full(leads, NO_TIMESTAMP, dtype=np.int64)
+        paid = type_codes == PAYMENT_CONFIRMED
+        np.minimum.at(converted_on, lead_ids[paid], timestamps[paid])
+
+        return cls(followups=followups, created_on=created_on, converted_on=converted_on)
+
+    # ColumnarEventLog の列をコピーせずに NumPy 配列として参照して集計する
+    @classmethod
+    def from_event_log(cls, log: ColumnarEventLog) -> "FunnelTable":
+        return cls.from_event_arrays(
+            np.frombuffer(log.lead_ids, dtype=np.int32),
+            np.frombuffer(log.type_codes, dtype=np.uint8),
+            np.frombuffer(log.timestamps, dtype=np.int64),
+            len(log.lead_table),
+        )
+
+    # event_sourcing_analysis の LeadStateModelProjection から作る
+    # NOTE: プロジェクションは支払完了の時刻を持たないので、成約済みのリードは updated_on を成約時刻とみなす
+    @classmethod
+    def from_projections(cls, projections: Iterable) -> "FunnelTable":
+        followups, created_on, converted_on = [], [], []
+        for projection in projections:
+            followups.append(projection.followups)
+            created_on.append(to_epoch_micros(projection.created_on) if projection.created_on else NO_TIMESTAMP)
+            converted = projection.status.value == LeadStatusEnum.CONVERTED and projection.updated_on
+            converted_on.append(to_epoch_micros(projection.updated_on) if converted else NO_TIMESTAMP)
+        return cls(
+            followups=np.array(followups, dtype=np.int64),
+            created_on=np.array(created_on, dtype=np.int64),
+            converted_on=np.array(converted_on, dtype=np.int64),
+        )
+
+
+#################################################
+# レポート
+#################################################
+
+@dataclass(frozen=True)
+class FunnelReport:
+    leads: int
+    converted: int
+    followups_distribution: dict[int, int]           # フォローアップ回数 -> リード数
+    conversion_rate_by_followups: dict[int, float]   # フォローアップ回数 -> 成約率
+    time_to_conversion_seconds: dict[int, float]     # パーセンタイル -> 新規登録から成約までの秒数
+
+    @classmethod
+    def from_table(cls, table: FunnelTable, percentiles: Iterable[int] = PERCENTILES) -> "FunnelReport":
+        converted = table.converted
+        leads_by_followups = np.bincount(table.followups)
+        converted_by_followups = np.bincount(table.followups, weights=converted, minlength=len(leads_by_followups))
+        present = leads_by_followups > 0
+
+        measurable = converted & (table.created_on != NO_TIMESTAMP)
+        durations = (table.converted_on[measurable] - table.created_on[measurable]) / 1_000_000
+        percentiles = tuple(percentiles)
+        values = np.percentile(durations, percentiles) if len(durations) else [float("nan")] * len(percentiles)
+
+        return cls(
+            leads=len(table),
+            converted=int(converted.sum()),
+            followups_distribution={int(k): int(leads_by_followups[k]) for k in np.flatnonzero(present)},
+            conversion_rate_by_followups={
+                int(k): float(converted_by_followups[k] / leads_by_followups[k]) for k in np.flatnonzero(present)
+            },
+            time_to_conversion_seconds={p: float(v) for p, v in zip(percentiles, values)},
+        )
+
+    def to_text(self) -> str:
+        lines = [
+            f"leads={self.leads:,} converted={self.converted:,} ({self.converted / max(self.leads, 1):.1%})",
+            "followups  leads        conversion_rate",
+        ]
+        for followups, leads in self.followups_distribution.items():
+            lines.append(f"{followups:>9}  {leads:>11,}  {self.conversion_rate_by_followups[followups]:>15.1%}")
+        lines.append("time to conversion:")
+        for p, seconds in self.time_to_conversion_seconds.items():
+            lines.append(f"  p{p:<3} {seconds / 86400:8.2f} days")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # 使い方: python funnel_analytics.py [リード数]
+    import json
+    import os
+    import sys
+    import time
+
+    from event_decoder import decode_json
+    from projection_rebuild import rebuild_shard
+    import event_sourcing_analysis
+
+    # events.json (リード12) で、イベント列からの集計とプロジェクションからの集計が一致することを確認
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(f"{script_dir}/events.json", "rb") as f:
+        data = f.read()
+    log = ColumnarEventLog.from_events(decode_json(data))
+    projections = rebuild_shard(event_sourcing_analysis.LeadStateModelProjection, json.loads(data))
+    from_log = FunnelReport.from_table(FunnelTable.from_event_log(log))
+    from_projections = FunnelReport.from_table(FunnelTable.from_projections(projections.values()))
+    assert from_log == from_projections
+    print(from_log.to_text())
+
+    # 合成データ: リードごとに 新規登録 + フォローアップ k 回 + (成約なら) 支払完了
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    rng = np.random.default_rng(0)
+    lead_numbers = np.arange(leads, dtype=np.int32)
+    created_on = 1_577_836_800_000_000 + rng.integers(0, 365 * 86400 * 10**6, leads)  # 2020年
+    followups = np.minimum(rng.geometric(0.5, leads) - 1, 8)
+    converted = rng.random(leads) < 0.05 + 0.08 * followups
+    paid_after = rng.exponential(14 * 86400 * 10**6, leads).astype(np.int64)
+
+    followup_leads = np.repeat(lead_numbers, followups)
+    paid_leads = lead_numbers[converted]
+    lead_ids = np.concatenate([lead_numbers, followup_leads, paid_leads])
+    type_codes = np.concatenate([
+        np.full(leads, INITIALIZED, dtype=np.uint8),
+        np.full(len(followup_leads), FOLLOWUP_SET, dtype=np.uint8),
+        np.full(len(paid_leads), PAYMENT_CONFIRMED, dtype=np.uint8),
+    ])
+    timestamps = np.concatenate([created_on, created_on[followup_leads] + 1, (created_on + paid_after)[converted]])
+
+    start = time.perf_counter()
+    table = FunnelTable.from_event_arrays(lead_ids, type_codes, timestamps, leads)
+    report = FunnelReport.from_table(table)
+    elapsed = time.perf_counter() - start
+    print()
+    print(report.to_text())
+    print(f"events={len(lead_ids):,} elapsed={elapsed:.3f}s")
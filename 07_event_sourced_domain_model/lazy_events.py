@@ -0,0 +1,256 @@
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from operator import attrgetter
+from types import GenericAlias
+from typing import Annotated, Any, Callable, Iterable, Iterator, NotRequired, TypedDict, cast, get_origin
+import json
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError, with_config
+
+from event_decoder import EVENT_TYPES, gc_paused, lead_id_of
+from lead_events import LeadEvent, Name, PhoneNumber
+from trusted_replay import replay_trusted
+
+
+#################################################
+# フィールドの宣言
+#################################################
+
+# イベントの属性名 -> (JSON上のキー, 型)
+# NOTE: name / phone_number は新規登録・連絡先変更のイベントにしかない
+WIRE_FIELDS: dict[str, tuple[str, Any]] = {
+    "lead_id": ("lead-id", str),
+    "event_id": ("event-id", int),
+    "timestamp": ("timestamp", datetime),
+    "name": ("name", NotRequired[str]),
+    "phone_number": ("phone-number", NotRequired[str]),
+}
+
+ALL_FIELDS = frozenset(WIRE_FIELDS)
+
+# レコードの型では省略可能なフィールド (持つかどうかはイベントの種別で決まる)
+OPTIONAL_FIELDS = frozenset(name for name, (_, annotation) in WIRE_FIELDS.items() if get_origin(annotation) is NotRequired)
+
+# JSON上の値 (検証済み) -> イベントの属性の値
+_CONVERTERS: dict[str, Callable[[Any], Any]] = {
+    "lead_id": lead_id_of,
+    "name": lambda value: Name(value=value),
+    "phone_number": lambda value: PhoneNumber(value=value),
+}
+
+
+# プロジェクションが宣言した読むフィールド (event_fields)。宣言がなければ全フィールド
+def event_fields_of(projection_class: type) -> frozenset[str]:
+    return getattr(projection_class, "event_fields", ALL_FIELDS)
+
+
+# フィールドが実行時に決まる TypedDict を作る
+# NOTE: 型チェッカーは TypedDict() の関数形式に辞書リテラルしか受け付けないので、この関数の中だけ Any として呼ぶ
+def _make_typed_dict(name: str, fields: dict[str, Any]) -> type:
+    return cast(Any, TypedDict)(name, fields)
+
+
+# 指定したフィールドと event-type だけを持つレコードの型 (の TypeAdapter)
+# NOTE: TypedDict に無いキーは読み飛ばされ、Pythonオブジェクトへの変換も検証も行われない
+@lru_cache(maxsize=None)
+def _records_adapter(fields: frozenset[str]) -> TypeAdapter:
+    unknown = fields - ALL_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown event fields: {sorted(unknown)}")
+    annotations: dict[str, Any] = {"event_type": Annotated[str, Field(alias="event-type")]}
+    for name in sorted(fields):
+        wire_name, annotation = WIRE_FIELDS[name]
+        annotations[name] = Annotated[annotation, Field(alias=wire_name)]
+    record_type = with_config(ConfigDict(coerce_numbers_to_str=True))(_make_typed_dict("PartialLeadEventRecord", annotations))
+    # NOTE: list[record_type] も実行時に決まる型なので、型チェッカーには Any として渡す
+    return TypeAdapter(cast(Any, GenericAlias(list, (record_type,))))
+
+
+# fields のうち、event_class のイベントが必ず持つが、レコードの型では省略可能なフィールド (デコード時に有無を確認する)
+@lru_cache(maxsize=None)
+def _required_fields(event_class: type[LeadEvent], fields: frozenset[str]) -> frozenset[str]:
+    return fields & OPTIONAL_FIELDS & frozenset(event_class.model_fields)
+
+
+# 必須のフィールドが無いレコードのエラー
+# NOTE: 全フィールドをデコードする event_decoder と同じく pydantic の ValidationError にする
+def _missing_fields_error(index: int, event_type: str, names: Iterable[str], raw: bytes) -> ValidationError:
+    return ValidationError.from_exception_data(
+        "PartialLeadEventRecord",
+        [{"type": "missing", "loc": (index, event_type, WIRE_FIELDS[name][0]), "input": raw} for name in sorted(names)],
+    )
+
+
+# NOTE: status はJSONに無く、イベントのクラスごとの既定値 (LeadStatus) を使う
+@lru_cache(maxsize=None)
+def _default_status(event_class: type[LeadEvent]):
+    field = event_class.model_fields.get("status")
+    if field is None:
+        raise AttributeError(f"{event_class.__name__} has no attribute 'status'")
+    return field.default
+
+
+#################################################
+# Lazy Event
+#################################################
+
+# 生のイベント (NDJSON の1行) を持ち、属性を読まれたときに初めてそのフィールドを変換するイベント
+# NOTE: LeadEvent と同じ属性名で読めるので、apply のハンドラをそのまま使える。
+#       宣言されていないフィールドを読まれた場合は、生のバイト列を全てデコードし直す (遅いが正しい)
+class LazyEvent:
+    __slots__ = ("event_class", "raw", "_record", "_values")
+
+    def __init__(self, event_class: type[LeadEvent], raw: bytes, record: dict[str, Any]):
+        self.event_class = event_class
+        self.raw = raw
+        self._record = record
+        self._values: dict[str, Any] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        # NOTE: __getattr__ は __slots__ にない属性を読んだときだけ呼ばれる
+        values = self._values
+        if name in values:
+            return values[name]
+        if name == "status":
+            value = _default_status(self.event_class)
+        elif name in WIRE_FIELDS:
+            record = self._record
+            if name not in record:
+                if name not in self.event_class.model_fields:
+                    raise AttributeError(f"{self.event_class.__name__} has no attribute '{name}'")
+                record = self._record = _records_adapter(ALL_FIELDS).validate_json(b"[" + self.raw + b"]")[0]
+                if name not in record:
+                    raise _missing_fields_error(0, record["event_type"], [name], self.raw)
+            value = record[name]
+            converter = _CONVERTERS.get(name)
+            if converter is not None:
+                value = converter(value)
+        else:
+            raise AttributeError(f"{self.event_class.__name__} has no attribute '{name}'")
+        values[name] = value
+        return value
+
+    # 全フィールドを変換した通常のイベント
+    def materialize(self) -> LeadEvent:
+        return self.event_class(**{name: getattr(self, name) for name in self.event_class.model_fields})
+
+    def __repr__(self) -> str:
+        return f"LazyEvent({self.event_class.__name__}, {self.raw!r})"
+
+
+#################################################
+# Loader
+#################################################
+
+# NDJSON の行 (bytes) を batch_size 件ずつ、fields のフィールドだけ検証して LazyEvent にする
+# NOTE: fields のうちイベントの種別が必ず持つフィールド (新規登録の name 等) が無いレコードは、ここで ValidationError にする
+def decode_lazy(lines: Iterable[bytes], fields: frozenset[str] = ALL_FIELDS, batch_size: int = 1024) -> Iterator[LazyEvent]:
+    fields = frozenset(fields)
+    adapter = _records_adapter(fields)
+    lines = (line.strip() for line in lines)
+    lines = iter(line for line in lines if line)
+    while batch := list(islice(lines, batch_size)):
+        with gc_paused():
+            records = adapter.validate_json(b"[" + b",".join(batch) + b"]")
+            events = []
+            for index, (raw, record) in enumerate(zip(batch, records)):
+                event_class = EVENT_TYPES.get(record["event_type"])
+                if event_class is None:
+                    raise ValueError(f"Unknown event type: {record['event_type']}")
+                required = _required_fields(event_class, fields)
+                if required and not required <= record.keys():
+                    raise _missing_fields_error(index, record["event_type"], required - record.keys(), raw)
+                events.append(LazyEvent(event_class, raw, record))
+        yield from events
+
+
+# LazyEvent を trusted_replay のハンドラ表で適用する
+# NOTE: singledispatch は LazyEvent の型で振り分けられないので、event_class でハンドラを引く。
+#       LazyEvent は LeadEvent と同じ属性名で読めるので、ハンドラには LeadEvent として渡す
+def replay_lazy[P: BaseModel](projection: P, events: Iterable[LazyEvent]) -> P:
+    return replay_trusted(projection, cast(Iterable[LeadEvent], events), event_class_of=attrgetter("event_class"))
+
+
+if __name__ == "__main__":
+    # 使い方: python lazy_events.py [リード数]
+    from functools import singledispatchmethod
+    from typing import ClassVar
+    import os
+    import sys
+    import time
+
+    from event_decoder import decode_records
+    from lead_events import FollowupSetEvent, ContactedEvent
+    import event_sourcing_analysis
+
+    # 狭いプロジェクションの例: フォローアップの回数と最終更新時刻だけを数える
+    class FollowupActivityProjection(BaseModel):
+        event_fields: ClassVar[frozenset[str]] = frozenset({"timestamp"})
+
+        followups: int = 0
+        contacts: int = 0
+        updated_on: datetime | None = None
+
+        @classmethod
+        def empty(cls) -> "FollowupActivityProjection":
+            return cls()
+
+        @singledispatchmethod
+        def apply(self, event):
+            raise TypeError("Unsupported event type")
+
+        @apply.register
+        def _(self, event: LeadEvent):
+            self.updated_on = event.timestamp
+
+        @apply.register
+        def _(self, event: FollowupSetEvent):
+            self.updated_on = event.timestamp
+            self.followups += 1
+
+        @apply.register
+        def _(self, event: ContactedEvent):
+            self.updated_on = event.timestamp
+            self.contacts += 1
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(f"{script_dir}/events.json", "r", encoding="utf-8") as f:
+        template = json.load(f)
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    lines = [
+        json.dumps({**event, "lead-id": lead}, ensure_ascii=False).encode("utf-8")
+        for lead in range(leads) for event in template
+    ]
+
+    for projection_class in (FollowupActivityProjection, event_sourcing_analysis.LeadStateModelProjection):
+        # 全フィールドをデコードしてからリプレイ
+        start = time.perf_counter()
+        eager = replay_trusted(projection_class.empty(), decode_records(json.loads(line) for line in lines))
+        eager_elapsed = time.perf_counter() - start
+
+        # 宣言したフィールドだけをデコードしてリプレイ
+        start = time.perf_counter()
+        lazy = replay_lazy(projection_class.empty(), decode_lazy(lines, event_fields_of(projection_class)))
+        lazy_elapsed = time.perf_counter() - start
+
+        assert eager == lazy
+        print(f"{projection_class.__module__}.{projection_class.__name__} fields={sorted(event_fields_of(projection_class))}")
+        print(f"  eager: {eager_elapsed:.3f}s {len(lines) / eager_elapsed:,.0f} events/sec")
+        print(f"  lazy : {lazy_elapsed:.3f}s {len(lines) / lazy_elapsed:,.0f} events/sec ({eager_elapsed / lazy_elapsed:.1f}x)")
+
+    # 宣言していないフィールドも読める (その場で全体をデコードする)
+    event = next(decode_lazy(lines[:1], frozenset({"timestamp"})))
+    print(event.name, event.status, event.materialize() == decode_records([json.loads(lines[0])]).__next__())
+
+    # 宣言したフィールドが無いレコードは、全フィールドをデコードする場合と同じく ValidationError になる
+    broken = json.dumps({k: v for k, v in json.loads(lines[0]).items() if k != "name"}, ensure_ascii=False).encode("utf-8")
+    for decode in (
+        lambda: list(decode_records([json.loads(broken)])),
+        lambda: list(decode_lazy([broken], event_fields_of(event_sourcing_analysis.LeadStateModelProjection))),
+    ):
+        try:
+            decode()
+            raise AssertionError("a record without a declared field must not decode")
+        except ValidationError as e:
+            print(e.errors()[0]["loc"])
@@ -0,0 +1,358 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator
+import glob
+import json
+import lzma
+import os
+import threading
+import zlib
+
+from binary_codec import decode_lead_event, decode_stream, encode_lead_event, encode_stream
+from event_decoder import EVENT_TYPES, decode_records
+from event_loader import iter_ndjson
+from lead_events import LeadID, LeadEvent, LeadStatusEnum
+from projection_rebuild import LeadProjection
+
+# アーカイブ対象の状態 (以後イベントがほとんど届かない)
+FINISHED_STATUSES = frozenset({LeadStatusEnum.CONVERTED, LeadStatusEnum.CLOSED})
+
+# 圧縮方式: (圧縮, 伸長)
+CODECS: dict[str, tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "zlib": (lambda data: zlib.compress(data, 9), zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+# イベント種別 (events.json の event-type) -> そのイベントで変わる状態。状態を変えないイベントは含まない
+STATUS_BY_EVENT_TYPE: dict[str, LeadStatusEnum] = {
+    name: event_class.model_fields["status"].default.value
+    for name, event_class in EVENT_TYPES.items()
+    if "status" in event_class.model_fields
+}
+
+
+#################################################
+# Archive Segment
+#################################################
+
+# 1回のアーカイブで書き出す不変のセグメント
+#   archive-00000000.seg : リードごとに binary_codec のストリームを個別に圧縮して連結したもの
+#   archive-00000000.idx : リードID -> (オフセット, 長さ, イベント数, 最後の event_id) と圧縮方式 (JSON)
+# NOTE: リード単位で圧縮するので、1リードの読み出しではそのリードの分だけを伸長する
+class ArchiveSegment:
+    def __init__(self, path: str):
+        self.path = path
+        with open(f"{path[:-len('.seg')]}.idx", "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.codec: str = index["codec"]
+        self.streams: dict[str, tuple[int, int, int, int]] = {
+            lead_id: (offset, length, count, last_event_id)
+            for lead_id, (offset, length, count, last_event_id) in index["streams"].items()
+        }
+        self.size = os.path.getsize(path)
+
+    def load(self, lead_id: str) -> list[LeadEvent]:
+        offset, length, _, _ = self.streams[lead_id]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        _, decompress = CODECS[self.codec]
+        return list(decode_stream(decompress(data), decode_lead_event))
+
+    @staticmethod
+    def write(path: str, streams: dict[str, list[LeadEvent]], codec: str) -> "ArchiveSegment":
+        compress, _ = CODECS[codec]
+        index = {}
+        buffer = bytearray()
+        for lead_id, events in streams.items():
+            data = compress(encode_stream(events, encode_lead_event))
+            index[lead_id] = (len(buffer), len(data), len(events), events[-1].event_id)
+            buffer += data
+        # NOTE: 一時ファイルに書いてから置き換える。索引はセグメントの後に置くので、
+        #       途中で落ちても索引のないセグメント (読まれない) が残るだけ
+        base = path[:-len(".seg")]
+        for target, payload in (
+            (path, bytes(buffer)),
+            (f"{base}.idx", json.dumps({"codec": codec, "streams": index}).encode("utf-8")),
+        ):
+            with open(f"{target}.tmp", "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f"{target}.tmp", target)
+        return ArchiveSegment(path)
+
+
+#################################################
+# Lead Archive
+#################################################
+
+@dataclass(frozen=True)
+class ArchiveReport:
+    leads: int           # アーカイブしたリード数
+    events: int          # アーカイブしたイベント数
+    hot_before: int      # アーカイブ前のホットデータ (NDJSON) のバイト数
+    hot_after: int       # アーカイブ後のホットデータのバイト数
+    archived_bytes: int  # 追加したアーカイブセグメントのバイト数
+
+    @property
+    def reclaimed_bytes(self) -> int:
+        return self.hot_before - self.hot_after - self.archived_bytes
+
+    def report(self) -> str:
+        moved = self.hot_before - self.hot_after
+        ratio = self.archived_bytes / moved if moved else 0.0
+        return (
+            f"archived leads={self.leads:,} events={self.events:,} "
+            f"hot={self.hot_before:,} -> {self.hot_after:,} bytes, archive=+{self.archived_bytes:,} bytes ({ratio:.0%}), "
+            f"reclaimed={self.reclaimed_bytes:,} bytes"
+        )
+
+
+# 完了したリード (FINISHED_STATUSES) のストリームを、ホットデータ (NDJSON) から圧縮済みの不変セグメントに移す階層
+# NOTE: アクティブなリードの再構築はホットデータだけを読み、アーカイブには触れない。
+#       アーカイブ済みのリードの読み出し (まれ) だけがセグメントを伸長する
+class TieredLeadEvents:
+    def __init__(self, hot_path: str, directory: str, codec: str = "zlib"):
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported codec: {codec}")
+        self.hot_path = hot_path
+        self.directory = directory
+        self.codec = codec
+        os.makedirs(directory, exist_ok=True)
+        self.segments: list[ArchiveSegment] = []
+        # リードID -> そのリードを持つセグメント
+        self.archived: dict[str, ArchiveSegment] = {}
+        self._reactivated: set[str] | None = None
+        # append と archive (ホットデータの走査から置き換えまで) を直列化する
+        # NOTE: 走査の後に追記された行は一時ファイルに含まれず、置き換えで失われるため
+        self._hot_lock = threading.Lock()
+        for path in sorted(glob.glob(os.path.join(directory, "archive-*.seg"))):
+            if os.path.exists(f"{path[:-len('.seg')]}.idx"):
+                self._add_segment(ArchiveSegment(path))
+
+    def __contains__(self, lead_id: LeadID) -> bool:
+        return lead_id.value in self.archived
+
+    def _add_segment(self, segment: ArchiveSegment):
+        self.segments.append(segment)
+        for lead_id in segment.streams:
+            self.archived[lead_id] = segment
+
+    @property
+    def archive_bytes(self) -> int:
+        return sum(segment.size for segment in self.segments)
+
+    # アーカイブ済みの最後の event_id (アーカイブしていなければ -1)
+    def _archived_position(self, lead_id: str) -> int:
+        segment = self.archived.get(lead_id)
+        return segment.streams[lead_id][3] if segment is not None else -1
+
+    # ホットデータのうち、アーカイブに移っていないレコード
+    # NOTE: アーカイブの書き出し後、ホットデータの置き換え前に落ちた場合は両方に残るので、
+    #       アーカイブ済みの event_id 以下のレコードはここで読み飛ばす
+    def iter_hot(self) -> Iterator[dict[str, Any]]:
+        if not os.path.exists(self.hot_path):
+            return
+        for record in iter_ndjson(self.hot_path):
+            if record["event-id"] > self._archived_position(str(record["lead-id"])):
+                yield record
+
+    # アーカイブ後にホットデータにイベントが届いたリード
+    # NOTE: 初回だけホットデータを走査し、以後は append で追加する
+    @property
+    def reactivated(self) -> set[str]:
+        if self._reactivated is None:
+            self._reactivated = {
+                str(record["lead-id"]) for record in self.iter_hot() if str(record["lead-id"]) in self.archived
+            }
+        return self._reactivated
+
+    # ホットデータにイベント (events.json 形式のレコード) を追記する
+    def append(self, records: list[dict[str, Any]]):
+        with self._hot_lock:
+            with open(self.hot_path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False))
+                    f.write("\n")
+            for record in records:
+                if str(record["lead-id"]) in self.archived:
+                    self.reactivated.add(str(record["lead-id"]))
+
+    # 1リードのイベント (アーカイブ済みの分 + ホットデータに後から届いた分)
+    # NOTE: アーカイブ後にイベントが届いていなければセグメントだけを読む
+    def load(self, lead_id: LeadID) -> list[LeadEvent]:
+        segment = self.archived.get(lead_id.value)
+        if segment is None:
+            return list(decode_records(record for record in self.iter_hot() if str(record["lead-id"]) == lead_id.value))
+        events = segment.load(lead_id.value)
+        if lead_id.value in self.reactivated:
+            events.extend(decode_records(
+                record for record in self.iter_hot() if str(record["lead-id"]) == lead_id.value
+            ))
+        return events
+
+    # アクティブなリードのプロジェクションを再構築する
+    # NOTE: アーカイブ後にイベントが届いたリード (まれ) だけは、アーカイブ済みの分から適用し直す
+    def rebuild[P: LeadProjection](self, projection_class: type[P]) -> dict[LeadID, P]:
+        projections: dict[LeadID, P] = {}
+        for event in decode_records(self.iter_hot()):
+            projection = projections.get(event.lead_id)
+            if projection is None:
+                projection = projections[event.lead_id] = projection_class.empty()
+                segment = self.archived.get(event.lead_id.value)
+                if segment is not None:
+                    for archived_event in segment.load(event.lead_id.value):
+                        projection.apply(archived_event)
+            projection.apply(event)
+        return projections
+
+    # 完了したリードをアーカイブし、ホットデータから取り除く
+    # NOTE: 1回目の走査で状態だけを追跡し (デコードしない)、2回目の走査で行を振り分ける
+    def archive(self) -> ArchiveReport:
+        with self._hot_lock:
+            return self._archive()
+
+    def _archive(self) -> ArchiveReport:
+        hot_before = os.path.getsize(self.hot_path) if os.path.exists(self.hot_path) else 0
+        statuses: dict[str, LeadStatusEnum] = {}
+        for record in self.iter_hot():
+            status = STATUS_BY_EVENT_TYPE.get(record["event-type"])
+            if status is not None:
+                statuses[str(record["lead-id"])] = status
+        finished = {lead_id for lead_id, status in statuses.items() if status in FINISHED_STATUSES}
+        if not finished:
+            return ArchiveReport(0, 0, hot_before, hot_before, 0)
+
+        records: dict[str, list[dict[str, Any]]] = {}
+        remaining: set[str] = set()  # ホットデータに残るリード
+        with open(f"{self.hot_path}.tmp", "w", encoding="utf-8") as out:
+            for record in self.iter_hot():
+                lead_id = str(record["lead-id"])
+                if lead_id in finished:
+                    records.setdefault(lead_id, []).append(record)
+                else:
+                    remaining.add(lead_id)
+                    out.write(json.dumps(record, ensure_ascii=False))
+                    out.write("\n")
+
+        # アーカイブ済みのリードに後から届いたイベントは、既存のストリームと合わせて書き直す
+        streams: dict[str, list[LeadEvent]] = {}
+        for lead_id, lead_records in records.items():
+            segment = self.archived.get(lead_id)
+            streams[lead_id] = (segment.load(lead_id) if segment is not None else []) + list(decode_records(lead_records))
+
+        path = os.path.join(self.directory, f"archive-{len(self.segments):08d}.seg")
+        segment = ArchiveSegment.write(path, streams, self.codec)
+        self._add_segment(segment)
+        # NOTE: アーカイブが確定してからホットデータを置き換える
+        os.replace(f"{self.hot_path}.tmp", self.hot_path)
+        # NOTE: アーカイブ後に届いたが完了していないリード (架電・注文受領のみ等) はホットデータに残るので、引き続き追跡する
+        self._reactivated = {lead_id for lead_id in remaining if lead_id in self.archived}
+        return ArchiveReport(
+            leads=len(streams),
+            events=sum(len(events) for events in streams.values()),
+            hot_before=hot_before,
+            hot_after=os.path.getsize(self.hot_path),
+            archived_bytes=segment.size + os.path.getsize(f"{path[:-len('.seg')]}.idx"),
+        )
+
+
+if __name__ == "__main__":
+    # 使い方: python lead_archive.py [リード数] [1リードあたりのイベント数]
+    import shutil
+    import sys
+    import tempfile
+    import time
+
+    from benchmarks.lead_generator import generate_events
+    from event_sourcing import LeadStateModelProjection
+    from projection_rebuild import rebuild_shard
+
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    events_per_lead = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    records = list(generate_events(leads, events_per_lead))
+    expected = rebuild_shard(LeadStateModelProjection, records)
+
+    with tempfile.TemporaryDirectory() as directory:
+        hot_path = os.path.join(directory, "events.ndjson")
+        with open(hot_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        for codec in CODECS:
+            shutil.rmtree(os.path.join(directory, codec), ignore_errors=True)
+            shutil.copy(hot_path, f"{hot_path}.{codec}")
+            tiered = TieredLeadEvents(f"{hot_path}.{codec}", os.path.join(directory, codec), codec)
+
+            start = time.perf_counter()
+            before = rebuild_shard(LeadStateModelProjection, iter_ndjson(tiered.hot_path))
+            before_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            report = tiered.archive()
+            archive_elapsed = time.perf_counter() - start
+            print(f"{codec}: {report.report()} ({archive_elapsed:.2f}s)")
+
+            # アクティブなリードの再構築はアーカイブ済みのリードを読まない
+            start = time.perf_counter()
+            active = tiered.rebuild(LeadStateModelProjection)
+            active_elapsed = time.perf_counter() - start
+            assert len(before) == leads
+            assert all(projection == expected[lead_id] for lead_id, projection in active.items())
+            assert all(lead_id in tiered for lead_id in expected.keys() - active.keys())
+            print(f"  rebuild: all={before_elapsed:.2f}s active only={active_elapsed:.2f}s ({len(active):,} leads)")
+
+            # アーカイブ済みのリードは透過的に伸長して読める
+            archived_ids = [lead_id for lead_id in expected if lead_id in tiered][:1_000]
+            start = time.perf_counter()
+            for lead_id in archived_ids:
+                projection = LeadStateModelProjection.empty()
+                for event in tiered.load(lead_id):
+                    projection.apply(event)
+                assert projection == expected[lead_id]
+            print(f"  archived read: {(time.perf_counter() - start) / len(archived_ids) * 1000:.2f}ms/lead")
+
+            # アーカイブ後に届いたイベントも読み出し・再構築に含まれる
+            lead_id = archived_ids[0]
+            last = tiered.load(lead_id)[-1]
+            tiered.append([{"lead-id": lead_id.value, "event-id": last.event_id + 1, "event-type": "架電", "timestamp": "2030-01-01T00:00:00Z"}])
+            assert tiered.load(lead_id)[-1].event_id == last.event_id + 1
+            assert tiered.rebuild(LeadStateModelProjection)[lead_id].version == expected[lead_id].version + 1
+
+            # 別のリードが完了して再度アーカイブしても、完了していないリードの後から届いたイベントは失われない
+            new_lead = str(leads)
+            tiered.append([
+                {"lead-id": new_lead, "event-id": 0, "event-type": "新規登録", "timestamp": "2030-01-01T00:00:00Z",
+                 "name": "山田太郎", "phone-number": "555-0000"},
+                {"lead-id": new_lead, "event-id": 1, "event-type": "支払完了", "timestamp": "2030-01-02T00:00:00Z"},
+            ])
+            report = tiered.archive()
+            assert report.leads == 1 and LeadID(value=new_lead) in tiered
+            assert tiered.load(lead_id)[-1].event_id == last.event_id + 1
+            assert TieredLeadEvents(tiered.hot_path, tiered.directory, codec).load(lead_id)[-1].event_id == last.event_id + 1
+
+            # アーカイブ中に別スレッドから追記されたイベントも失われない
+            concurrent_lead = str(leads + 1)
+            tiered.append([
+                {"lead-id": concurrent_lead, "event-id": 0, "event-type": "新規登録", "timestamp": "2030-01-01T00:00:00Z",
+                 "name": "山田花子", "phone-number": "555-0001"},
+                {"lead-id": concurrent_lead, "event-id": 1, "event-type": "支払完了", "timestamp": "2030-01-02T00:00:00Z"},
+            ])
+            archived = threading.Event()
+            appended = 0
+
+            def writer_loop():
+                global appended
+                # アーカイブの走査から置き換えまでの間、追記し続ける
+                while not archived.is_set():
+                    tiered.append([{"lead-id": lead_id.value, "event-id": last.event_id + 2 + appended,
+                                    "event-type": "架電", "timestamp": "2030-01-03T00:00:00Z"}])
+                    appended += 1
+                    time.sleep(0.0001)
+
+            writer = threading.Thread(target=writer_loop)
+            writer.start()
+            tiered.archive()
+            archived.set()
+            writer.join()
+            assert tiered.load(lead_id)[-1].event_id == last.event_id + 1 + appended
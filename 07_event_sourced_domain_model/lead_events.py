@@ -0,0 +1,63 @@
+from pydantic import BaseModel, ConfigDict, Field
+from datetime import datetime
+import enum
+
+
+#################################################
+# Value Object
+#################################################
+
+class LeadID(BaseModel):
+    value: str
+    model_config = ConfigDict(frozen=True)
+
+class Name(BaseModel):
+    value: str
+    model_config = ConfigDict(frozen=True)
+    
+class LeadStatusEnum(str, enum.Enum):
+    NEW_LEAD = "new_lead"
+    FOLLOWUP_SET = "followup_set"
+    PENDING_PAYMENT = "pending_payment"
+    CONVERTED = "converted"
+    CLOSED = "closed"
+
+class LeadStatus(BaseModel):
+    value: LeadStatusEnum
+    model_config = ConfigDict(frozen=True)
+
+class PhoneNumber(BaseModel):
+    value: str
+    model_config = ConfigDict(frozen=True)
+
+
+#################################################
+# Domain Event
+#################################################
+
+class LeadEvent(BaseModel):
+    lead_id: LeadID
+    event_id: int
+    timestamp: datetime
+    model_config = ConfigDict(frozen=True)
+
+class LeadInitializedEvent(LeadEvent):
+    name: Name
+    phone_number: PhoneNumber
+    status: LeadStatus = Field(default=LeadStatus(value=LeadStatusEnum.NEW_LEAD))
+
+class ContactedEvent(LeadEvent):
+    pass
+
+class FollowupSetEvent(LeadEvent):
+    status: LeadStatus = Field(default=LeadStatus(value=LeadStatusEnum.FOLLOWUP_SET))
+
+class ContactDetailsChangedEvent(LeadEvent):
+    name: Name
+    phone_number: PhoneNumber
+
+class OrderSubmittedEvent(LeadEvent):
+    status: LeadStatus = Field(default=LeadStatus(value=LeadStatusEnum.PENDING_PAYMENT))
+
+class PaymentConfirmedEvent(LeadEvent):
+    status: LeadStatus = Field(default=LeadStatus(value=LeadStatusEnum.CONVERTED))
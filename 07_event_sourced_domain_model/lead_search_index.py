@@ -0,0 +1,215 @@
+from functools import singledispatchmethod
+from typing import Iterable
+import unicodedata
+
+from lead_events import (
+    LeadID, Name, PhoneNumber,
+    LeadEvent, LeadInitializedEvent, ContactDetailsChangedEvent,
+)
+
+
+#################################################
+# 正規化・n-gram
+#################################################
+
+# 氏名の正規化: 全角/半角を揃え (NFKC)、空白を除く
+def normalize_name(name: str) -> str:
+    return "".join(unicodedata.normalize("NFKC", name).split())
+
+
+# 電話番号の正規化: 数字だけを残す ("555-2951" -> "5552951")
+def normalize_phone_number(phone_number: str) -> str:
+    return "".join(ch for ch in unicodedata.normalize("NFKC", phone_number) if ch.isdigit())
+
+
+# 1文字 + 2文字の n-gram (日本語の氏名は短いので両方使う)
+def name_grams(name: str) -> set[str]:
+    return set(name) | {name[i:i + 2] for i in range(len(name) - 1)}
+
+
+# 電話番号は数字10種類しかないので3文字の n-gram を使う
+def phone_grams(digits: str) -> set[str]:
+    return {digits[i:i + 3] for i in range(len(digits) - 2)}
+
+
+# 集合の類似度 (Dice係数)
+def dice(a: set[str], b: set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+#################################################
+# Inverted Index
+#################################################
+
+# 値 -> リードID の転置インデックス (完全一致 + n-gram)
+# NOTE: n-gram からは「値」を引き、値からリードIDを引く。
+#       同じ氏名を持つリードは多いので、部分一致・あいまい検索の検証は異なり数 (語彙) に対してだけ行えばよい
+class _InvertedIndex:
+    def __init__(self, grams):
+        self._grams = grams
+        self.exact: dict[str, set[str]] = {}     # 正規化した値 -> リードID
+        self.postings: dict[str, set[str]] = {}  # n-gram -> 正規化した値
+
+    def add(self, lead_id: str, value: str):
+        lead_ids = self.exact.get(value)
+        if lead_ids is None:
+            lead_ids = self.exact[value] = set()
+            for gram in self._grams(value):
+                self.postings.setdefault(gram, set()).add(value)
+        lead_ids.add(lead_id)
+
+    def search_exact(self, value: str) -> set[str]:
+        return self.exact.get(value, set())
+
+    # 部分一致: クエリの n-gram を全て含む値を集合の積で絞り込み、部分文字列かどうかを確かめる
+    # NOTE: 空のクエリ (正規化で全て取り除かれた場合を含む) は何にも一致しないものとする
+    def search_partial(self, fragment: str) -> set[str]:
+        if not fragment:
+            return set()
+        grams = self._grams(fragment)
+        candidates: Iterable[str]
+        if grams:
+            postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+            # NOTE: 小さい集合から順に積を取ることで、頻出する n-gram の大きな集合を走査せずに済む
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                if not candidates:
+                    break
+                candidates &= posting
+        else:
+            # n-gram より短いクエリはインデックスを使えないので語彙を走査する
+            candidates = self.exact.keys()
+        lead_ids: set[str] = set()
+        for value in candidates:
+            if fragment in value:
+                lead_ids |= self.exact[value]
+        return lead_ids
+
+    # あいまい検索: candidate_grams を1つ以上共有する値のうち、Dice係数が threshold 以上のものを返す
+    def search_fuzzy(self, value: str, candidate_grams: set[str], threshold: float) -> dict[str, float]:
+        grams = self._grams(value)
+        candidates: set[str] = set()
+        for gram in candidate_grams:
+            candidates |= self.postings.get(gram, set())
+        scores: dict[str, float] = {}
+        for candidate in candidates:
+            score = dice(grams, self._grams(candidate))
+            if score < threshold:
+                continue
+            for lead_id in self.exact[candidate]:
+                if score > scores.get(lead_id, 0.0):
+                    scores[lead_id] = score
+        return scores
+
+
+# 全リードを横断する氏名・電話番号の検索インデックス
+# NOTE: LeadInitializedEvent / ContactDetailsChangedEvent を適用するたびに差分で更新する
+class LeadSearchIndex:
+    def __init__(self):
+        self._names = _InvertedIndex(name_grams)
+        self._phone_numbers = _InvertedIndex(phone_grams)
+        self._lead_ids: dict[str, LeadID] = {}  # 検索結果で LeadID を作り直さないように保持する
+
+    # NOTE: メソッドのオーバーロードにsingledispatchmethodを使用
+    @singledispatchmethod
+    def apply(self, event: LeadEvent):
+        pass  # 氏名・電話番号を変えないイベントは無視する
+
+    @apply.register
+    def _(self, event: LeadInitializedEvent):
+        self._add(event.lead_id, event.name, event.phone_number)
+
+    @apply.register
+    def _(self, event: ContactDetailsChangedEvent):
+        self._add(event.lead_id, event.name, event.phone_number)
+
+    def _add(self, lead_id: LeadID, name: Name, phone_number: PhoneNumber):
+        self._lead_ids.setdefault(lead_id.value, lead_id)
+        self._names.add(lead_id.value, normalize_name(name.value))
+        self._phone_numbers.add(lead_id.value, normalize_phone_number(phone_number.value))
+
+    # この氏名を過去に持ったことのあるリード
+    def search_name(self, name: Name) -> set[LeadID]:
+        return self._to_lead_ids(self._names.search_exact(normalize_name(name.value)))
+
+    # 氏名の一部 ("浩美" 等) を含むリード
+    def search_name_partial(self, fragment: str) -> set[LeadID]:
+        return self._to_lead_ids(self._names.search_partial(normalize_name(fragment)))
+
+    # 氏名が似ているリード (小林浩美 -> 小林裕美 等) を類似度の高い順に返す
+    def search_name_fuzzy(self, name: Name, threshold: float = 0.5) -> list[tuple[LeadID, float]]:
+        value = normalize_name(name.value)
+        # NOTE: 候補の生成には頻度の低い2文字の n-gram だけを使う (1文字の n-gram は集合が大きすぎる)
+        bigrams = {gram for gram in name_grams(value) if len(gram) == 2} or name_grams(value)
+        scores = self._names.search_fuzzy(value, bigrams, threshold)
+        return [(self._lead_ids[lead_id], score) for lead_id, score in sorted(scores.items(), key=lambda x: -x[1])]
+
+    # この電話番号を過去に持ったことのあるリード (ハイフン等の有無は問わない)
+    def search_phone_number(self, phone_number: PhoneNumber) -> set[LeadID]:
+        return self._to_lead_ids(self._phone_numbers.search_exact(normalize_phone_number(phone_number.value)))
+
+    # 電話番号の一部 ("2951" 等) を含むリード
+    def search_phone_number_partial(self, fragment: str) -> set[LeadID]:
+        return self._to_lead_ids(self._phone_numbers.search_partial(normalize_phone_number(fragment)))
+
+    def _to_lead_ids(self, lead_ids: set[str]) -> set[LeadID]:
+        return {self._lead_ids[lead_id] for lead_id in lead_ids}
+
+
+if __name__ == "__main__":
+    # 使い方: python lead_search_index.py [リード数]
+    from datetime import datetime, timezone
+    import random
+    import sys
+    import time
+
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    family_names = ["小林", "佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "加藤"]
+    given_names = ["浩美", "裕美", "博美", "健太", "翔太", "美咲", "陽菜", "大輝", "結衣", "蓮", "葵", "悠真"]
+    random.seed(0)
+    now = datetime.now(timezone.utc)
+
+    index = LeadSearchIndex()
+    start = time.perf_counter()
+    for lead in range(leads):
+        lead_id = LeadID(value=str(lead))
+        index.apply(LeadInitializedEvent(
+            lead_id=lead_id, event_id=0, timestamp=now,
+            name=Name(value=random.choice(family_names) + random.choice(given_names)),
+            phone_number=PhoneNumber(value=f"{random.randint(0, 999):03d}-{random.randint(0, 9999):04d}"),
+        ))
+        if lead % 10 == 0:
+            index.apply(ContactDetailsChangedEvent(
+                lead_id=lead_id, event_id=1, timestamp=now,
+                name=Name(value=random.choice(family_names) + random.choice(given_names)),
+                phone_number=PhoneNumber(value=f"{random.randint(0, 999):03d}-{random.randint(0, 9999):04d}"),
+            ))
+    print(f"leads={leads} build={time.perf_counter() - start:.3f}s")
+
+    # events.json のリード12
+    index.apply(LeadInitializedEvent(
+        lead_id=LeadID(value="12"), event_id=0, timestamp=now,
+        name=Name(value="小林浩美"), phone_number=PhoneNumber(value="555-2951"),
+    ))
+    index.apply(ContactDetailsChangedEvent(
+        lead_id=LeadID(value="12"), event_id=3, timestamp=now,
+        name=Name(value="小林裕美"), phone_number=PhoneNumber(value="555-8101"),
+    ))
+
+    queries = [
+        ("search_name(小林浩美)", lambda: index.search_name(Name(value="小林浩美"))),
+        ("search_name_partial(林浩)", lambda: index.search_name_partial("林浩")),
+        ("search_name_fuzzy(小林浩美)", lambda: index.search_name_fuzzy(Name(value="小林浩美"), threshold=0.9)),
+        ("search_phone_number(5552951)", lambda: index.search_phone_number(PhoneNumber(value="5552951"))),
+        ("search_phone_number_partial(55-29)", lambda: index.search_phone_number_partial("55-29")),
+    ]
+    for label, query in queries:
+        start = time.perf_counter()
+        result = query()
+        elapsed = time.perf_counter() - start
+        print(f"{label}: hits={len(result)} {elapsed * 1000:.3f}ms")
+
+    print(index.search_phone_number(PhoneNumber(value="5558101")))  # {LeadID(value='12')} を含む
+    print([(lead_id, round(score, 2)) for lead_id, score in index.search_name_fuzzy(Name(value="小林浩美")) if lead_id.value == "12"])  # [(LeadID(value='12'), 1.0)]
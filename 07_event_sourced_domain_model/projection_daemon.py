@@ -0,0 +1,280 @@
+from dataclasses import dataclass
+from typing import Any
+import asyncio
+import json
+import os
+import pickle
+import time
+
+from event_decoder import decode_records
+from event_dedup import EventDeduplicator
+from lead_events import LeadID
+from projection_rebuild import LeadProjection
+
+
+#################################################
+# Event Source
+#################################################
+
+# 追記され続ける NDJSON ファイルを末尾から読み進めるイベントソース
+# NOTE: event_id はリード内の連番なので、読み進めた位置は「ファイル先頭からのイベント数」と「バイトオフセット」で表す
+class NdjsonEventSource:
+    def __init__(self, path: str):
+        self.path = path
+        self._head = 0         # ファイル内のイベント数 (完結した空でない行の数)
+        self._head_offset = 0  # 数え終わったバイトオフセット
+
+    # 末尾に追記された分だけ行を数えて head を更新する
+    # NOTE: read_batch と同じく空行はイベントとして数えない (数えると position が head に届かず lag が 0 にならない)
+    def head(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "rb") as f:
+            f.seek(self._head_offset)
+            # 前のチャンクの末尾で途切れた行 (改行までは次のチャンクと合わせて数える)
+            partial = b""
+            while chunk := f.read(1024 * 1024):
+                data = partial + chunk
+                complete = data.rfind(b"\n") + 1
+                self._head += sum(1 for line in data[:complete].split(b"\n") if line.strip())
+                self._head_offset += complete
+                partial = data[complete:]
+            # NOTE: EOF で改行で終わらない末尾の行は書き込み途中なので数えない (_head_offset はその行の先頭のまま)
+        return self._head
+
+    # offset から最大 limit 件のイベントを読む。戻り値は (イベント, 次のオフセット)
+    def read_batch(self, offset: int, limit: int) -> tuple[list[dict[str, Any]], int]:
+        records: list[dict[str, Any]] = []
+        if not os.path.exists(self.path):
+            return records, offset
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while len(records) < limit:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break  # 書き込み途中の行は次のポーリングで読む
+                offset += len(line)
+                if line.strip():
+                    records.append(json.loads(line))
+        return records, offset
+
+
+#################################################
+# Checkpoint
+#################################################
+
+@dataclass
+class Checkpoint:
+    position: int = 0  # 適用済みのイベント数
+    offset: int = 0    # 適用済みのバイトオフセット
+
+
+@dataclass(frozen=True)
+class ProjectorMetrics:
+    position: int
+    head: int
+    lag: int                # head - position (未適用のイベント数)
+    events_per_sec: float   # 直近のポーリングでの適用速度
+    events_total: int       # 起動してから適用したイベント数
+
+
+#################################################
+# Projector
+#################################################
+
+# イベントソースを追いかけてプロジェクションを更新し続けるデーモン
+class CatchUpProjector:
+    def __init__(
+        self,
+        source: NdjsonEventSource,
+        projections: dict[str, type[LeadProjection]],
+        state_path: str,
+        batch_size: int = 1000,
+        poll_interval: float = 1.0,
+        save_interval: float = 10.0,
+        deduplicator: EventDeduplicator | None = None,
+    ):
+        self.source = source
+        self.projections = projections
+        self.state_path = state_path            # リードモデル + チェックポイント (pickle)
+        self.checkpoint_path = f"{state_path}.checkpoint.json"  # 監視用のチェックポイント
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.save_interval = save_interval
+        # NOTE: 重複排除の状態はリードモデルと一緒に保存するので、再起動をまたいでも1回だけ適用される
+        self.deduplicator = deduplicator
+
+        self.checkpoint = Checkpoint()
+        self.read_models: dict[str, dict[LeadID, LeadProjection]] = {name: {} for name in projections}
+        self._events_total = 0
+        self._events_per_sec = 0.0
+        self._saved_at = time.monotonic()
+
+    # 保存済みのリードモデルを読み込む (ウォームスタート)。なければイベント0から再生する
+    def load(self) -> bool:
+        if not os.path.exists(self.state_path):
+            return False
+        with open(self.state_path, "rb") as f:
+            state = pickle.load(f)
+        self.checkpoint = state["checkpoint"]
+        for name in self.projections:
+            self.read_models[name] = state["read_models"].get(name, {})
+        if self.deduplicator is not None and state.get("deduplicator") is not None:
+            self.deduplicator = state["deduplicator"]
+        return True
+
+    # リードモデルとチェックポイントを一緒に保存する
+    # NOTE: 一時ファイルに書いてから置き換えるので、途中で落ちても前回の状態が残る
+    def save(self):
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(
+                {"checkpoint": self.checkpoint, "read_models": self.read_models, "deduplicator": self.deduplicator},
+                f, protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp, self.state_path)
+        with open(f"{self.checkpoint_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"position": self.checkpoint.position, "offset": self.checkpoint.offset}, f)
+        os.replace(f"{self.checkpoint_path}.tmp", self.checkpoint_path)
+        self._saved_at = time.monotonic()
+
+    def metrics(self) -> ProjectorMetrics:
+        head = max(self.source.head(), self.checkpoint.position)
+        return ProjectorMetrics(
+            position=self.checkpoint.position,
+            head=head,
+            lag=head - self.checkpoint.position,
+            events_per_sec=self._events_per_sec,
+            events_total=self._events_total,
+        )
+
+    # 1回ポーリングして、読めたイベントを全プロジェクションに適用する。適用した件数を返す
+    # NOTE: 読み込みだけでなく重複排除・デコード・適用 (CPU を使う部分) もスレッドで行い、イベントループを止めない。
+    #       リードモデルと重複排除の状態に触れるのは poll / save だけで、どちらも前の呼び出しを待ってから動く
+    async def poll(self) -> int:
+        records, offset = await asyncio.to_thread(self.source.read_batch, self.checkpoint.offset, self.batch_size)
+        if not records:
+            return 0
+
+        start = time.perf_counter()
+        await asyncio.to_thread(self._apply, records)
+        elapsed = time.perf_counter() - start
+
+        self.checkpoint = Checkpoint(position=self.checkpoint.position + len(records), offset=offset)
+        self._events_total += len(records)
+        self._events_per_sec = len(records) / elapsed if elapsed > 0 else 0.0
+        return len(records)
+
+    def _apply(self, records: list[dict[str, Any]]):
+        accepted = self.deduplicator.filter(records) if self.deduplicator is not None else records
+        for event in decode_records(accepted):
+            for name, projection_class in self.projections.items():
+                read_model = self.read_models[name]
+                projection = read_model.get(event.lead_id)
+                if projection is None:
+                    projection = read_model[event.lead_id] = projection_class.empty()
+                projection.apply(event)
+
+    # 追いつくまで (lag が 0 になるまで) 適用する
+    async def catch_up(self):
+        while await self.poll():
+            pass
+
+    # stop がセットされるまでポーリングを続ける
+    async def run(self, stop: asyncio.Event):
+        self.load()
+        try:
+            while not stop.is_set():
+                applied = await self.poll()
+                if time.monotonic() - self._saved_at >= self.save_interval:
+                    await asyncio.to_thread(self.save)
+                if applied < self.batch_size:
+                    # 末尾まで読んだら次のポーリングまで待つ
+                    try:
+                        await asyncio.wait_for(stop.wait(), timeout=self.poll_interval)
+                    except TimeoutError:
+                        pass
+        finally:
+            await asyncio.to_thread(self.save)
+
+
+if __name__ == "__main__":
+    # 使い方: python projection_daemon.py [リード数]
+    import sys
+    import tempfile
+
+    import event_sourcing
+    import event_sourcing_analysis
+    import event_sourcing_search
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(f"{script_dir}/events.json", "r", encoding="utf-8") as f:
+        template = json.load(f)
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+
+    def append(path: str, lead_numbers: range):
+        with open(path, "a", encoding="utf-8") as f:
+            for lead in lead_numbers:
+                for event in template:
+                    f.write(json.dumps({**event, "lead-id": lead}, ensure_ascii=False) + "\n")
+
+    projections: dict[str, type[LeadProjection]] = {
+        "state": event_sourcing.LeadStateModelProjection,
+        "analysis": event_sourcing_analysis.LeadStateModelProjection,
+        "search": event_sourcing_search.LeadStateModelProjection,
+    }
+
+    async def main(directory: str):
+        events_path = os.path.join(directory, "events.ndjson")
+        state_path = os.path.join(directory, "read_models.pickle")
+        append(events_path, range(leads))
+
+        # 1回目: イベント0から再生しながら、途中で追記されたイベントも追いかける
+        projector = CatchUpProjector(
+            NdjsonEventSource(events_path), projections, state_path, poll_interval=0.1, deduplicator=EventDeduplicator()
+        )
+        stop = asyncio.Event()
+        task = asyncio.create_task(projector.run(stop))
+
+        # 適用中もイベントループは止まらない (10ms ごとのタイマーがどれだけ遅れたか)
+        ticks: list[float] = []
+
+        async def ticker():
+            while not stop.is_set():
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.01)
+
+        ticker_task = asyncio.create_task(ticker())
+        await asyncio.sleep(0.2)
+        print("running :", projector.metrics())
+        append(events_path, range(leads, leads * 2))
+        while projector.metrics().lag:
+            await asyncio.sleep(0.1)
+        stop.set()
+        await task
+        await ticker_task
+        print("stopped :", projector.metrics())
+        print(f"event loop: ticks={len(ticks)} max gap={max(b - a for a, b in zip(ticks, ticks[1:])) * 1000:.0f}ms")
+
+        # 2回目: 保存済みのリードモデルから再開し、停止中に追記された末尾だけを適用する
+        append(events_path, range(leads * 2, leads * 2 + 10))
+        start = time.perf_counter()
+        projector = CatchUpProjector(NdjsonEventSource(events_path), projections, state_path, deduplicator=EventDeduplicator())
+        projector.load()
+        print(f"warm start: {time.perf_counter() - start:.3f}s", projector.metrics())
+        await projector.catch_up()
+        print("caught up:", projector.metrics())
+        print(projector.read_models["analysis"][LeadID(value="12")])
+
+        # プロデューサーのリトライで同じイベントがもう一度届いても、リードモデルは変わらない
+        retried = projector.read_models["analysis"][LeadID(value=str(leads * 2))]
+        assert isinstance(retried, event_sourcing_analysis.LeadStateModelProjection)
+        before = retried.model_copy()
+        append(events_path, range(leads * 2, leads * 2 + 10))
+        await projector.catch_up()
+        assert projector.read_models["analysis"][LeadID(value=str(leads * 2))] == before
+        assert projector.deduplicator is not None
+        print("retried :", projector.deduplicator.report())
+
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(main(directory))
@@ -0,0 +1,246 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from types import GenericAlias
+from typing import Any, Iterable, Iterator, Protocol, Self, cast
+import json
+import os
+import pickle
+import re
+import tempfile
+import zlib
+
+from pydantic import BaseModel, TypeAdapter
+
+from apply_profiler import ApplyProfiler, ApplyStats
+from event_decoder import decode_records
+from event_loader import iter_ndjson
+from lead_events import LeadID, LeadEvent
+
+# NDJSON の1行から lead-id の値 (文字列または数値のトークン) を取り出す
+_LEAD_ID_PATTERN = re.compile(rb'"lead-id"\s*:\s*("(?:[^"\\]|\\.)*"|[^,}\s]+)')
+
+
+class LeadProjection(Protocol):
+    @classmethod
+    def empty(cls) -> Self: ...
+
+    def apply(self, event: LeadEvent) -> None: ...
+
+
+#################################################
+# Sharding
+#################################################
+
+# リードIDからシャード番号を求める
+# NOTE: hash() は PYTHONHASHSEED によってプロセスごとに値が変わるため crc32 を使う
+def shard_of(lead_id: str, shards: int) -> int:
+    return zlib.crc32(lead_id.encode("utf-8")) % shards
+
+
+# NDJSON の1行のリードID
+# NOTE: 行全体を JSON としてデコードせず、正規表現で lead-id だけを取り出す。
+#       取り出せない行 (キーの書き方が想定と違う等) は行全体をデコードする
+def _lead_id_of_line(line: bytes) -> str:
+    match = _LEAD_ID_PATTERN.search(line)
+    if match is None:
+        return str(json.loads(line)["lead-id"])
+    token = match.group(1)
+    if token.startswith(b'"') and b"\\" not in token:
+        return token[1:-1].decode("utf-8")
+    return str(json.loads(token))
+
+
+# ファイルを parts 個のバイト範囲 [start, end) に分ける (境界は行の先頭に揃える)
+def byte_ranges(path: str, parts: int) -> list[tuple[int, int]]:
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, "rb") as f:
+        for part in range(1, parts):
+            offset = max(size * part // parts, boundaries[-1])
+            if offset > 0:
+                f.seek(offset - 1)
+                f.readline()  # offset - 1 を含む行の残りを読み飛ばす (offset が行頭ならちょうど改行1文字)
+                offset = f.tell()
+            boundaries.append(min(offset, size))
+    boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+# シャード分けの中間ファイル (part 番目のバイト範囲のうち、shard 番目のシャードの行)
+def _part_path(directory: str, part: int, shard: int) -> str:
+    return os.path.join(directory, f"part-{part:04d}-shard-{shard:04d}.ndjson")
+
+
+# ワーカープロセスで path の [start, end) の行をリードIDのシャードごとの中間ファイルに振り分ける
+def _partition_range(path: str, start: int, end: int, part: int, shards: int, directory: str):
+    outputs = [open(_part_path(directory, part, shard), "wb") for shard in range(shards)]
+    try:
+        with open(path, "rb") as f:
+            f.seek(start)
+            offset = start
+            while offset < end:
+                line = f.readline()
+                if not line:
+                    break
+                offset += len(line)
+                if line.strip():
+                    outputs[shard_of(_lead_id_of_line(line), shards)].write(line if line.endswith(b"\n") else line + b"\n")
+    finally:
+        for output in outputs:
+            output.close()
+
+
+#################################################
+# Rebuild
+#################################################
+
+# 1シャード分のイベントをデコードし、既存の apply でリードごとの状態を再構築する
+# NOTE: profiler を渡すと、その間だけ apply をイベント種別ごとに計測する
+def rebuild_shard[P: LeadProjection](
+    projection_class: type[P], records: Iterable[dict[str, Any]], profiler: ApplyProfiler | None = None
+) -> dict[LeadID, P]:
+    if profiler is not None:
+        with profiler.profiling(projection_class):
+            return rebuild_shard(projection_class, records)
+    projections: dict[LeadID, P] = {}
+    for event in decode_records(records):
+        projection = projections.get(event.lead_id)
+        if projection is None:
+            projection = projections[event.lead_id] = projection_class.empty()
+        projection.apply(event)
+    return projections
+
+
+# リードID (文字列) -> プロジェクション を JSON で受け渡すためのアダプタ
+# NOTE: dict[str, projection_class] は型変数を含むので mypy では型として書けず、実行時に組み立てる
+def _projections_adapter[P: LeadProjection](projection_class: type[P]) -> TypeAdapter[dict[str, P]]:
+    return TypeAdapter(cast(Any, GenericAlias(dict, (str, projection_class))))
+
+
+# ワーカープロセスで1つのシャードの中間ファイル (バイト範囲の順) のリードを再構築し、JSON にまとめて返す
+# NOTE: computed_field は入力として受け付けない (extra="forbid" で検証エラーになる) ので JSON から除く。
+#       PrivateAttr の状態は JSON に含まれないので、リードID -> __pydantic_private__ を pickle で別に返す
+#       (PrivateAttr を持たないモデルでは None)。profile=True のときは計測値も返す
+def _rebuild_file_shard(
+    projection_class: type[LeadProjection], paths: list[str], profile: bool
+) -> tuple[bytes, bytes | None, dict[tuple[str, str], ApplyStats] | None]:
+    profiler = ApplyProfiler() if profile else None
+    records = chain.from_iterable(iter_ndjson(path) for path in paths)
+    projections = rebuild_shard(projection_class, records, profiler)
+    model_class = cast(type[BaseModel], projection_class)
+    data = _projections_adapter(projection_class).dump_json(
+        {lead_id.value: projection for lead_id, projection in projections.items()},
+        exclude={"__all__": set(model_class.model_computed_fields)},
+    )
+    private = None
+    if model_class.__private_attributes__:
+        private = pickle.dumps(
+            {lead_id.value: cast(BaseModel, projection).__pydantic_private__ for lead_id, projection in projections.items()}
+        )
+    return data, private, profiler.stats if profiler is not None else None
+
+
+# 全リードのプロジェクションを workers 個のプロセスで並列に再構築する
+# NOTE: 2段階で処理し、どの段階でも各ワーカーは自分の分だけを読む
+#       (親プロセスでデコード・振り分けしたレコードを pickle で渡すと、親の直列処理と転送がボトルネックになる)。
+#       1. ファイルを行の先頭に揃えた workers 個のバイト範囲に分け、各ワーカーが自分の範囲の行を
+#          リードIDのシャードごとの中間ファイルに振り分ける (行は JSON としてデコードしない)
+#       2. 各ワーカーが自分のシャードの中間ファイルをバイト範囲の順に読み、再構築する
+#          (範囲の順に読むので、リードごとのイベントの順序はファイルの順と変わらない)。
+#       結果は pydantic モデルを pickle せず、JSON (bytes) にまとめて返し、親で pydantic-core により検証し直す
+#       (PrivateAttr の状態だけは pickle で返して戻す)。そのため projection_class は pydantic のモデルである必要がある
+def rebuild_projections[P: LeadProjection](
+    projection_class: type[P],
+    path: str,
+    workers: int | None = None,
+    profiler: ApplyProfiler | None = None,
+) -> dict[LeadID, P]:
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return rebuild_shard(projection_class, iter_ndjson(path), profiler)
+
+    adapter = _projections_adapter(projection_class)
+    projections: dict[LeadID, P] = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool, tempfile.TemporaryDirectory() as directory:
+        ranges = byte_ranges(path, workers)
+        for future in [
+            pool.submit(_partition_range, path, start, end, part, workers, directory)
+            for part, (start, end) in enumerate(ranges)
+        ]:
+            future.result()
+        futures = [
+            pool.submit(
+                _rebuild_file_shard,
+                projection_class,
+                [_part_path(directory, part, shard) for part in range(len(ranges))],
+                profiler is not None,
+            )
+            for shard in range(workers)
+        ]
+        # シャード間でリードは重複しないので、そのままマージできる
+        for future in futures:
+            data, private, stats = future.result()
+            states = pickle.loads(private) if private is not None else {}
+            for lead_id, projection in adapter.validate_json(data).items():
+                if lead_id in states:
+                    # NOTE: BaseModel.__setattr__ を経由せずに置き換える (pydantic の __setstate__ と同じ方法)
+                    object.__setattr__(projection, "__pydantic_private__", states[lead_id])
+                projections[LeadID(value=lead_id)] = projection
+            # NOTE: 計測はワーカーごとに行い、計測値を profiler に足し込む
+            if profiler is not None and stats is not None:
+                profiler.merge(stats)
+    return projections
+
+
+if __name__ == "__main__":
+    # 使い方: python projection_rebuild.py [リード数] [ワーカー数] [apply の計測結果 (JSON) の出力先]
+    import sys
+    import time
+
+    from event_sourcing import LeadStateModelProjection
+    import event_sourcing_analysis
+    import event_sourcing_search
+
+    projection_classes: list[type[LeadProjection]] = [
+        LeadStateModelProjection,
+        event_sourcing_analysis.LeadStateModelProjection,
+        event_sourcing_search.LeadStateModelProjection,
+    ]
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(f"{script_dir}/events.json", "r", encoding="utf-8") as f:
+        template = json.load(f)
+
+    # events.json のイベント列をリードIDを変えて複製し、合成データ (NDJSON) を作る
+    leads = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "events.ndjson")
+        with open(path, "w", encoding="utf-8") as f:
+            for lead in range(leads):
+                for event in template:
+                    f.write(json.dumps({**event, "lead-id": lead}, ensure_ascii=False) + "\n")
+        events = leads * len(template)
+
+        results = {}
+        for n in sorted({1, workers}):
+            start = time.perf_counter()
+            results[n] = rebuild_projections(LeadStateModelProjection, path, workers=n)
+            elapsed = time.perf_counter() - start
+            print(f"workers={n} leads={len(results[n])} events={events} elapsed={elapsed:.3f}s events/sec={events / elapsed:,.0f}")
+
+        assert results[1] == results[workers]
+        print(results[workers][LeadID(value="12")])
+
+        # どのプロジェクションでも、ワーカー数によらず同じ状態 (PrivateAttr を含む) に再構築されることを確かめる
+        for projection_class in projection_classes:
+            expected = rebuild_projections(projection_class, path, workers=1)
+            actual = rebuild_projections(projection_class, path, workers=max(workers, 2))
+            assert expected == actual, projection_class.__module__
+
+        # 再構築の最後に apply の計測結果を出力する
+        if len(sys.argv) > 3:
+            profiler = ApplyProfiler()
+            assert rebuild_projections(LeadStateModelProjection, path, workers=workers, profiler=profiler) == results[1]
+            profiler.dump(sys.argv[3])
+            print(profiler.to_text())
@@ -0,0 +1,308 @@
+from contextlib import contextmanager
+from typing import Iterator
+import json
+
+from sqlalchemy import Engine, and_, create_engine, event, func, insert, or_, select
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+
+from db.models import Event, Snapshot
+from event_sourcing_domain_model import (
+    ConcurrencyConflictError, EVENT_TYPES, LOCK_STRIPES, DomainEvent, SnapshotPolicy, TicketID, TicketSnapshot,
+    TicketState, TicketStateCache, TicketsRepository,
+)
+
+# 書き込みのトランザクションに付ける実行オプション (SQLite では BEGIN IMMEDIATE で始める。他のDBでは無視される)
+WRITE_EXECUTION_OPTIONS = {"sqlite_begin_immediate": True}
+
+
+# SQLite で読み込み -> 書き込みのトランザクションを扱えるようにしたエンジン
+# NOTE: pysqlite は BEGIN を遅延させるため、書き込み時のロック昇格で即座に "database is locked" になる。
+#       書き込みのトランザクション (WRITE_EXECUTION_OPTIONS) だけは BEGIN IMMEDIATE で書き込みロックを取り、busy timeout で待たせる。
+#       読み込みのトランザクションは通常の BEGIN で始め、書き込みロックを待たない
+def create_sqlite_engine(url: str) -> Engine:
+    engine = create_engine(url, connect_args={"timeout": 30, "check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _(conn):
+        immediate = conn.get_execution_options().get("sqlite_begin_immediate", False)
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if immediate else "BEGIN")
+
+    return engine
+
+
+# MySQL (InnoDB) のデッドロック (1213)・ロック待ちタイムアウト (1205)
+# NOTE: 同じストリームに同時に追記すると、主キーの範囲ロックを待つ・奪い合う形で起きる。トランザクションはロールバック済みなので、
+#       一意制約違反と同じく楽観的な排他制御の競合として扱う
+MYSQL_LOCK_CONFLICTS = frozenset({1205, 1213})
+
+
+def _is_lock_conflict(error: OperationalError) -> bool:
+    # ドライバ (PyMySQL / mysqlclient) の例外は args[0] にエラーコードを持つ
+    code = error.orig.args[0] if error.orig is not None and error.orig.args else None
+    return code in MYSQL_LOCK_CONFLICTS
+
+
+# IN 句に並べるストリームIDの最大数 (SQLite のプレースホルダ数の上限より小さくする)
+IN_CLAUSE_SIZE = 500
+
+
+def _rows(stream_id: str, events: list[DomainEvent], expected_version: int) -> list[dict]:
+    return [
+        {
+            "stream_id": stream_id,
+            "version": expected_version + i,
+            "event_type": type(e).__name__,
+            "occurred_at": e.timestamp,
+            "payload": e.model_dump_json(),
+        }
+        for i, e in enumerate(events, start=1)
+    ]
+
+
+# TicketsRepository の SQLAlchemy 実装
+# NOTE: load_events / save_events のインターフェースは TicketsRepository と同じ。スナップショットも snapshots テーブルに保存する
+class SQLTicketsRepository(TicketsRepository):
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        snapshot_policy: SnapshotPolicy | None = None,
+        lock_stripes: int = LOCK_STRIPES,
+        state_cache: TicketStateCache | None = None,
+    ):
+        super().__init__(snapshot_policy=snapshot_policy, lock_stripes=lock_stripes, state_cache=state_cache)
+        self._session_factory = session_factory
+
+    # イベント・スナップショットはDBに保存するので、基底クラスのインメモリの dict は作らない
+    def _init_store(self):
+        pass
+
+    # 書き込みのトランザクション
+    # NOTE: 最初の SQL の前に実行オプションを付けた接続を取り、SQLite では BEGIN IMMEDIATE で始める
+    @contextmanager
+    def _write_transaction(self) -> Iterator[Session]:
+        with self._session_factory() as session, session.begin():
+            session.connection(execution_options=WRITE_EXECUTION_OPTIONS)
+            yield session
+
+    # イベントのロード (start 番目以降)
+    def load_events(self, ticket_id: TicketID, start: int = 0) -> list[DomainEvent]:
+        with self._session_factory() as session:
+            rows = session.execute(
+                select(Event.event_type, Event.payload)
+                .where(Event.stream_id == str(ticket_id.value), Event.version > start)
+                .order_by(Event.version)
+            )
+            return [EVENT_TYPES[event_type].model_validate_json(payload) for event_type, payload in rows]
+
+    # 複数ストリームのイベントのロード
+    # NOTE: (stream_id = ? AND version > ?) を OR でつないで一度に読む。スナップショット (start) より前のイベントは
+    #       主キーのインデックスの範囲検索で読み飛ばされ、DBからは転送されない。
+    #       1ストリームあたり2つのプレースホルダを使うので、1回の SELECT で読むストリーム数は IN_CLAUSE_SIZE の半分にする
+    def load_events_many(self, starts: dict[TicketID, int]) -> dict[TicketID, list[DomainEvent]]:
+        events: dict[TicketID, list[DomainEvent]] = {ticket_id: [] for ticket_id in starts}
+        ticket_ids = {str(ticket_id.value): ticket_id for ticket_id in starts}
+        stream_ids = list(ticket_ids)
+        chunk_size = IN_CLAUSE_SIZE // 2
+        with self._session_factory() as session:
+            for i in range(0, len(stream_ids), chunk_size):
+                rows = session.execute(
+                    select(Event.stream_id, Event.event_type, Event.payload)
+                    .where(or_(*(
+                        and_(Event.stream_id == stream_id, Event.version > starts[ticket_ids[stream_id]])
+                        for stream_id in stream_ids[i:i + chunk_size]
+                    )))
+                    .order_by(Event.stream_id, Event.version)
+                )
+                for stream_id, event_type, payload in rows:
+                    events[ticket_ids[stream_id]].append(EVENT_TYPES[event_type].model_validate_json(payload))
+        return events
+
+    # 複数ストリームへの追記
+    # NOTE: 現在のバージョンを1回の SELECT で確認し、競合しなかったストリームのイベントを1つの INSERT で書き込む
+    def save_events_many(self, appends: list[tuple[TicketID, list[DomainEvent], int]]) -> set[TicketID]:
+        if len({ticket_id for ticket_id, _, _ in appends}) != len(appends):
+            # 同じストリームへの複数回の追記は1件ずつ確認する
+            return super().save_events_many(appends)
+        stream_ids = [str(ticket_id.value) for ticket_id, _, _ in appends]
+        try:
+            with self._write_transaction() as session:
+                current_versions: dict[str, int] = {}
+                for i in range(0, len(stream_ids), IN_CLAUSE_SIZE):
+                    versions = session.execute(
+                        select(Event.stream_id, func.max(Event.version))
+                        .where(Event.stream_id.in_(stream_ids[i:i + IN_CLAUSE_SIZE]))
+                        .group_by(Event.stream_id)
+                    )
+                    current_versions.update((stream_id, version) for stream_id, version in versions)
+                conflicts = set()
+                rows = []
+                for (ticket_id, events, expected_version), stream_id in zip(appends, stream_ids):
+                    if current_versions.get(stream_id, 0) != expected_version:
+                        conflicts.add(ticket_id)
+                        continue
+                    rows.extend(_rows(stream_id, events, expected_version))
+                if rows:
+                    session.execute(insert(Event), rows)
+                return conflicts
+        except IntegrityError:
+            # 確認と書き込みの間に他のトランザクションが追記した: 1件ずつやり直して競合したストリームを特定する
+            return super().save_events_many(appends)
+        except OperationalError as e:
+            if not _is_lock_conflict(e):
+                raise
+            return super().save_events_many(appends)
+
+    # イベントの保存
+    # NOTE: 複数イベントは1つの INSERT ... VALUES (...), (...), ... で書き込む
+    def save_events(self, ticket_id: TicketID, events: list[DomainEvent], expected_version: int):
+        stream_id = str(ticket_id.value)
+        try:
+            with self._write_transaction() as session:
+                current_version = session.scalar(
+                    select(func.coalesce(func.max(Event.version), 0)).where(Event.stream_id == stream_id)
+                )
+                if current_version != expected_version:
+                    raise ConcurrencyConflictError()
+                if not events:
+                    return
+                session.execute(insert(Event).values(_rows(stream_id, events, expected_version)))
+        except IntegrityError:
+            # 読み込みと書き込みの間に他のトランザクションが同じバージョンを書いた
+            raise ConcurrencyConflictError()
+        except OperationalError as e:
+            if not _is_lock_conflict(e):
+                raise
+            raise ConcurrencyConflictError()
+
+    # ストリームの長さ (保存済みのイベント数)
+    def stream_length(self, ticket_id: TicketID) -> int:
+        with self._session_factory() as session:
+            return session.scalar(
+                select(func.coalesce(func.max(Event.version), 0)).where(Event.stream_id == str(ticket_id.value))
+            )
+
+    # スナップショットの保存 (ストリームごとに最新の1件を上書きする)
+    def save_snapshot(self, snapshot: TicketSnapshot):
+        stream_id = str(snapshot.ticket_id.value)
+        state = json.dumps(snapshot.state)
+        try:
+            with self._write_transaction() as session:
+                row = session.get(Snapshot, stream_id)
+                if row is None:
+                    session.add(Snapshot(
+                        stream_id=stream_id, schema_version=snapshot.schema_version, position=snapshot.position, state=state,
+                    ))
+                else:
+                    row.schema_version = snapshot.schema_version
+                    row.position = snapshot.position
+                    row.state = state
+        except IntegrityError:
+            # 他のトランザクションが同時に最初のスナップショットを書いた。
+            # スナップショットはロードを速くするためだけのものなので、書けなくても整合性は崩れない
+            pass
+
+    # 最新のスナップショットのロード (スキーマが古いものは無視する)
+    def load_snapshot(self, ticket_id: TicketID) -> TicketSnapshot | None:
+        with self._session_factory() as session:
+            row = session.get(Snapshot, str(ticket_id.value))
+            if row is None or row.schema_version != TicketState.snapshot_schema_version:
+                return None
+            return TicketSnapshot(
+                ticket_id=ticket_id, schema_version=row.schema_version, position=row.position, state=json.loads(row.state),
+            )
+
+
+if __name__ == "__main__":
+    # 使い方: python sql_event_store.py [--drop-tables] [DBのURL] [ライター数] [ライターあたりの保存回数] [1回あたりのイベント数]
+    # NOTE: ベンチマークは events / snapshots テーブルを作り直す (DROP TABLE)。
+    #       SQLite 以外の URL は、そのDBのテーブルを消してよいことを --drop-tables で明示したときだけ使う
+    from collections import Counter
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import datetime
+    import os
+    import random
+    import sys
+    import tempfile
+    import time
+
+    from db.models import Base
+    from event_sourcing_domain_model import EscalatedEvent, EveryKEventsSnapshotPolicy, TicketAPI
+
+    drop_tables = "--drop-tables" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--drop-tables"]
+    with tempfile.TemporaryDirectory() as directory:
+        url = args[0] if len(args) > 0 else f"sqlite:///{os.path.join(directory, 'events.db')}"
+        writers = int(args[1]) if len(args) > 1 else 8
+        saves_per_writer = int(args[2]) if len(args) > 2 else 500
+        batch_size = int(args[3]) if len(args) > 3 else 10
+        if not url.startswith("sqlite") and not drop_tables:
+            sys.exit(
+                f"refusing to drop the events/snapshots tables in {url}: "
+                "use a dedicated benchmark database and pass --drop-tables"
+            )
+
+        engine = create_sqlite_engine(url) if url.startswith("sqlite") else create_engine(url, pool_size=writers)
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        repo = SQLTicketsRepository(sessionmaker(engine))
+
+        # 既存の TicketAPI からそのまま使える
+        ticket_id = TicketID()
+        TicketAPI(repo).request_escalation(ticket_id)
+        print(repo.load_ticket(ticket_id).state)
+
+        # スナップショットはDBに保存され、別のリポジトリ (再起動後) からも読める
+        snapshot_repo = SQLTicketsRepository(sessionmaker(engine), snapshot_policy=EveryKEventsSnapshotPolicy(k=1))
+        snapshot_ticket_id = TicketID()
+        TicketAPI(snapshot_repo).request_escalation(snapshot_ticket_id)
+        snapshot = SQLTicketsRepository(sessionmaker(engine)).load_snapshot(snapshot_ticket_id)
+        assert snapshot is not None and snapshot.position == 1
+        assert repo.load_ticket(snapshot_ticket_id).state == snapshot_repo.load_ticket(snapshot_ticket_id).state
+
+        # 読み込みは書き込みロックを取らないので、書き込みのトランザクション中でも待たされない
+        with repo._write_transaction():
+            start = time.perf_counter()
+            assert repo.load_events(ticket_id) and repo.load_snapshot(snapshot_ticket_id) is not None
+            assert time.perf_counter() - start < 1
+
+        # 並行ライター: 少数のストリームを奪い合うので、一部は競合エラーになる
+        ticket_ids = [TicketID() for _ in range(writers * 4)]
+        now = datetime.now()
+
+        def writer() -> tuple[int, int]:
+            appended = conflicts = 0
+            for _ in range(saves_per_writer):
+                ticket_id = random.choice(ticket_ids)
+                try:
+                    repo.save_events(ticket_id, [EscalatedEvent(timestamp=now)] * batch_size, repo.stream_length(ticket_id))
+                    appended += batch_size
+                except ConcurrencyConflictError:
+                    conflicts += 1
+            return appended, conflicts
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=writers) as pool:
+            results = [f.result() for f in [pool.submit(writer) for _ in range(writers)]]
+        elapsed = time.perf_counter() - start
+
+        appended = sum(a for a, _ in results)
+        conflicts = sum(c for _, c in results)
+        print(f"writers={writers} batch={batch_size} appended={appended} elapsed={elapsed:.3f}s")
+        print(f"appends/sec={appended / elapsed:,.0f} conflicts={conflicts} ({conflicts / (writers * saves_per_writer):.1%})")
+        assert sum(repo.stream_length(t) for t in ticket_ids) == appended
+
+        # 一括エスカレーション: ロード・追記をそれぞれまとめて行う
+        sweep_ticket_ids = [TicketID() for _ in range(2_000)]
+        start = time.perf_counter()
+        for ticket_id in sweep_ticket_ids[:1_000]:
+            TicketAPI(repo).request_escalation(ticket_id)
+        print(f"request_escalation x1000 : {time.perf_counter() - start:.3f}s")
+        start = time.perf_counter()
+        outcomes = TicketAPI(repo).request_escalations(sweep_ticket_ids)
+        print(f"request_escalations(2000): {time.perf_counter() - start:.3f}s {Counter(o.value for o in outcomes.values())}")
+        engine.dispose()
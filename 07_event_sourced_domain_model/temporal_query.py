@@ -0,0 +1,157 @@
+from bisect import bisect_right, insort
+from datetime import datetime
+from typing import Iterable, cast
+import sys
+
+from pydantic import BaseModel
+
+from lead_events import LeadID, LeadEvent
+from projection_rebuild import LeadProjection
+from trusted_replay import replay_trusted
+
+# 何イベントごとにスナップショットを取るか
+SNAPSHOT_INTERVAL = 16
+
+
+# replay_trusted は pydantic のモデルを受け取る。LeadProjection (Protocol) のプロジェクションを BaseModel として渡す
+def _replay[P: LeadProjection](projection: P, events: Iterable[LeadEvent]) -> P:
+    return cast(P, replay_trusted(cast(BaseModel, projection), events))
+
+
+#################################################
+# History (1リード分)
+#################################################
+
+# 1リードのイベント列 ((時刻, event_id) 順) と、SNAPSHOT_INTERVAL イベントごとのスナップショット
+# NOTE: スナップショットは replay_trusted が返す新しいプロジェクションで、以後変更しない
+class LeadHistory[P: LeadProjection]:
+    def __init__(self, projection_class: type[P], snapshot_interval: int = SNAPSHOT_INTERVAL):
+        self.projection_class = projection_class
+        self.snapshot_interval = snapshot_interval
+        self.keys: list[tuple[datetime, int]] = []  # 各イベントの (時刻, event_id)
+        self.events: list[LeadEvent] = []
+        # スナップショットに含まれるイベント数 -> その時点の状態 (位置の昇順)
+        self.snapshot_positions: list[int] = [0]
+        self.snapshots: list[P] = [projection_class.empty()]
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def append(self, event: LeadEvent):
+        # NOTE: 同じ時刻のイベント (架電 -> 商談予定設定 等) は event_id の順に並べる
+        key = (event.timestamp, event.event_id)
+        position = bisect_right(self.keys, key)
+        if position < len(self.events):
+            # 遅れて届いたイベント: 挿入位置より後ろのスナップショットは作り直す
+            # NOTE: 作り直しは挿入位置から末尾までのリプレイになるので、大きく遅れたイベントほど高くつく
+            insort(self.keys, key)
+            self.events.insert(position, event)
+            keep = bisect_right(self.snapshot_positions, position)
+            del self.snapshot_positions[keep:]
+            del self.snapshots[keep:]
+        else:
+            self.keys.append(key)
+            self.events.append(event)
+        while len(self.events) - self.snapshot_positions[-1] >= self.snapshot_interval:
+            self._take_snapshot(self.snapshot_positions[-1] + self.snapshot_interval)
+
+    def _take_snapshot(self, position: int):
+        base = self.snapshot_positions[-1]
+        self.snapshots.append(_replay(self.snapshots[-1], self.events[base:position]))
+        self.snapshot_positions.append(position)
+
+    # when の時点 (when ちょうどのイベントを含む) の状態。まだイベントがなければ None
+    # NOTE: 時刻の二分探索で適用するイベント数を求め、その直前のスナップショットから高々 snapshot_interval 件だけ適用する
+    def as_of(self, when: datetime) -> P | None:
+        position = bisect_right(self.keys, (when, sys.maxsize))
+        if position == 0:
+            return None
+        index = bisect_right(self.snapshot_positions, position) - 1
+        base = self.snapshot_positions[index]
+        # NOTE: 適用するイベントがなくても replay_trusted でコピーを返し、スナップショットを呼び出し側に渡さない
+        return _replay(self.snapshots[index], self.events[base:position])
+
+
+#################################################
+# Temporal Query
+#################################################
+
+# 「日時 D の時点でのリード X の状態」を答えるインデックス
+class TemporalLeadQuery[P: LeadProjection]:
+    def __init__(self, projection_class: type[P], snapshot_interval: int = SNAPSHOT_INTERVAL):
+        self.projection_class = projection_class
+        self.snapshot_interval = snapshot_interval
+        self.histories: dict[LeadID, LeadHistory[P]] = {}
+
+    def apply(self, event: LeadEvent):
+        history = self.histories.get(event.lead_id)
+        if history is None:
+            history = self.histories[event.lead_id] = LeadHistory(self.projection_class, self.snapshot_interval)
+        history.append(event)
+
+    def extend(self, events: Iterable[LeadEvent]):
+        for event in events:
+            self.apply(event)
+
+    def as_of(self, lead_id: LeadID, when: datetime) -> P | None:
+        history = self.histories.get(lead_id)
+        return history.as_of(when) if history is not None else None
+
+
+if __name__ == "__main__":
+    # 使い方: python temporal_query.py [1リードあたりのイベント数]
+    from datetime import timedelta, timezone
+    import os
+    import random
+    import time
+
+    from event_decoder import decode_json
+    from event_sourcing import LeadStateModelProjection
+    from lead_events import ContactedEvent, FollowupSetEvent
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(f"{script_dir}/events.json", "rb") as f:
+        events = decode_json(f.read())
+
+    query = TemporalLeadQuery(LeadStateModelProjection, snapshot_interval=2)
+    query.extend(events)
+    lead_id = LeadID(value="12")
+    for when in ["2020-05-19", "2020-05-20T12:00:00Z", "2020-05-22", "2020-05-26", "2020-05-28"]:
+        state = query.as_of(lead_id, datetime.fromisoformat(when.replace("Z", "+00:00")).replace(tzinfo=timezone.utc))
+        print(when, state and (state.status.value.value, state.phone_number.value))
+        # 2020-05-19 None
+        # 2020-05-20T12:00:00Z ('new_lead', '555-2951')
+        # 2020-05-22 ('followup_set', '555-8101')
+        # 2020-05-26 ('followup_set', '555-8101')
+        # 2020-05-28 ('converted', '555-8101')
+
+    # 遅れて届いたイベントを挿入しても、全イベントを時刻順に適用した結果と一致する
+    shuffled = TemporalLeadQuery(LeadStateModelProjection, snapshot_interval=2)
+    shuffled.extend(events[::-1])
+    assert all(shuffled.as_of(lead_id, e.timestamp) == query.as_of(lead_id, e.timestamp) for e in events)
+
+    # 長い履歴を持つリード: 先頭からのリプレイと比較
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    start_on = events[0].timestamp
+    history = [events[0]] + [
+        (FollowupSetEvent if i % 2 else ContactedEvent)(lead_id=lead_id, event_id=i, timestamp=start_on + timedelta(minutes=i))
+        for i in range(1, count)
+    ]
+    query = TemporalLeadQuery(LeadStateModelProjection)
+    start = time.perf_counter()
+    query.extend(history)
+    print(f"events={count} build={time.perf_counter() - start:.3f}s snapshots={len(query.histories[lead_id].snapshots)}")
+
+    random.seed(0)
+    targets = [start_on + timedelta(minutes=random.randrange(count)) for _ in range(100)]
+
+    start = time.perf_counter()
+    naive = [replay_trusted(LeadStateModelProjection.empty(), (e for e in history if e.timestamp <= when)) for when in targets]
+    naive_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = [query.as_of(lead_id, when) for when in targets]
+    indexed_elapsed = time.perf_counter() - start
+
+    assert naive == indexed
+    print(f"as_of x{len(targets)}: replay={naive_elapsed * 1000:.1f}ms indexed={indexed_elapsed * 1000:.1f}ms ({naive_elapsed / indexed_elapsed:.0f}x)")
@@ -0,0 +1,109 @@
+from copy import copy
+from functools import singledispatchmethod
+from typing import Any, Callable, Iterable
+from pydantic import BaseModel
+
+from lead_events import LeadEvent
+
+Handler = Callable[[Any, LeadEvent], None]
+
+# プロジェクションのクラス -> (イベントのクラス -> apply のハンドラ)
+_handler_tables: dict[type[BaseModel], dict[type, Handler]] = {}
+
+
+# 検証なしで属性を書き込むための入れ物
+# NOTE: apply のハンドラは self.xxx への代入しかしないので、
+#       pydantic のモデルの代わりにこのオブジェクトを self として渡せる
+class _ReplayState:
+    pass
+
+
+def _apply_dispatcher(projection_class: type[BaseModel]):
+    apply = next(klass.__dict__["apply"] for klass in projection_class.__mro__ if "apply" in klass.__dict__)
+    assert isinstance(apply, singledispatchmethod)
+    return apply.dispatcher
+
+
+# singledispatchmethod に登録されたハンドラを イベントのクラス -> 関数 の表にする
+def handler_table(projection_class: type[BaseModel]) -> dict[type, Handler]:
+    table = _handler_tables.get(projection_class)
+    if table is None:
+        registry = _apply_dispatcher(projection_class).registry
+        table = {event_class: handler for event_class, handler in registry.items() if event_class is not object}
+        _handler_tables[projection_class] = table
+    return table
+
+
+# 表にないイベントのクラス (サブクラス等) は singledispatch と同じ規則で解決して表に追加する
+def _resolve(projection_class: type[BaseModel], table: dict[type, Handler], event_class: type) -> Handler:
+    dispatcher = _apply_dispatcher(projection_class)
+    handler = dispatcher.dispatch(event_class)
+    if handler is dispatcher.registry[object]:
+        raise TypeError("Unsupported event type")
+    table[event_class] = handler
+    return handler
+
+
+# 検証済みのイベント列を、代入時のバリデーションなしで一括適用する (信頼できるリプレイ)
+# 最終状態だけを1回バリデーションし、新しいプロジェクションとして返す
+# NOTE: 通常のコマンド処理では従来どおり projection.apply(event) を使う
+# NOTE: event_class_of はハンドラを引くためのイベントのクラスを返す (lazy_events.LazyEvent 等、LeadEvent 以外を渡す場合)
+def replay_trusted[P: BaseModel](
+    projection: P, events: Iterable[LeadEvent], event_class_of: Callable[[Any], type] = type
+) -> P:
+    projection_class = type(projection)
+    table = handler_table(projection_class)
+
+    state = _ReplayState()
+    state.__dict__.update(projection.__dict__)
+    # NOTE: PrivateAttr の dict 等は apply で破壊的に更新されるので、元のプロジェクションと共有しない
+    private = {name: copy(value) for name, value in (projection.__pydantic_private__ or {}).items()}
+    state.__dict__.update(private)
+
+    for event in events:
+        event_class = event_class_of(event)
+        handler = table.get(event_class)
+        if handler is None:
+            handler = _resolve(projection_class, table, event_class)
+        handler(state, event)
+
+    values = state.__dict__
+    result = projection_class.model_validate({name: values[name] for name in projection_class.model_fields})
+    for name in private:
+        setattr(result, name, values[name])
+    return result
+
+
+if __name__ == "__main__":
+    # 使い方: python trusted_replay.py [イベント数]
+    from itertools import cycle, islice
+    import os
+    import sys
+    import time
+
+    from event_decoder import decode_json
+    from event_sourcing import LeadStateModelProjection
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(f"{script_dir}/events.json", "rb") as f:
+        template = decode_json(f.read())
+
+    # events.json のイベント列を繰り返した合成ストリーム
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    events = list(islice(cycle(template), count))
+
+    start = time.perf_counter()
+    validated = LeadStateModelProjection.empty()
+    for e in events:
+        validated.apply(e)
+    validated_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    trusted = replay_trusted(LeadStateModelProjection.empty(), events)
+    trusted_elapsed = time.perf_counter() - start
+
+    assert validated == trusted
+    print(f"events={count}")
+    print(f"validated (singledispatch + validate_assignment): {validated_elapsed:.3f}s {count / validated_elapsed:,.0f} events/sec")
+    print(f"trusted   (handler table, validate once)        : {trusted_elapsed:.3f}s {count / trusted_elapsed:,.0f} events/sec")
+    print(f"speedup: {validated_elapsed / trusted_elapsed:.1f}x")